@@ -80,6 +80,8 @@ if not snk_distutils.is_py3k:
             'snakeoil._formatters', ['src/formatters.c'], **extra_kwargs),
         OptionalExtension(
             'snakeoil.chksum._whirlpool_cdo', ['src/whirlpool_cdo.c'], **extra_kwargs),
+        OptionalExtension(
+            'snakeoil.chksum._whirlpool_c', ['src/whirlpool.c'], **extra_kwargs),
         ]
     )
 
@@ -6,12 +6,14 @@ chksum verification/generation subsystem
 """
 
 from snakeoil import klass, compatibility
+from snakeoil.currying import partial
 from snakeoil.demandload import demandload
-demandload(globals(), "os",
-    "sys",
-    "snakeoil.chksum.defaults:chksum_loop_over_file",
-    "snakeoil.modules:load_module",
+demandload(globals(),
+    "snakeoil.chksum:defaults",
+    "snakeoil.chksum.defaults:chksum_loop_over_file,default_policy,get_path,"
+        "get_size,loop_over_file",
     "snakeoil:osutils",
+    "snakeoil.threads:threaded_map",
 )
 
 chksum_types = {}
@@ -22,15 +24,20 @@ def get_handler(requested):
     """
     get a chksum handler
 
+    Handlers are resolved on demand; only the implementations that need to
+    be tried to find an available one are imported.
+
     :raise KeyError: if chksum type has no registered handler
     :return: chksum handler (callable)
     """
 
-    if not __inited__:
-        init()
-    if requested not in chksum_types:
-        raise KeyError("no handler for %s" % requested)
-    return chksum_types[requested]
+    handler = chksum_types.get(requested)
+    if handler is None:
+        handler = defaults.resolve(requested)
+        if handler is None:
+            raise KeyError("no handler for %s" % requested)
+        chksum_types[requested] = handler
+    return handler
 
 
 def get_handlers(requested=None):
@@ -54,12 +61,48 @@ def get_handlers(requested=None):
     return d
 
 
+def get_fastest_handler(requested):
+
+    """
+    get the handler for a chksum backed by the fastest available implementation
+
+    Unlike :py:func:`get_handler`, this disregards preference order (which
+    weighs reliability) and ranks solely via the throughput metadata of
+    :py:func:`get_implementations`.
+
+    :raise KeyError: if chksum type has no available implementation
+    :return: chksum handler (callable)
+    """
+
+    handler = defaults.resolve(requested, fastest=True)
+    if handler is None:
+        raise KeyError("no handler for %s" % requested)
+    return handler
+
+
+def get_implementations(requested=None):
+
+    """
+    get metadata on the known implementations of chksums
+
+    Nothing is imported; use the `available` attribute of an implementation
+    to check if it's usable.
+
+    :param requested: None (all chksums), or the name of a specific chksum
+    :return: list of :py:class:`snakeoil.chksum.defaults.Implementation`
+        instances, in order of preference
+    """
+
+    return defaults.get_implementations(requested)
+
+
 def init(additional_handlers=None):
 
     """
     init the chksum subsystem.
 
-    Scan dirname(__file__), find what handlers are available, and load them.
+    Resolve every known chksum to a handler; this is only needed to list all
+    handlers, individual handlers are resolved on demand.
 
     :param additional_handlers: None, or pass in a dict of type:func
     """
@@ -72,24 +115,10 @@ def init(additional_handlers=None):
 
     chksum_types.clear()
     __inited__ = False
-    loc = os.path.dirname(sys.modules[__name__].__file__)
-    for f in osutils.listdir_files(loc):
-        if not f.endswith(".py") or f.startswith("__init__."):
-            continue
-        try:
-            i = f.find(".")
-            if i != -1:
-                f = f[:i]
-            del i
-            m = load_module(__name__+"."+f)
-        except ImportError:
-            continue
-        try:
-            types = getattr(m, "chksum_types")
-        except AttributeError:
-            # no go.
-            continue
-        chksum_types.update(types)
+    for chf_type in defaults.chksum_names():
+        handler = defaults.resolve(chf_type)
+        if handler is not None:
+            chksum_types[chf_type] = handler
 
     if additional_handlers is not None:
         chksum_types.update(additional_handlers)
@@ -108,6 +137,15 @@ def get_chksums(location, *chksums, **kwds):
     :param location: either a data_source, or a filepath to generate chksum data for
     :param chksums: variable arg, the name of the chksums desired.  These need to
         be valid chksums known in `chksum_types`
+    :keyword parallelize: if False, never hash via multiple threads; else
+        leave the decision to the policy
+    :keyword policy: :py:class:`snakeoil.chksum.defaults.AdaptivePolicy`
+        instance deciding how to drive the hashers; defaults to
+        :py:data:`snakeoil.chksum.defaults.default_policy`
+    :keyword cache: optional :py:class:`snakeoil.chksum.cache.ChksumCache`
+        instance to consult; only used if `location` has an ondisk path
+    :keyword read_strategy: :py:class:`snakeoil.chksum.defaults.ReadStrategy`
+        instance controlling how ondisk files are read
     :return: a list of chksums, matching the order of requested chksums
     """
 
@@ -115,16 +153,131 @@ def get_chksums(location, *chksums, **kwds):
         # dumb api invocation...
         return []
 
+    parallelize = kwds.get("parallelize", True)
+    policy = kwds.get("policy")
+    read_strategy = kwds.get("read_strategy")
+    # try to hand off to the per file handler, may be faster.  Only if
+    # the caller didn't ask for specific behaviour however.
+    shortcut = (len(chksums) == 1 and policy is None and read_strategy is None)
+    if policy is None:
+        policy = default_policy
+
+    cache = kwds.get("cache")
+    if cache is not None:
+        path = get_path(location)
+        if path is not None:
+            return cache.get_chksums(path, chksums, parallelize=parallelize,
+                policy=policy, read_strategy=read_strategy)
+
     handlers = get_handlers(chksums)
-    # try to hand off to the per file handler, may be faster.
-    if len(chksums) == 1:
+    if shortcut:
         return [handlers[chksums[0]](location)]
-    if len(chksums) == 2 and 'size' in chksums:
-        parallelize = False
-    else:
-        parallelize = kwds.get("parallelize", True)
+    strategy = policy.choose(get_size(location), chksums, parallelize)
     return chksum_loop_over_file(location, [handlers[k].new() for k in chksums],
-        parallelize=parallelize)
+        parallelize=(strategy == 'threaded'), use_mmap=(strategy != 'serial'),
+        read_strategy=read_strategy)
+
+
+def _get_chksums_pair(chksums, kwds, location):
+    return location, get_chksums(location, *chksums, **kwds)
+
+
+def get_chksums_many(locations, *chksums, **kwds):
+    """
+    run multiple chksumers over many data_sources/file paths via a thread pool
+
+    Files are hashed concurrently rather than hashing each file via multiple
+    threads; since the underlying hash implementations generally release the
+    GIL, this scales with both cores and IO parallelism.
+
+    :param locations: iterable of data_sources or filepaths; consumed lazily
+    :param chksums: variable arg, the name of the chksums desired.  These need to
+        be valid chksums known in `chksum_types`
+    :keyword workers: number of threads to use; defaults to the processor count
+    :keyword ordered: if True (the default), results are yielded in the order
+        of `locations`, else they're yielded as they complete
+    :keyword cache: see :py:func:`get_chksums`
+    :raise KeyError: if a requested chksum type has no registered handler
+    :return: iterator yielding (location, list of chksums) tuples
+    """
+    # validate- and force init- up front rather than in the workers.
+    get_handlers(chksums)
+    workers = kwds.pop("workers", None)
+    ordered = kwds.pop("ordered", True)
+    kwds["parallelize"] = False
+    return threaded_map(partial(_get_chksums_pair, chksums, kwds),
+        locations, workers=workers, ordered=ordered)
+
+
+def verify_chksums(location, expected, **kwds):
+    """
+    verify a data_source/file path against known chksums
+
+    Unlike comparing the results of :py:func:`get_chksums`, this checks the
+    size before reading anything, and reads the data only once for all
+    chksums.  If the size is known to be wrong, no hashing is done; if the
+    size is all that's expected and it's known, nothing is read at all.
+
+    :param location: either a data_source, a filepath, or a file object
+    :param expected: dict of chksum name to the expected long value, as
+        :py:func:`get_chksums` would return it
+    :keyword abort: if True (the default) and `expected` has a size, stop
+        reading as soon as more data than that has been seen
+    :keyword parallelize: see :py:func:`get_chksums`
+    :keyword policy: see :py:func:`get_chksums`
+    :keyword read_strategy: see :py:func:`get_chksums`
+    :raise KeyError: if a chksum type has no registered handler
+    :return: dict of chksum name to (expected, actual) for each chksum that
+        didn't match; empty if everything verified.  actual is None for
+        chksums that weren't computed due to a size mismatch; if reading was
+        aborted, the actual size is the number of bytes read before aborting.
+    """
+    handlers = get_handlers(expected)
+    hashes = [chf for chf in expected if chf != 'size']
+    expected_size = expected.get('size')
+    policy = kwds.get("policy")
+    if policy is None:
+        policy = default_policy
+
+    def mismatch(actual_size):
+        d = dict((chf, (expected[chf], None)) for chf in hashes)
+        d['size'] = (expected_size, actual_size)
+        return d
+
+    size = get_size(location)
+    if expected_size is not None and size is not None \
+        and size != expected_size:
+        return mismatch(size)
+    if not hashes and (size is not None or expected_size is None):
+        # nothing left that needs the data read.
+        return {}
+
+    chfs = [handlers[chf].new()() for chf in hashes]
+    callbacks = [chf.update for chf in chfs]
+    counter = None
+    if expected_size is not None:
+        counter = handlers['size'].new()()
+        callbacks.append(counter.update)
+    max_size = None
+    if kwds.get("abort", True):
+        max_size = expected_size
+    strategy = policy.choose(size, hashes, kwds.get("parallelize", True))
+    try:
+        loop_over_file(location, callbacks,
+            parallelize=(strategy == 'threaded'),
+            use_mmap=(strategy != 'serial'), max_size=max_size,
+            read_strategy=kwds.get("read_strategy"))
+    except defaults.SizeLimitExceeded, e:
+        return mismatch(e.count)
+
+    results = {}
+    if counter is not None and counter.count != expected_size:
+        results['size'] = (expected_size, counter.count)
+    for chf_type, chf in zip(hashes, chfs):
+        val = long(chf.hexdigest(), 16)
+        if val != expected[chf_type]:
+            results[chf_type] = (expected[chf_type], val)
+    return results
 
 
 class LazilyHashedPath(object):
@@ -133,9 +286,16 @@ class LazilyHashedPath(object):
 
     __metaclass__ = klass.immutable_instance
 
-    def __init__(self, path, **initial_values):
+    def __init__(self, path, cache=None, **initial_values):
+        """
+        :param path: ondisk location to hash
+        :param cache: optional :py:class:`snakeoil.chksum.cache.ChksumCache`
+            to consult before hashing
+        :param initial_values: already known chksums, passed as attr=value
+        """
         f = object.__setattr__
         f(self, 'path', path)
+        f(self, '_cache', cache)
         for attr, val in initial_values.iteritems():
             f(self, attr, val)
 
@@ -147,7 +307,7 @@ class LazilyHashedPath(object):
             val = osutils.stat_mtime_long(self.path)
         else:
             try:
-                val = get_chksums(self.path, attr)[0]
+                val = get_chksums(self.path, attr, cache=self._cache)[0]
             except KeyError:
                 compatibility.raise_from(AttributeError(attr))
         object.__setattr__(self, attr, val)
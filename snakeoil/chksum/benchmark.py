@@ -0,0 +1,495 @@
+# License: GPL2/BSD
+
+"""
+chksum benchmark suite
+
+Run via ``python -m snakeoil.chksum.benchmark``; see ``--help`` for options.
+Results are printed as tables, or written as JSON via ``--json`` for
+tracking regressions between releases.
+
+The suites are:
+
+* ``handlers``: raw throughput of every available implementation of every
+  chksum; see :py:func:`snakeoil.chksum.get_implementations`.
+* ``get_chksums``: :py:func:`snakeoil.chksum.get_chksums` with 1-6 chksums,
+  for each strategy :py:class:`snakeoil.chksum.defaults.AdaptivePolicy`
+  can choose- serial reads, mmap, and threaded.
+* ``small_files``: many small files, via both get_chksums and
+  get_chksums_many.
+* ``fanout``: strategies for feeding a stream through multiple hashers-
+  serially, via :py:class:`snakeoil.chksum.defaults.BlockFanOut`, and via
+  the queue-per-hasher threading model it replaced (kept here purely as a
+  reference point).
+* ``io``: reading files of various sizes via different
+  :py:class:`snakeoil.chksum.defaults.ReadStrategy` settings.
+"""
+
+__all__ = ("legacy_threaded_loop", "bench_handlers", "bench_get_chksums",
+    "bench_small_files", "bench_fanout", "bench_io", "run", "main")
+
+import os
+import re
+import sys
+import threading
+import time
+import Queue
+
+from snakeoil.version import __version__
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'hashlib',
+    'json',
+    'optparse',
+    'platform',
+    'shutil',
+    'tempfile',
+    'snakeoil:chksum',
+    'snakeoil.chksum:defaults',
+    'snakeoil:osutils',
+    'snakeoil.process:get_proc_count',
+)
+
+fanout_hashes = ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512')
+
+
+def _queue_thread(queue, callback):
+    qget = queue.get
+    data = qget()
+    while data is not None:
+        callback(data)
+        data = qget()
+
+
+def legacy_threaded_loop(handle, callbacks):
+    """
+    the pre BlockFanOut threading model: one thread and queue per hasher
+
+    Each block is read into a fresh string and put to every queue.
+    """
+    queues = [Queue.Queue(8) for x in callbacks]
+    threads = [threading.Thread(target=_queue_thread, args=(queue, functor))
+        for queue, functor in zip(queues, callbacks)]
+    for thread in threads:
+        thread.start()
+    try:
+        data = handle.read(defaults.blocksize)
+        while data:
+            for queue in queues:
+                queue.put(data)
+            data = handle.read(defaults.blocksize)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _fanout_loop(handle, callbacks):
+    fanout = defaults.BlockFanOut(callbacks)
+    try:
+        fanout.feed(handle)
+    finally:
+        fanout.finish()
+
+
+def _serial_loop(handle, callbacks):
+    defaults.loop_over_file(handle, callbacks, parallelize=False)
+
+
+fanout_modes = (
+    ('serial', _serial_loop),
+    ('threaded', legacy_threaded_loop),
+    ('fanout', _fanout_loop),
+)
+
+
+def mk_datafile(size, directory=None):
+    """
+    create a temporary file of random content
+
+    :param size: size in bytes
+    :return: path to the file; the caller is responsible for removing it
+    """
+    fd, path = tempfile.mkstemp(dir=directory, prefix='snakeoil-bench-')
+    try:
+        chunk = os.urandom(min(size, 1 << 20))
+        while size > 0:
+            size -= os.write(fd, chunk[:size])
+    finally:
+        os.close(fd)
+    return path
+
+
+def best_of(functor, repeat=3):
+    """
+    invoke functor `repeat` times, returning the fastest wall time
+    """
+    best = None
+    for x in xrange(repeat):
+        start = time.time()
+        functor()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _mb_per_sec(size, elapsed):
+    return (size / float(1 << 20)) / max(elapsed, 1e-9)
+
+
+def _time_mode(path, loop, hashes):
+    chfs = [getattr(hashlib, x)() for x in hashes]
+    f = open(path, 'rb')
+    try:
+        loop(f, [chf.update for chf in chfs])
+    finally:
+        f.close()
+
+
+def bench_fanout(path, counts=(1, 2, 4, 6), repeat=3):
+    """
+    time each fanout mode against `path` for the given hasher counts
+
+    :param path: file to hash; it's streamed, not mmap'd
+    :param counts: number of hashers to run for each measurement
+    :return: list of dicts, one per (mode, hasher count)
+    """
+    size = os.stat(path).st_size
+    results = []
+    for count in counts:
+        hashes = fanout_hashes[:count]
+        for mode, loop in fanout_modes:
+            elapsed = best_of(lambda: _time_mode(path, loop, hashes), repeat)
+            results.append({'mode': mode, 'hashers': count,
+                'seconds': elapsed, 'mb_per_sec': _mb_per_sec(size, elapsed)})
+    return results
+
+
+def bench_handlers(chf_types=None, size=(4 << 20), python_size=(64 << 10),
+    repeat=3):
+    """
+    measure the throughput of every available chksum implementation
+
+    :param chf_types: sequence of chksums to measure; defaults to all
+    :param size: bytes to hash per measurement
+    :param python_size: bytes to hash for non native implementations; the
+        pure python whirlpool is slow enough that the full `size` isn't
+        worth waiting on
+    :return: list of dicts, one per implementation found
+    """
+    results = []
+    for impl in defaults.get_implementations():
+        if impl.chf_type == 'size' or \
+            (chf_types is not None and impl.chf_type not in chf_types):
+            continue
+        handler = impl.load()
+        if handler is None:
+            continue
+        factory = handler.new()
+        length = size
+        if not impl.native:
+            length = min(size, python_size)
+        data = os.urandom(min(length, defaults.blocksize))
+        count = max(length // len(data), 1)
+        def f():
+            chf = factory()
+            for x in xrange(count):
+                chf.update(data)
+            chf.digest()
+        elapsed = best_of(f, repeat)
+        results.append({'chksum': impl.chf_type, 'backend': impl.backend,
+            'bytes': count * len(data), 'seconds': elapsed,
+            'mb_per_sec': _mb_per_sec(count * len(data), elapsed)})
+    return results
+
+
+class _FixedPolicy(object):
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+
+    def choose(self, size, chksums, parallelize=True):
+        return self.strategy
+
+
+def benchmark_chksums(limit=6):
+    """
+    :return: up to `limit` available chksum names, fastest first
+    """
+    names = [x for x in defaults.chksum_names() if x != 'size'
+        and defaults.resolve(x) is not None]
+    names.sort(key=lambda x: defaults.resolve(x).implementation.throughput,
+        reverse=True)
+    return names[:limit]
+
+
+def bench_get_chksums(path, counts=(1, 2, 3, 4, 5, 6), repeat=3):
+    """
+    time get_chksums against `path` for each strategy and chksum count
+
+    :param counts: number of chksums to request per measurement; counts
+        exceeding the number of available chksums are skipped
+    :return: list of dicts, one per (strategy, chksum count)
+    """
+    size = os.stat(path).st_size
+    available = benchmark_chksums()
+    results = []
+    for count in counts:
+        if count > len(available):
+            continue
+        hashes = available[:count]
+        for strategy in defaults.AdaptivePolicy.strategies:
+            policy = _FixedPolicy(strategy)
+            elapsed = best_of(
+                lambda: chksum.get_chksums(path, *hashes, **{'policy': policy}),
+                repeat)
+            results.append({'strategy': strategy, 'chksums': count,
+                'names': hashes, 'seconds': elapsed,
+                'mb_per_sec': _mb_per_sec(size, elapsed)})
+    return results
+
+
+def bench_small_files(directory, count=2000, size=4096, repeat=3,
+    hashes=('sha1', 'sha256', 'size')):
+    """
+    time hashing many small files
+
+    :param directory: directory to create the files in
+    :param count: number of files
+    :param size: size of each file
+    :return: list of dicts, one per mode
+    """
+    paths = []
+    data = os.urandom(size)
+    for x in xrange(count):
+        path = os.path.join(directory, 'small-%i' % x)
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        paths.append(path)
+
+    modes = (
+        ('get_chksums', lambda: [chksum.get_chksums(x, *hashes)
+            for x in paths]),
+        ('get_chksums_many', lambda: list(chksum.get_chksums_many(paths,
+            *hashes))),
+    )
+    results = []
+    try:
+        for mode, functor in modes:
+            elapsed = best_of(functor, repeat)
+            results.append({'mode': mode, 'files': count, 'size': size,
+                'seconds': elapsed,
+                'files_per_sec': count / max(elapsed, 1e-9),
+                'mb_per_sec': _mb_per_sec(count * size, elapsed)})
+    finally:
+        for path in paths:
+            os.unlink(path)
+    return results
+
+
+io_modes = (
+    ('mmap', True, {}),
+    ('mmap+willneed', True, {'willneed': True}),
+    ('read-64k', False, {'blocksize': 64 << 10, 'sequential': False}),
+    ('read-128k', False, {'blocksize': 128 << 10, 'sequential': False}),
+    ('read-128k+seq', False, {'blocksize': 128 << 10}),
+    ('read-1m+seq', False, {'blocksize': 1 << 20}),
+    ('read-4m+seq', False, {'blocksize': 4 << 20}),
+)
+
+
+def evict(path):
+    """
+    drop a file from the page cache, if fadvise is supported
+
+    :return: True if the advice was issued
+    """
+    if not osutils.fadvise_supported:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        osutils.fadvise(fd, 0, 0, osutils.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def bench_io(paths, repeat=3, cold=False, hashes=('md5',)):
+    """
+    time hashing files via each of the :py:data:`io_modes`
+
+    :param paths: files to hash
+    :param cold: if True, evict each file from the page cache prior to
+        each run; this requires fadvise support, and that nothing else
+        holds the file's pages
+    :param hashes: chksums to compute
+    :return: list of dicts, one per (path, mode)
+    """
+    results = []
+    chfs = [getattr(hashlib, x) for x in hashes]
+    for path in paths:
+        size = os.stat(path).st_size
+        for mode, use_mmap, kwds in io_modes:
+            strategy = defaults.ReadStrategy(**kwds)
+            def f():
+                defaults.chksum_loop_over_file(path, chfs, parallelize=False,
+                    use_mmap=use_mmap, read_strategy=strategy)
+            def run():
+                if cold:
+                    evict(path)
+                start = time.time()
+                f()
+                return time.time() - start
+            elapsed = min(run() for x in xrange(repeat))
+            results.append({'mode': mode, 'size': size, 'cold': cold,
+                'seconds': elapsed, 'mb_per_sec': _mb_per_sec(size, elapsed)})
+    return results
+
+
+# suite name, and the columns to display for it: (key, header, format).
+suites = (
+    ('handlers', (('chksum', 'chksum', '%-10s'), ('backend', 'backend', '%-9s'),
+        ('mb_per_sec', 'MiB/s', '%10.1f'))),
+    ('get_chksums', (('strategy', 'strategy', '%-9s'),
+        ('chksums', 'chksums', '%7i'), ('seconds', 'seconds', '%9.3f'),
+        ('mb_per_sec', 'MiB/s', '%10.1f'))),
+    ('small_files', (('mode', 'mode', '%-17s'), ('files', 'files', '%6i'),
+        ('seconds', 'seconds', '%9.3f'),
+        ('files_per_sec', 'files/s', '%10.1f'))),
+    ('fanout', (('mode', 'mode', '%-9s'), ('hashers', 'hashers', '%7i'),
+        ('seconds', 'seconds', '%9.3f'), ('mb_per_sec', 'MiB/s', '%10.1f'))),
+    ('io', (('mode', 'mode', '%-14s'), ('size', 'bytes', '%10i'),
+        ('seconds', 'seconds', '%9.3f'), ('mb_per_sec', 'MiB/s', '%10.1f'))),
+)
+
+
+def _header_fmt(fmt):
+    # '%9.3f' -> '%9s'; headers share the width of their column.
+    return "%%%ss" % (re.match(r"%(-?\d*)", fmt).group(1),)
+
+
+def environment():
+    """
+    :return: dict describing the machine and software benchmarked
+    """
+    return {
+        'snakeoil': __version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processors': get_proc_count(),
+        'fadvise': osutils.fadvise_supported,
+        'implementations': dict((x, defaults.resolve(x).implementation.backend)
+            for x in benchmark_chksums(None)),
+        'time': time.time(),
+    }
+
+
+def run(names=None, size=(64 << 20), io_sizes=((1 << 20), (16 << 20),
+    (64 << 20)), repeat=3, directory=None, cold=False):
+    """
+    run benchmark suites
+
+    :param names: sequence of suite names to run; defaults to all
+    :param size: size of the file used for the throughput suites
+    :param io_sizes: file sizes to use for the io suite
+    :param directory: directory to create temporary files in
+    :param cold: see :py:func:`bench_io`
+    :return: dict of suite name to list of result dicts
+    """
+    if names is None:
+        names = [x[0] for x in suites]
+    unknown = set(names).difference(x[0] for x in suites)
+    if unknown:
+        raise ValueError("unknown suites: %s" % ", ".join(sorted(unknown)))
+
+    workdir = tempfile.mkdtemp(dir=directory, prefix='snakeoil-bench-')
+    try:
+        results = {}
+        path = None
+        if 'get_chksums' in names or 'fanout' in names:
+            path = mk_datafile(size, workdir)
+        if 'handlers' in names:
+            results['handlers'] = bench_handlers(repeat=repeat)
+        if 'get_chksums' in names:
+            results['get_chksums'] = bench_get_chksums(path, repeat=repeat)
+        if 'small_files' in names:
+            results['small_files'] = bench_small_files(workdir,
+                repeat=repeat)
+        if 'fanout' in names:
+            results['fanout'] = bench_fanout(path, repeat=repeat)
+        if 'io' in names:
+            paths = [mk_datafile(x, workdir) for x in io_sizes]
+            results['io'] = bench_io(paths, repeat=repeat, cold=cold)
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None, out=None):
+    if out is None:
+        out = sys.stdout
+    parser = optparse.OptionParser(
+        description="benchmark the snakeoil.chksum subsystem")
+    parser.add_option("--suites", default=None,
+        help="comma separated suites to run, out of %s; defaults to all"
+        % ", ".join(x[0] for x in suites))
+    parser.add_option("--size", type="int", default=64,
+        help="size of the test file in MiB; defaults to %default")
+    parser.add_option("--io-sizes", default="1,16,64",
+        help="comma separated file sizes in MiB for the io suite; "
+        "defaults to %default")
+    parser.add_option("--repeat", type="int", default=3,
+        help="take the best of this many runs; defaults to %default")
+    parser.add_option("--dir", default=None,
+        help="directory to create test files in")
+    parser.add_option("--cold", action="store_true", default=False,
+        help="evict files from the page cache before each io run")
+    parser.add_option("--json", default=None, metavar="PATH",
+        help="write results as JSON to PATH ('-' for stdout) rather than "
+        "printing tables")
+    options, args = parser.parse_args(argv)
+
+    names = None
+    if options.suites is not None:
+        names = [x.strip() for x in options.suites.split(",") if x.strip()]
+    try:
+        results = run(names, size=(options.size << 20),
+            io_sizes=[int(x) << 20 for x in options.io_sizes.split(",")],
+            repeat=options.repeat, directory=options.dir, cold=options.cold)
+    except ValueError, e:
+        parser.error(str(e))
+
+    if options.json is not None:
+        data = {'format': 1, 'environment': environment(), 'results': results}
+        if options.json == '-':
+            json.dump(data, out, indent=2, sort_keys=True)
+            out.write("\n")
+        else:
+            f = open(options.json, 'w')
+            try:
+                json.dump(data, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+        return 0
+
+    for name, columns in suites:
+        if name not in results:
+            continue
+        out.write("%s:\n" % (name,))
+        out.write(" ".join(_header_fmt(fmt) % (header,)
+            for key, header, fmt in columns).rstrip() + "\n")
+        for result in results[name]:
+            out.write(" ".join(fmt % (result[key],)
+                for key, header, fmt in columns).rstrip() + "\n")
+        out.write("\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
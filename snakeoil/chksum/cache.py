@@ -0,0 +1,306 @@
+# License: GPL2/BSD
+
+"""
+persistent chksum cache keyed by stat identity
+
+Rehashing unchanged files is the dominant cost of bulk verification; a
+:py:class:`ChksumCache` instance remembers digests computed for a given
+``(st_dev, st_ino)`` and hands them back as long as the file's size and
+nanosecond mtime still match what fstat reports.  Files modified within
+:py:data:`racy_window` seconds of being hashed aren't cached; a further write
+in the same mtime tick would go unnoticed.
+
+Usage is opt in; pass the cache to :py:func:`snakeoil.chksum.get_chksums`
+or :py:class:`snakeoil.chksum.LazilyHashedPath`:
+
+>>> from snakeoil.chksum import get_chksums
+>>> from snakeoil.chksum.cache import ChksumCache
+>>> cache = ChksumCache("/var/cache/chksums")     # doctest: +SKIP
+>>> get_chksums("/etc/passwd", "sha1", "md5", cache=cache)    # doctest: +SKIP
+>>> cache.flush()                                 # doctest: +SKIP
+
+The ondisk format is plain text, one file per line.  Writers serialize via an
+:py:class:`snakeoil.osutils.FsLock` on ``path + '.lock'`` and merge whatever
+other processes flushed in the meantime; the cache itself is replaced via
+:py:class:`snakeoil.fileutils.AtomicWriteFile`, so readers never need a lock.
+"""
+
+__all__ = ("ChksumCache",)
+
+import os
+import threading
+import time
+
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'errno',
+    'snakeoil:chksum',
+    'snakeoil.chksum.defaults:chksum_loop_over_file,default_policy',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.osutils:FsLock,ensure_dirs',
+)
+
+_header = "# snakeoil chksum cache v1"
+
+# mtime granularity is filesystem dependent (FAT's is two seconds), and py2k
+# only has a float mtime; entries modified this close to being hashed can't
+# be told apart from a later write, so they're left uncached.
+racy_window = 2
+
+
+def stat_key(st):
+    """
+    split a stat result into the cache key, and the values that must match
+
+    :return: ((st_dev, st_ino), (st_size, mtime_ns))
+    """
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # py2k lacks st_mtime_ns; the float is stable for a given stat
+        # however, which is all we need for an identity check.
+        mtime_ns = long(st.st_mtime * 1000000000)
+    return (st.st_dev, st.st_ino), (st.st_size, mtime_ns)
+
+
+class ChksumCache(object):
+
+    """
+    stat keyed chksum cache, optionally persisted to disk
+
+    :ivar hits: number of digests served from the cache
+    :ivar misses: number of digests that had to be computed
+    :ivar evictions: number of entries dropped due to `max_entries`
+    """
+
+    def __init__(self, path=None, max_entries=100000):
+        """
+        :param path: ondisk location of the cache; if None, the cache is
+            purely in memory
+        :param max_entries: maximum number of files tracked; once exceeded
+            the least recently used entries are evicted
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive, got %r"
+                % (max_entries,))
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = self.misses = self.evictions = 0
+        self._entries = None
+        self._dirty = False
+        self._last_stamp = 0.0
+        # guards all mutation; instances are shared across the threads
+        # get_chksums_many uses.
+        self._lock = threading.RLock()
+
+    def _stamp(self):
+        # strictly increasing, so LRU ordering is stable even when the
+        # clock granularity is coarser than our lookup rate.
+        self._last_stamp = max(time.time(), self._last_stamp + 0.000001)
+        return self._last_stamp
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = self._read_disk()
+        return self._entries
+
+    def _read_disk(self):
+        entries = {}
+        if self.path is None:
+            return entries
+        try:
+            f = open(self.path, 'r')
+        except IOError, ie:
+            if ie.errno != errno.ENOENT:
+                raise
+            return entries
+        try:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                try:
+                    entry = line.split()
+                    key = (int(entry[0]), int(entry[1]))
+                    ident = (int(entry[2]), int(entry[3]))
+                    stamp = float(entry[4])
+                    digests = dict((chf, long(val, 16)) for chf, val in
+                        (x.split('=', 1) for x in entry[5:]))
+                except (IndexError, ValueError):
+                    # corrupted or truncated line; drop it.
+                    continue
+                entries[key] = [ident, stamp, digests]
+        finally:
+            f.close()
+        return entries
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return len(self._get_entries())
+        finally:
+            self._lock.release()
+
+    def lookup(self, st, chksums):
+        """
+        return the cached digests for a stat result
+
+        :param st: stat result of the file
+        :param chksums: sequence of chksum names desired
+        :return: dict of chksum name to long for the chksums available;
+            empty if nothing valid is cached
+        """
+        key, ident = stat_key(st)
+        self._lock.acquire()
+        try:
+            entry = self._get_entries().get(key)
+            if entry is None:
+                return {}
+            if entry[0] != ident:
+                # the inode was modified (or reused); that data is worthless.
+                del self._entries[key]
+                self._dirty = True
+                return {}
+            entry[1] = self._stamp()
+            digests = entry[2]
+            return dict((chf, digests[chf]) for chf in chksums
+                if chf in digests)
+        finally:
+            self._lock.release()
+
+    def update(self, st, digests, hashed_at=None):
+        """
+        record digests for the file described by `st`
+
+        Ignored if the file was modified within :py:data:`racy_window`
+        seconds of `hashed_at`.
+
+        :param st: stat result the digests were computed against
+        :param digests: dict of chksum name to long
+        :param hashed_at: time the file's content started being read;
+            defaults to now
+        """
+        key, ident = stat_key(st)
+        if hashed_at is None:
+            hashed_at = time.time()
+        if ident[1] >= long((hashed_at - racy_window) * 1000000000):
+            return
+        self._lock.acquire()
+        try:
+            entries = self._get_entries()
+            entry = entries.get(key)
+            if entry is None or entry[0] != ident:
+                entries[key] = [ident, self._stamp(), dict(digests)]
+            else:
+                entry[1] = self._stamp()
+                entry[2].update(digests)
+            self._dirty = True
+            if len(entries) > self.max_entries:
+                self._evict(entries)
+        finally:
+            self._lock.release()
+
+    def _evict(self, entries):
+        # evict down to 90% so that we're not sorting the whole cache on
+        # every insertion once it's full.
+        target = max(self.max_entries - (self.max_entries // 10), 1)
+        if len(entries) <= target:
+            return
+        victims = sorted(entries.iteritems(), key=lambda x: x[1][1])
+        victims = victims[:len(entries) - target]
+        for key, _val in victims:
+            del entries[key]
+        self.evictions += len(victims)
+
+    def get_chksums(self, path, chksums, parallelize=True, policy=None,
+        read_strategy=None):
+        """
+        cache aware version of :py:func:`snakeoil.chksum.get_chksums`
+
+        :param path: ondisk file to generate chksums for
+        :param chksums: sequence of chksum names desired
+        :param parallelize: see :py:func:`snakeoil.chksum.get_chksums`
+        :param policy: see :py:func:`snakeoil.chksum.get_chksums`
+        :param read_strategy: see :py:func:`snakeoil.chksum.get_chksums`
+        :return: a list of chksums, matching the order of requested chksums
+        """
+        hashed_at = time.time()
+        f = open(path, 'rb')
+        try:
+            st = os.fstat(f.fileno())
+            known = self.lookup(st, chksums)
+            missing = [chf for chf in chksums if chf not in known]
+            self._lock.acquire()
+            self.hits += len(chksums) - len(missing)
+            self.misses += len(missing)
+            self._lock.release()
+            if missing:
+                if policy is None:
+                    policy = default_policy
+                strategy = policy.choose(st.st_size, missing, parallelize)
+                handlers = chksum.get_handlers(missing)
+                vals = chksum_loop_over_file(f,
+                    [handlers[chf].new() for chf in missing],
+                    parallelize=(strategy == 'threaded'),
+                    read_strategy=read_strategy)
+                vals = dict(zip(missing, vals))
+                known.update(vals)
+                # only trust the result if nothing changed under us.
+                if stat_key(os.fstat(f.fileno())) == stat_key(st):
+                    self.update(st, vals, hashed_at)
+        finally:
+            f.close()
+        return [known[chf] for chf in chksums]
+
+    def flush(self):
+        """
+        write the cache to disk, merging in changes from other processes
+
+        Does nothing if the cache is memory only, or unmodified.
+        """
+        self._lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self._lock.release()
+
+    def _flush(self):
+        if self.path is None or not self._dirty:
+            return
+        ensure_dirs(os.path.dirname(os.path.abspath(self.path)))
+        lock = FsLock(self.path + '.lock', create=True)
+        lock.acquire_write_lock()
+        try:
+            entries = self._read_disk()
+            for key, ours in self._entries.iteritems():
+                theirs = entries.get(key)
+                if theirs is None or theirs[0] != ours[0]:
+                    if theirs is None or theirs[1] <= ours[1]:
+                        entries[key] = ours
+                    continue
+                theirs[2].update(ours[2])
+                theirs[1] = max(theirs[1], ours[1])
+            if len(entries) > self.max_entries:
+                self._evict(entries)
+            self._write_disk(entries)
+            self._entries = entries
+            self._dirty = False
+        finally:
+            lock.release_write_lock()
+
+    def _write_disk(self, entries):
+        f = AtomicWriteFile(self.path)
+        try:
+            f.write(_header + "\n")
+            for (dev, ino), ((size, mtime), stamp, digests) in \
+                entries.iteritems():
+                f.write("%i %i %i %i %.6f %s\n" % (dev, ino, size, mtime, stamp,
+                    " ".join("%s=%x" % x for x in sorted(digests.iteritems()))))
+        except:
+            f.discard()
+            raise
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
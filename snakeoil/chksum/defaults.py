@@ -8,23 +8,33 @@ default chksum implementation- sha1, sha256, rmd160, and md5
 Specifically designed to provide maximal compatibility for >=python2.4
 for chksum implementations, while also preferring the fastest implementation
 available.
+
+Each chksum may be provided by multiple libraries; these are listed in
+:py:data:`implementations` along with metadata about them, and are only
+imported when a chksum is requested.
 """
 
+import sys
 import threading
-import Queue
+import time
 
+from snakeoil import data_source
 from snakeoil.data_source import base as base_data_source
 from snakeoil.currying import partial
 from snakeoil import modules
+from snakeoil import compatibility
 from snakeoil.compatibility import intern, is_py3k
 from snakeoil.demandload import demandload
 demandload(globals(),
     'os',
     'snakeoil.process:get_proc_count',
+    'snakeoil:osutils',
     'snakeoil.fileutils:mmap_or_open_for_read',
 )
 
 blocksize = 2 ** 17
+# how many blocks may be in flight between the reader and the hashers
+fanout_buffers = 4
 
 sha1_size = 40
 md5_size = 32
@@ -33,29 +43,401 @@ sha256_size = 64
 sha512_size = 128
 whirlpool_size = 128
 
+# py2.6 lacks memoryview; without it, we can't hand out slices of a
+# recycled buffer, thus fall back to plain reads.
+try:
+    _memoryview = memoryview
+except NameError:
+    _memoryview = None
+
+
+class BlockFanOut(object):
+
+    """
+    Hand each block read to every hasher thread without copying it.
+
+    Blocks are read once into a small pool of recycled buffers; every
+    consumer thread walks the same sequence of blocks, and the last
+    consumer to finish with a block returns its buffer to the pool.
+    Publishing a block is a single notify to all consumers, rather than
+    a queue put per consumer.
+
+    Consumers must not retain the data handed to them past their
+    callback returning- hash objects don't.
+    """
+
+    def __init__(self, callbacks, buffers=None, size=None):
+        """
+        :param callbacks: sequence of callables, each invoked with every block
+        :param buffers: number of buffers to recycle; defaults to
+            :py:data:`fanout_buffers`
+        :param size: size of each buffer; defaults to :py:data:`blocksize`
+        """
+        if buffers is None:
+            buffers = fanout_buffers
+        if size is None:
+            size = blocksize
+        self.size = size
+        self.buffers = max(buffers, 1)
+        lock = threading.Lock()
+        self._ready = threading.Condition(lock)
+        self._space = threading.Condition(lock)
+        self._blocks = {}
+        self._published = 0
+        self._finished = False
+        self._error = None
+        self._free = []
+        if _memoryview is not None:
+            self._free = [bytearray(size) for x in xrange(self.buffers)]
+        self._consumers = len(callbacks)
+        self._threads = [threading.Thread(target=self._consume, args=(x,))
+            for x in callbacks]
+        for thread in self._threads:
+            thread.start()
+
+    def _consume(self, callback):
+        ready, blocks = self._ready, self._blocks
+        seq = 0
+        while True:
+            ready.acquire()
+            try:
+                while seq == self._published and not self._finished:
+                    ready.wait()
+                if seq == self._published:
+                    return
+                block = blocks[seq]
+            finally:
+                ready.release()
+
+            if callback is not None:
+                try:
+                    callback(block[0])
+                except Exception:
+                    # keep consuming so the reader doesn't stall waiting
+                    # on our buffers; it'll reraise this once we're done.
+                    self._error = sys.exc_info()
+                    callback = None
+
+            ready.acquire()
+            try:
+                block[1] -= 1
+                if not block[1]:
+                    del blocks[seq]
+                    if block[2] is not None:
+                        self._free.append(block[2])
+                    self._space.notify()
+            finally:
+                ready.release()
+            seq += 1
+
+    def publish(self, data, buf=None):
+        """
+        make a block available to all consumers
+
+        If `buf` isn't given, this blocks while `buffers` blocks are already
+        awaiting consumption, so that feeding a stream of chunks from a
+        source we don't control stays bounded in memory.
+
+        :param data: the data to hand to each consumer
+        :param buf: if given, the pooled buffer backing `data`; it's recycled
+            once every consumer has processed `data`
+        """
+        self._ready.acquire()
+        try:
+            if buf is None:
+                while len(self._blocks) >= self.buffers:
+                    self._space.wait()
+            self._blocks[self._published] = [data, self._consumers, buf]
+            self._published += 1
+            self._ready.notifyAll()
+        finally:
+            self._ready.release()
+
+    def _get_buffer(self):
+        self._space.acquire()
+        try:
+            while not self._free:
+                self._space.wait()
+            return self._free.pop()
+        finally:
+            self._space.release()
+
+    def feed(self, handle):
+        """
+        read `handle` to EOF, publishing each block to the consumers
+        """
+        readinto = getattr(handle, 'readinto', None)
+        if readinto is None or _memoryview is None:
+            data = handle.read(self.size)
+            while data:
+                self.publish(data)
+                data = handle.read(self.size)
+            return
+
+        while True:
+            buf = self._get_buffer()
+            count = readinto(buf)
+            if not count:
+                self._free.append(buf)
+                break
+            self.publish(_memoryview(buf)[:count], buf)
+
+    def finish(self):
+        """
+        wait for all consumers to process everything published
+
+        :raise: the first exception any consumer threw
+        """
+        self._ready.acquire()
+        try:
+            self._finished = True
+            self._ready.notifyAll()
+        finally:
+            self._ready.release()
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+
+class SizeLimitExceeded(Exception):
+
+    """
+    thrown by :py:func:`loop_over_file` once more than max_size bytes are seen
+
+    :ivar count: number of bytes seen when the limit was exceeded
+    """
+
+    def __init__(self, count, limit):
+        Exception.__init__(self, "read %i bytes, exceeding the limit of %i"
+            % (count, limit))
+        self.count = count
+        self.limit = limit
+
+
+class _SizeLimiter(object):
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+
+    def add(self, count):
+        self.count += count
+        if self.count > self.limit:
+            raise SizeLimitExceeded(self.count, self.limit)
 
-def chf_thread(queue, callback):
-    qget = queue.get
-    data = qget()
-    while data is not None:
-        callback(data)
-        data = qget()
+    def update(self, data):
+        self.add(len(data))
+
+
+class _LimitedReader(object):
+
+    """file object wrapper feeding the amount read to a _SizeLimiter"""
+
+    def __init__(self, handle, limiter):
+        self._handle = handle
+        self._limiter = limiter
+        if getattr(handle, 'readinto', None) is not None:
+            self.readinto = self._readinto
+
+    def read(self, size=-1):
+        data = self._handle.read(size)
+        self._limiter.add(len(data))
+        return data
+
+    def _readinto(self, buf):
+        count = self._handle.readinto(buf)
+        self._limiter.add(count or 0)
+        return count
 
 
-def chksum_loop_over_file(filename, chfs, parallelize=True):
+def chksum_loop_over_file(filename, chfs, parallelize=True, use_mmap=True,
+    read_strategy=None):
     chfs = [chf() for chf in chfs]
-    loop_over_file(filename, [chf.update for chf in chfs], parallelize=parallelize)
+    loop_over_file(filename, [chf.update for chf in chfs],
+        parallelize=parallelize, use_mmap=use_mmap,
+        read_strategy=read_strategy)
     return [long(chf.hexdigest(), 16) for chf in chfs]
 
 
-def loop_over_file(handle, callbacks, parallelize=True):
-    m = None
+def _serial_feed(handle, callbacks, size=None):
+    if size is None:
+        size = blocksize
+    readinto = getattr(handle, 'readinto', None)
+    if readinto is None or _memoryview is None:
+        data = handle.read(size)
+        while data:
+            for callback in callbacks:
+                callback(data)
+            data = handle.read(size)
+        return
+
+    buf = bytearray(size)
+    view = _memoryview(buf)
+    count = readinto(buf)
+    while count:
+        data = view[:count]
+        for callback in callbacks:
+            callback(data)
+        count = readinto(buf)
+
+
+def get_path(location):
+    """
+    get the ondisk path holding the raw content of a chksum target
+
+    :param location: filepath, data_source, file object, etc
+    :return: the path, or None if the content isn't directly ondisk
+    """
+    if isinstance(location, basestring):
+        return location
+    if isinstance(location, data_source.compressed_source):
+        # its path is the compressed form.
+        return None
+    if isinstance(location, base_data_source):
+        return location.path
+    return None
+
+
+def _as_buffer(obj):
+    # return a bytes level view of obj if it supports the buffer protocol,
+    # else None.
+    if _memoryview is not None:
+        try:
+            return _memoryview(obj)
+        except TypeError:
+            pass
+    try:
+        # py2k objects only supporting the old buffer protocol; mmap, array.
+        return buffer(obj)
+    except (NameError, TypeError):
+        return None
+
+
+def _in_memory(location):
+    # whether a data_source's content is held in memory, thus cheap to size.
+    return isinstance(location, data_source.data_source) and not \
+        isinstance(location, data_source.invokable_data_source)
+
+
+def _get_fd(handle):
+    try:
+        return handle.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+
+class ReadStrategy(object):
+
+    """
+    how ondisk files are read for hashing
+
+    Controls the read size, and the kernel hints (posix_fadvise) issued
+    around reading; see :py:func:`snakeoil.osutils.fadvise`.  If fadvise
+    isn't supported, the hints are silently skipped.
+
+    For bulk verification of data that won't be used again soon, use
+    ``ReadStrategy(dontneed=True)``; this drops each file from the page
+    cache once hashed rather than evicting data that's actually in use.
+    """
+
+    def __init__(self, blocksize=None, sequential=True, willneed=False,
+        dontneed=False):
+        """
+        :param blocksize: bytes per read; defaults to :py:data:`blocksize`
+        :param sequential: if True, advise the kernel we're reading
+            sequentially, typically doubling its readahead.  Not applicable
+            to mmap'd files
+        :param willneed: if True, ask the kernel to start reading the whole
+            file into the page cache before we begin; mostly useful for
+            mmap'd files on cold caches
+        :param dontneed: if True, drop the file from the page cache once
+            we're done
+        """
+        self.blocksize = blocksize
+        self.sequential = sequential
+        self.willneed = willneed
+        self.dontneed = dontneed
+
+    @staticmethod
+    def _advise(fd, advice):
+        try:
+            osutils.fadvise(fd, 0, 0, advice)
+        except EnvironmentError:
+            # pipes, sockets, and the like; it's just a hint anyways.
+            pass
+
+    def _advise_path(self, path, advice):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except EnvironmentError:
+            return
+        try:
+            self._advise(fd, advice)
+        finally:
+            os.close(fd)
+
+    def prepare(self, path=None, fd=None):
+        """
+        issue hints prior to reading
+
+        :param path: path of the file, if it's mmap'd
+        :param fd: file descriptor it's being read via, if not mmap'd
+        """
+        if fd is not None:
+            if self.sequential:
+                self._advise(fd, osutils.POSIX_FADV_SEQUENTIAL)
+            if self.willneed:
+                self._advise(fd, osutils.POSIX_FADV_WILLNEED)
+        elif path is not None and self.willneed:
+            self._advise_path(path, osutils.POSIX_FADV_WILLNEED)
+
+    def release(self, path=None, fd=None):
+        """
+        issue hints once reading is finished; see :py:meth:`prepare`
+        """
+        if not self.dontneed:
+            return
+        if fd is not None:
+            self._advise(fd, osutils.POSIX_FADV_DONTNEED)
+        elif path is not None:
+            self._advise_path(path, osutils.POSIX_FADV_DONTNEED)
+
+
+default_read_strategy = ReadStrategy()
+
+
+def loop_over_file(handle, callbacks, parallelize=True, use_mmap=True,
+    max_size=None, read_strategy=None):
+    """
+    feed the content of handle to each callback
+
+    :param handle: filepath, data_source, file object, an object supporting
+        the buffer protocol, or an iterable of data chunks
+    :param callbacks: sequence of callables, each invoked with every block
+    :param parallelize: if True, each callback is run in its own thread
+    :param use_mmap: if True, filepaths are mmap'd rather than read
+    :param max_size: if not None, throw :py:class:`SizeLimitExceeded` as soon
+        as more than this many bytes are seen; this is checked before the
+        data is passed to the callbacks
+    :param read_strategy: :py:class:`ReadStrategy` instance to use for
+        ondisk files; defaults to :py:data:`default_read_strategy`
+    """
+    if read_strategy is None:
+        read_strategy = default_read_strategy
+    m = f = data = chunks = None
     close_f = True
-    if isinstance(handle, basestring):
-        m, f = mmap_or_open_for_read(handle)
+    path = get_path(handle)
+    if path is not None:
+        if use_mmap:
+            m, f = mmap_or_open_for_read(path)
+        else:
+            f = open(path, 'rb')
     elif isinstance(handle, base_data_source):
-        f = handle.bytes_fileobj()
-    else:
+        # in memory sources hand out slices of their data; no copies.
+        data = handle.iter_chunks(blocksize)
+    elif hasattr(handle, 'read'):
         f = handle
         close_f = False
         if is_py3k and getattr(handle, 'encoding', None):
@@ -64,54 +446,277 @@ def loop_over_file(handle, callbacks, parallelize=True):
         # reset; we do it for compat, but it also avoids unpleasant issues from
         # the encoding bypass during py3k
         f.seek(0, 0)
+    else:
+        data = handle
+
+    if f is not None and m is None and hasattr(f, 'getvalue'):
+        data = f.getvalue()
+        if is_py3k and not isinstance(data, bytes):
+            data = data.encode()
+    elif data is not None:
+        buf = _as_buffer(data)
+        if buf is None:
+            try:
+                chunks = iter(data)
+            except TypeError:
+                compatibility.raise_from(TypeError("can't chksum %r; it's "
+                    "not a path, data_source, file, buffer, nor iterable"
+                    % (handle,)))
+            data = None
+        elif len(buf) != len(data):
+            # multibyte items, array('i') for example; hash the raw bytes.
+            data = buf
 
     parallelize = parallelize and len(callbacks) > 1 and get_proc_count() > 1
-    threads, queues = [], []
+    fanout = None
+    reader = f
+    fd = None
+    if m is not None:
+        read_strategy.prepare(path=path)
+    elif f is not None and data is None:
+        fd = _get_fd(f)
+        read_strategy.prepare(fd=fd)
 
     try:
         if parallelize:
-            queues = [Queue.Queue(8) for x in callbacks]
-
-            threads = [threading.Thread(target=chf_thread, args=(queue, functor))
-                for queue, functor in zip(queues, callbacks)]
+            fanout = BlockFanOut(callbacks, size=read_strategy.blocksize)
+            callbacks = [fanout.publish]
 
-            for thread in threads:
-                thread.start()
-
-            callbacks = [queue.put for queue in queues]
+        if max_size is not None:
+            limiter = _SizeLimiter(max_size)
+            if m is not None or data is not None or chunks is not None:
+                callbacks = [limiter.update] + list(callbacks)
+            else:
+                reader = _LimitedReader(f, limiter)
 
         if m is not None:
-            for callback in callbacks:
-                callback(m)
-        elif hasattr(f, 'getvalue'):
-            data = f.getvalue()
-            if is_py3k and not isinstance(data, bytes):
-                data = data.encode()
-
+            data = m
+        if data is not None:
             for callback in callbacks:
                 callback(data)
-        else:
-            data = f.read(blocksize)
-            while data:
+        elif chunks is not None:
+            for data in chunks:
                 for callback in callbacks:
                     callback(data)
-                data = f.read(blocksize)
+        elif fanout is not None:
+            fanout.feed(reader)
+        else:
+            _serial_feed(reader, callbacks, read_strategy.blocksize)
 
     finally:
-        if parallelize:
-            for functor in callbacks:
-                functor(None)
-            for thread in threads:
-                thread.join()
+        try:
+            try:
+                if fanout is not None:
+                    fanout.finish()
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+        finally:
+            if m is not None:
+                m.close()
+                read_strategy.release(path=path)
+            elif f is not None:
+                if fd is not None:
+                    read_strategy.release(fd=fd)
+                if close_f:
+                    f.close()
 
-        if m is not None:
-            m.close()
-        elif f is not None and close_f:
-            f.close()
+
+def get_size(location):
+    """
+    cheaply determine the size of a chksum target, if possible
+
+    :param location: filepath, data_source, file object, or buffer
+    :return: size in bytes, or None if it can't be determined without
+        reading the data
+    """
+    path = get_path(location)
+    try:
+        if path is not None:
+            return os.stat(path).st_size
+        if isinstance(location, data_source.compressed_source):
+            return None
+        if isinstance(location, base_data_source):
+            if not _in_memory(location):
+                # chunked sources are of unknown size.
+                return None
+            f = location.bytes_fileobj()
+            try:
+                f.seek(0, 2)
+                return f.tell()
+            finally:
+                f.close()
+        if hasattr(location, 'fileno'):
+            return os.fstat(location.fileno()).st_size
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+    buf = _as_buffer(location)
+    if buf is None:
+        return None
+    return len(buf)
+
+
+class AdaptivePolicy(object):
+
+    """
+    choose how to drive a set of hashers over a file
+
+    The strategies are:
+
+    * ``serial``: plain reads, every hasher updated in the calling thread.
+      Cheapest for small files where mmap setup and threads are overhead.
+    * ``mmap``: map the file and run each hasher over the whole map in the
+      calling thread.
+    * ``threaded``: map the file (or fan out its blocks) to one thread per
+      hasher.  Only worth it if the slowest hasher dominates the total
+      and the saving outweighs thread startup.
+
+    Throughput is estimated from the metadata of the implementation each
+    chksum resolves to (see :py:func:`resolve`); use :py:meth:`calibrate` to
+    measure the running machine instead.
+
+    :ivar counts: dict of strategy name to number of times chosen
+    :ivar throughput: dict of chksum name to measured bytes per second,
+        overriding the implementation's estimate
+    """
+
+    strategies = ('serial', 'mmap', 'threaded')
+
+    def __init__(self, mmap_threshold=(64 << 10), min_saving=0.1,
+        thread_cost=0.0001, fallback_throughput=(200 << 20), proc_count=None):
+        """
+        :param mmap_threshold: files smaller than this many bytes are always
+            hashed via ``serial``
+        :param min_saving: the fraction of the estimated single threaded
+            time that threading must save to be chosen
+        :param thread_cost: seconds of overhead per hasher thread
+        :param fallback_throughput: bytes/s assumed for hashers with no
+            implementation metadata
+        :param proc_count: number of processors to assume; defaults to
+            :py:func:`snakeoil.process.get_proc_count`
+        """
+        self.mmap_threshold = mmap_threshold
+        self.min_saving = min_saving
+        self.thread_cost = thread_cost
+        self.fallback_throughput = fallback_throughput
+        self.throughput = {}
+        self._proc_count = proc_count
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """clear the strategy counters"""
+        self.counts = dict.fromkeys(self.strategies, 0)
+
+    @property
+    def proc_count(self):
+        if self._proc_count is None:
+            self._proc_count = get_proc_count() or 1
+        return self._proc_count
+
+    def get_throughput(self, chf_type):
+        """
+        :return: estimated bytes per second hashed by `chf_type`
+        """
+        val = self.throughput.get(chf_type)
+        if val is not None:
+            return val
+        handler = resolve(chf_type)
+        impl = getattr(handler, 'implementation', None)
+        if impl is None or not impl.throughput:
+            return self.fallback_throughput
+        return impl.throughput << 20
+
+    def estimate(self, size, chksums, strategy):
+        """
+        estimate the seconds needed to hash `size` bytes via `strategy`
+        """
+        costs = [size / float(self.get_throughput(x))
+            for x in chksums if x != 'size']
+        if not costs:
+            return 0.0
+        if strategy != 'threaded':
+            return sum(costs)
+        # beyond the core count, hashers queue up behind each other.
+        return (max(max(costs), sum(costs) / min(len(costs), self.proc_count))
+            + self.thread_cost * len(costs))
+
+    def choose(self, size, chksums, parallelize=True):
+        """
+        pick a strategy
+
+        :param size: size of the target in bytes, or None if unknown
+        :param chksums: sequence of chksum names being computed
+        :param parallelize: if False, ``threaded`` is never chosen
+        :return: one of :py:attr:`strategies`
+        """
+        hashes = len([x for x in chksums if x != 'size'])
+        if size is not None and size < self.mmap_threshold:
+            strategy = 'serial'
+        elif not parallelize or hashes < 2 or self.proc_count < 2:
+            strategy = 'mmap'
+        elif size is None:
+            strategy = 'threaded'
+        else:
+            serial = self.estimate(size, chksums, 'mmap')
+            threaded = self.estimate(size, chksums, 'threaded')
+            if threaded < serial * (1 - self.min_saving):
+                strategy = 'threaded'
+            else:
+                strategy = 'mmap'
+        self._lock.acquire()
+        self.counts[strategy] += 1
+        self._lock.release()
+        return strategy
+
+    def calibrate(self, handlers, size=(4 << 20), repeat=3):
+        """
+        measure hasher throughput and thread overhead on this machine
+
+        :param handlers: dict of chksum name to handler, as returned by
+            :py:func:`snakeoil.chksum.get_handlers`
+        :param size: bytes hashed per measurement
+        :param repeat: number of measurements; the fastest is used
+        :return: dict of chksum name to measured bytes per second
+        """
+        data = os.urandom(size)
+        measured = {}
+        for name, handler in handlers.iteritems():
+            if name == 'size':
+                continue
+            best = None
+            for x in xrange(repeat):
+                start = time.time()
+                chf = handler.new()()
+                chf.update(data)
+                chf.hexdigest()
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            measured[name] = size / max(best, 1e-9)
+        self.throughput.update(measured)
+
+        best = None
+        for x in xrange(repeat):
+            start = time.time()
+            thread = threading.Thread(target=len, args=((),))
+            thread.start()
+            thread.join()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        self.thread_cost = best
+        return measured
+
+
+default_policy = AdaptivePolicy()
 
 
 class Chksummer(object):
 
+    # the Implementation this was loaded from, if any.
+    implementation = None
+
     def __init__(self, chf_type, obj, str_size):
         self.obj = obj
         self.chf_type = chf_type
@@ -152,44 +757,9 @@ class Chksummer(object):
 # as attributes of the hashlib module and less common hashes available
 # through a constructor taking a string. The former is faster.
 #
-# Some timing data from my athlonxp 2600+, python 2.4.3, python 2.5rc1,
-# pycrypto 2.0.1-r5, openssl 0.9.7j, fchksum 1.7.1 (not exhaustive obviously):
-# (test file is the Python 2.4.3 tarball, 7.7M)
-#
-# python2.4 -m timeit -s 'import fchksum'
-#   'fchksum.fmd5t("/home/marienz/tmp/Python-2.4.3.tar.bz2")[0]'
-# 40 +/- 1 msec roughly
-#
-# same with python2.5: same results.
-#
-# python2.4 -m timeit -s 'from snakeoil.chksum import defaults;import md5'
-#   'defaults.loop_over_file(md5, "/home/marienz/tmp/Python-2.4.3.tar.bz2")'
-# 64 +/- 1 msec roughly
-#
-# Same with python2.5:
-# 37 +/- 1 msec roughly
-#
-# python2.5 -m timeit -s
-#   'from snakeoil.chksum import defaults; from snakeoil import currying;'
-# -s 'import hashlib; hash = currying.pre_curry(hashlib.new, "md5")'
-#   'defaults.loop_over_file(hash, "/home/marienz/tmp/Python-2.4.3.tar.bz2")'
-# 37 +/- 1 msec roughly
-#
-# python2.5 -m timeit -s 'import hashlib'
-#   'h=hashlib.new("md5"); h.update("spork"); h.hexdigest()'
-# 6-7 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib'
-#   'h=hashlib.md5(); h.update("spork"); h.hexdigest()'
-# ~4 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib;data = 1024 * "spork"'
-#   'h=hashlib.new("md5"); h.update(data); h.hexdigest()'
-# ~20 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib;data = 1024 * "spork"'
-#   'h=hashlib.md5(); h.update(data); h.hexdigest()'
-# ~18 usec per loop
+# Some 2006 era timing data (athlonxp 2600+, python 2.4/2.5, fchksum 1.7.1)
+# led to the conclusions below; for current numbers across every
+# available implementation, run `python -m snakeoil.chksum.benchmark`.
 #
 # Summarized:
 # - hashlib is faster than fchksum, fchksum is faster than python 2.4's md5.
@@ -205,124 +775,115 @@ class Chksummer(object):
 # especially on non-x86 platforms, OpenSSL should be more reliable
 # because it is more widely used).
 #
-# TODO do benchmarks for more hashes?
-#
 # Hash function we use is:
 # - hashlib attr if available
 # - hashlib through new() if available.
 # - fchksum with python md5 fallback if possible
 # - PyCrypto
 # - python's md5 or sha1.
+#
+# That preference order is encoded in the implementations table below;
+# nothing is imported until a chksum is actually requested.
 
-chksum_types = {}
+_unloaded = object()
 
-try:
-    import hashlib
-except ImportError:
-    pass
-else:
-    # Always available according to docs.python.org:
-    # md5(), sha1(), sha224(), sha256(), sha384(), and sha512().
-    for hashlibname, chksumname, size in [
-        ('md5', 'md5', md5_size),
-        ('sha1', 'sha1', sha1_size),
-        ('sha256', 'sha256', sha256_size),
-        ('sha512', 'sha512', sha512_size),
-        ]:
-        chksum_types[chksumname] = Chksummer(chksumname,
-            getattr(hashlib, hashlibname), size)
-
-    # May or may not be available depending on openssl. List
-    # determined through trial and error.
-    for hashlibname, chksumname, size in [
-        ('ripemd160', 'rmd160', rmd160_size),
-        ('whirlpool', 'whirlpool', whirlpool_size),
-        ]:
-        try:
-            hashlib.new(hashlibname)
-        except ValueError:
-            pass # This hash is not available.
-        else:
-            chksum_types[chksumname] = Chksummer(chksumname,
-                partial(hashlib.new, hashlibname), size)
-    del hashlibname, chksumname
 
+class Implementation(object):
 
-if 'md5' not in chksum_types:
-    import md5
-    fchksum = None
-    try:
-        import fchksum
-    except ImportError:
-        pass
-    else:
-        class MD5Chksummer(Chksummer):
-            chf_type = "md5"
-            str_size = md5_size
-            __init__ = lambda s:None
-
-            def new(self):
-                return md5.new
-
-            def __call__(self, filename):
-                if isinstance(filename, base_data_source):
-                    if filename.path is not None:
-                        filename = filename.path
-                if isinstance(filename, basestring) and fchksum is not None:
-                    return long(fchksum.fmd5t(filename)[0], 16)
-                return chksum_loop_over_file(filename, md5.new)[0]
-
-        chksum_types["md5"] = MD5Chksummer()
-
-
-# expand this to load all available at some point
-for k, v, str_size in (("sha1", "SHA", sha1_size),
-    ("sha256", "SHA256", sha256_size),
-    ("sha512", "SHA512", sha512_size),
-    ("rmd160", "RIPEMD", rmd160_size)):
-    if k in chksum_types:
-        continue
-    try:
-        chksum_types[k] = Chksummer(k, modules.load_attribute(
-            "Crypto.Hash.%s.new" % v), str_size)
-    except modules.FailedImport:
-        pass
-del k, v
-
-
-for modulename, chksumname, size in [
-    ('sha', 'sha1', sha1_size),
-    ('md5', 'md5', md5_size),
-    ]:
-    if chksumname not in chksum_types:
-        chksum_types[chksumname] = Chksummer(chksumname,
-            modules.load_attribute('%s.new' % (modulename,)), size)
-del modulename, chksumname
+    """
+    metadata for, and lazy loader of, a single implementation of a chksum
 
-try:
-    import mhash
-except ImportError:
-    pass
-else:
-    # Scan mhash for what we need next.
-    for chf in ('sha1', 'sha256', 'sha512', ('rmd160', 'ripemd160'),
-                'whirlpool', 'md5'):
-        target = chf
-        if not isinstance(chf, basestring):
-            chf, target = chf
-        if chf in chksum_types:
-            continue
-        target = 'MHASH_%s' % chf.upper()
-        if hasattr(mhash, target):
-            chksum_types[chf] = Chksummer(chf,
-                                partial(mhash.MHASH, getattr(mhash, target)),
-                                locals()['%s_size' % chf])
-
-if 'whirlpool' not in chksum_types:
-    # Fallback to the python implementation.
-    chksum_types['whirlpool'] = Chksummer('whirlpool',
-        modules.load_attribute('snakeoil.chksum._whirlpool.Whirlpool'),
-        whirlpool_size)
+    :ivar chf_type: name of the chksum implemented
+    :ivar backend: name of the library providing it
+    :ivar str_size: length of the hex form of the chksum
+    :ivar native: True if the hashing is done in C
+    :ivar releases_gil: True if the GIL is dropped while hashing large
+        blocks, thus hashing scales across threads
+    :ivar throughput: rough single core MiB/s, used to rank implementations
+    """
+
+    def __init__(self, chf_type, backend, loader, str_size, native=True,
+        releases_gil=False, throughput=0, handler_cls=Chksummer):
+        """
+        :param loader: callable returning the chksum constructor; it must
+            throw ImportError, AttributeError, or ValueError if the
+            implementation isn't available
+        :param handler_cls: :py:class:`Chksummer` derivative to wrap the
+            constructor in
+        """
+        self.chf_type = intern(chf_type)
+        self.backend = backend
+        self.loader = loader
+        self.str_size = str_size
+        self.native = native
+        self.releases_gil = releases_gil
+        self.throughput = throughput
+        self.handler_cls = handler_cls
+        self._handler = _unloaded
+
+    @property
+    def digest_size(self):
+        """size of the raw digest in bytes"""
+        return self.str_size // 2
+
+    def load(self):
+        """
+        import the implementation if it's not already loaded
+
+        :return: a :py:class:`Chksummer` instance, or None if this
+            implementation isn't available
+        """
+        if self._handler is _unloaded:
+            handler = None
+            try:
+                obj = self.loader()
+            except (ImportError, AttributeError, ValueError):
+                pass
+            else:
+                handler = self.handler_cls(self.chf_type, obj, self.str_size)
+                handler.implementation = self
+            self._handler = handler
+        return self._handler
+
+    @property
+    def available(self):
+        return self.load() is not None
+
+    def __repr__(self):
+        return "<%s %s implementation via %s>" % (self.__class__.__name__,
+            self.chf_type, self.backend)
+
+
+def _hashlib_new(name):
+    hashlib = modules.load_module('hashlib')
+    # May or may not be available depending on openssl; throws ValueError
+    # if not.
+    hashlib.new(name)
+    return partial(hashlib.new, name)
+
+
+def _mhash(name):
+    mhash = modules.load_module('mhash')
+    return partial(mhash.MHASH, getattr(mhash, 'MHASH_%s' % name.upper()))
+
+
+def _fchksum_md5():
+    modules.load_module('fchksum')
+    return modules.load_attribute('md5.new')
+
+
+class _FchksumMD5Chksummer(Chksummer):
+
+    def __call__(self, filename):
+        path = get_path(filename)
+        if path is not None:
+            fchksum = modules.load_module('fchksum')
+            return long(fchksum.fmd5t(path)[0], 16)
+        return Chksummer.__call__(self, filename)
+
+
+def _attr(target):
+    return partial(modules.load_attribute, target)
 
 
 class SizeUpdater(object):
@@ -343,11 +904,7 @@ class SizeChksummer(Chksummer):
     yes, aware that size isn't much of a chksum. ;)
     """
 
-    def __init__(self):
-        pass
-    obj = SizeUpdater
     str_size = 1000000000
-    chf_type = 'size'
 
     @staticmethod
     def long2str(val):
@@ -358,21 +915,128 @@ class SizeChksummer(Chksummer):
         return long(val)
 
     def __call__(self, file_obj):
-        if isinstance(file_obj, base_data_source):
-            if file_obj.path is not None:
-                file_obj = file_obj.path
-            else:
-                file_obj = file_obj.text_fileobj()
-        if isinstance(file_obj, basestring):
+        path = get_path(file_obj)
+        if path is not None:
             try:
-                st_size = os.lstat(file_obj).st_size
+                st_size = os.lstat(path).st_size
             except OSError:
                 return -1
             return st_size
-        # seek to the end.
-        file_obj.seek(0, 2)
-        return long(file_obj.tell())
+        if hasattr(file_obj, 'seek'):
+            # seek to the end.
+            file_obj.seek(0, 2)
+            return long(file_obj.tell())
+        size = get_size(file_obj)
+        if size is None:
+            size = chksum_loop_over_file(file_obj, [self.obj])[0]
+        return long(size)
 
 
-chksum_types["size"] = SizeChksummer()
-chksum_types = dict((intern(k), v) for k, v in chksum_types.iteritems())
+# implementations in order of preference; throughput numbers are rough
+# single core numbers from a ~2012 x86_64.
+implementations = (
+    # Always available according to docs.python.org:
+    # md5(), sha1(), sha224(), sha256(), sha384(), and sha512().
+    Implementation('md5', 'hashlib', _attr('hashlib.md5'), md5_size,
+        releases_gil=True, throughput=550),
+    Implementation('sha1', 'hashlib', _attr('hashlib.sha1'), sha1_size,
+        releases_gil=True, throughput=600),
+    Implementation('sha256', 'hashlib', _attr('hashlib.sha256'), sha256_size,
+        releases_gil=True, throughput=200),
+    Implementation('sha512', 'hashlib', _attr('hashlib.sha512'), sha512_size,
+        releases_gil=True, throughput=300),
+    Implementation('rmd160', 'hashlib', partial(_hashlib_new, 'ripemd160'),
+        rmd160_size, releases_gil=True, throughput=200),
+    Implementation('whirlpool', 'hashlib', partial(_hashlib_new, 'whirlpool'),
+        whirlpool_size, releases_gil=True, throughput=100),
+
+    Implementation('md5', 'fchksum', _fchksum_md5, md5_size,
+        throughput=500, handler_cls=_FchksumMD5Chksummer),
+
+    Implementation('sha1', 'pycrypto', _attr('Crypto.Hash.SHA.new'),
+        sha1_size, throughput=300),
+    Implementation('sha256', 'pycrypto', _attr('Crypto.Hash.SHA256.new'),
+        sha256_size, throughput=100),
+    Implementation('sha512', 'pycrypto', _attr('Crypto.Hash.SHA512.new'),
+        sha512_size, throughput=150),
+    Implementation('rmd160', 'pycrypto', _attr('Crypto.Hash.RIPEMD.new'),
+        rmd160_size, throughput=100),
+
+    Implementation('sha1', 'sha', _attr('sha.new'), sha1_size,
+        throughput=400),
+    Implementation('md5', 'md5', _attr('md5.new'), md5_size,
+        throughput=400),
+
+    # our C implementation drops the GIL, and is far faster than both
+    # mhash and the python fallback.
+    Implementation('whirlpool', 'snakeoil',
+        _attr('snakeoil.chksum._whirlpool_c.new'), whirlpool_size,
+        releases_gil=True, throughput=110),
+
+    Implementation('sha1', 'mhash', partial(_mhash, 'sha1'), sha1_size,
+        throughput=400),
+    Implementation('sha256', 'mhash', partial(_mhash, 'sha256'), sha256_size,
+        throughput=150),
+    Implementation('sha512', 'mhash', partial(_mhash, 'sha512'), sha512_size,
+        throughput=200),
+    Implementation('rmd160', 'mhash', partial(_mhash, 'ripemd160'),
+        rmd160_size, throughput=150),
+    Implementation('whirlpool', 'mhash', partial(_mhash, 'whirlpool'),
+        whirlpool_size, throughput=80),
+    Implementation('md5', 'mhash', partial(_mhash, 'md5'), md5_size,
+        throughput=400),
+
+    # Fallback to the python implementation.
+    Implementation('whirlpool', 'python',
+        _attr('snakeoil.chksum._whirlpool.Whirlpool'), whirlpool_size,
+        native=False, throughput=1),
+
+    Implementation('size', 'snakeoil', lambda: SizeUpdater,
+        SizeChksummer.str_size, native=False, throughput=1 << 20,
+        handler_cls=SizeChksummer),
+)
+
+
+def get_implementations(chf_type=None):
+    """
+    list the known implementations, without loading any
+
+    :param chf_type: if given, only return implementations of this chksum
+    :return: list of :py:class:`Implementation` instances, in order of
+        preference
+    """
+    return [x for x in implementations
+        if chf_type is None or x.chf_type == chf_type]
+
+
+def chksum_names():
+    """
+    :return: list of the names of every chksum with a known implementation
+    """
+    names = []
+    for impl in implementations:
+        if impl.chf_type not in names:
+            names.append(impl.chf_type)
+    return names
+
+
+def resolve(chf_type, fastest=False):
+    """
+    find an available implementation of a chksum
+
+    Implementations are imported only until one is found that's available.
+
+    :param chf_type: chksum name
+    :param fastest: if True, candidates are tried in order of their
+        throughput rather than preference
+    :return: :py:class:`Chksummer` instance, or None if no implementation
+        is available
+    """
+    candidates = get_implementations(chf_type)
+    if fastest:
+        candidates.sort(key=lambda x: x.throughput, reverse=True)
+    for impl in candidates:
+        handler = impl.load()
+        if handler is not None:
+            return handler
+    return None
@@ -1,7 +1,23 @@
 # Copyright: 2011 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD 3 clause
 
-from snakeoil import modules, klass
+"""
+compression and decompression of bzip2, gzip, xz, zstd, and lz4
+
+Each format is handled in process where python offers support, falling back
+to the format's binary if not.  The decompression functions detect the
+format from the data's leading bytes if no compressor_type is given:
+
+>>> from snakeoil import compression
+>>> handle = compression.decompress_handle("/path/to/file")    # doctest: +SKIP
+"""
+
+import io
+import os
+import re
+
+from snakeoil import compatibility, modules, klass
+from snakeoil.compression._stream import SeekIndex
 
 class _transform_source(object):
 
@@ -12,38 +28,238 @@ class _transform_source(object):
     def module(self):
         return modules.load_module('snakeoil.compression._%s' % (self.name,))
 
+    @property
+    def available(self):
+        """
+        whether this format can be used; either the python module or the
+        binary must be available
+        """
+        try:
+            self.module
+        except modules.FailedImport:
+            return False
+        return True
+
     @klass.jit_attr
     def parallelizable(self):
         return bool(getattr(self.module, 'parallelizable', False))
 
-    def compress_data(self, data, level, parallelize=False):
-        parallelize = parallelize and self.module.parallelizable
-        return self.module.compress_data(data, level, parallelize=parallelize)
+    def compress_data(self, data, level=None, **kwds):
+        if level is not None:
+            kwds['level'] = level
+        return self.module.compress_data(data, **kwds)
+
+    def decompress_data(self, data, **kwds):
+        return self.module.decompress_data(data, **kwds)
 
-    def decompress_data(self, data, parallelize=False):
-        parallelize = parallelize and self.module.parallelizable
-        return self.module.decompress_data(data, parallelize=parallelize)
+    def compress_handle(self, handle, level=None, **kwds):
+        if level is not None:
+            kwds['level'] = level
+        return self.module.compress_handle(handle, **kwds)
 
-    def compress_handle(self, handle, level, parallelize=False):
-        parallelize = parallelize and self.module.parallelizable
-        return self.module.compress_handle(handle, level, parallelize=parallelize)
+    def decompress_handle(self, handle, **kwds):
+        return self.module.decompress_handle(handle, **kwds)
 
-    def decompress_handle(self, handle, parallelize=False):
-        parallelize = parallelize and self.module.parallelizable
-        return self.module.decompress_handle(handle, parallelize=parallelize)
+    def iter_decompress(self, handle, **kwds):
+        return self.module.iter_decompress(handle, **kwds)
 
 
 _transforms = dict((name, _transform_source(name))
-    for name in ('bzip2',))
+    for name in ('bzip2', 'gzip', 'xz', 'zstd', 'lz4'))
+
+# leading bytes of each format's streams.  Non ascii bytes are escaped
+# within the patterns, so force_bytes can't mangle them.
+_magic = tuple((name, re.compile(compatibility.force_bytes(regex)))
+    for name, regex in (
+        ('bzip2', r'BZh[1-9]'),
+        ('gzip', r'\x1f\x8b'),
+        ('xz', r'\xfd7zXZ\x00'),
+        ('zstd', r'\x28\xb5\x2f\xfd'),
+        ('lz4', r'\x04\x22\x4d\x18'),
+    ))
+_magic_len = 6
+_empty = compatibility.force_bytes('')
+
+
+def available():
+    """
+    :return: tuple of the compressor types usable on this system
+    """
+    return tuple(sorted(name for name, transform in _transforms.iteritems()
+        if transform.available))
+
+
+def detect(data):
+    """
+    identify the compression format of data from its leading bytes
+
+    :param data: the start of the compressed data; 6 bytes suffice
+    :return: compressor type, or None if unrecognized
+    """
+    for name, magic in _magic:
+        if magic.match(data):
+            return name
+    return None
+
+
+def _read_fd(fd, size=-1):
+    # os.read may come up short on pipes; file.read semantics are wanted.
+    chunks = []
+    while size is None or size < 0 or size > 0:
+        chunk = os.read(fd, 65536 if size is None or size < 0 else size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if size is not None and size >= 0:
+            size -= len(chunk)
+    return _empty.join(chunks)
+
+
+class _PrefixedReader(object):
 
-def compress_data(compressor_type, data, level=9, **kwds):
+    # hands back data already read from an unseekable source, then
+    # continues reading from it.  File objects are closed along with the
+    # reader; descriptors are read directly, and left to their owner.
+
+    def __init__(self, prefix, handle):
+        self._prefix = prefix
+        self._handle = handle
+        self.closed = False
+
+    def _read(self, size):
+        if isinstance(self._handle, (int, long)):
+            return _read_fd(self._handle, size)
+        return self._handle.read(size)
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        prefix = self._prefix
+        if not prefix:
+            return self._read(size)
+        if size is not None and 0 <= size <= len(prefix):
+            self._prefix = prefix[size:]
+            return prefix[:size]
+        self._prefix = prefix[:0]
+        if size is None or size < 0:
+            return prefix + self._read(-1)
+        return prefix + self._read(size - len(prefix))
+
+    def fileno(self):
+        if self._prefix:
+            # reading the descriptor directly would skip the prefix.
+            raise io.UnsupportedOperation("fileno of %r isn't usable until "
+                "the sniffed data is read" % (self,))
+        if isinstance(self._handle, (int, long)):
+            return self._handle
+        return self._handle.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._prefix = self._prefix[:0]
+        if not isinstance(self._handle, (int, long)):
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def sniff(source):
+    """
+    identify the compression format of a file
+
+    The source is left positioned where it was.  If it's an unseekable file
+    object (or descriptor), it can't be; a replacement is returned in that
+    case, yielding the data consumed followed by the rest of the source.
+    The caller owns the replacement: closing it closes a file object it
+    wraps, while a descriptor stays open for the caller to close, as it
+    would be had it been seekable.
+
+    :param source: file path, file descriptor, or file object
+    :return: (compressor type or None if unrecognized, source)
+    """
+    if isinstance(source, basestring):
+        f = open(source, 'rb')
+        try:
+            return detect(f.read(_magic_len)), source
+        finally:
+            f.close()
+    elif isinstance(source, (int, long)):
+        try:
+            pos = os.lseek(source, 0, os.SEEK_CUR)
+        except EnvironmentError:
+            header = _read_fd(source, _magic_len)
+            return detect(header), _PrefixedReader(header, source)
+        header = os.read(source, _magic_len)
+        os.lseek(source, pos, os.SEEK_SET)
+        return detect(header), source
+    try:
+        pos = source.tell()
+    except (AttributeError, EnvironmentError):
+        pos = None
+    header = source.read(_magic_len)
+    if pos is None:
+        source = _PrefixedReader(header, source)
+    else:
+        source.seek(pos)
+    return detect(header), source
+
+
+def _sniffed(compressor_type, source):
+    if source is None:
+        # invoked with just the source.
+        compressor_type, source = None, compressor_type
+    if compressor_type is None:
+        compressor_type, source = sniff(source)
+        if compressor_type is None:
+            raise ValueError("unrecognized compression format: %r"
+                % (source,))
+    return compressor_type, source
+
+
+def compress_data(compressor_type, data, level=None, **kwds):
+    """
+    :param level: compression level; defaults to the format's own default
+        (9 for bzip2 and gzip, 6 for xz, whose -9 needs ~674MiB per worker)
+    """
     return _transforms[compressor_type].compress_data(data, level, **kwds)
 
-def decompress_data(compressor_type, data, **kwds):
+def decompress_data(compressor_type, data=None, **kwds):
+    """
+    :param compressor_type: compression format; if None (or if only data is
+        given), detected from the data
+    """
+    if data is None:
+        compressor_type, data = None, compressor_type
+    if compressor_type is None:
+        compressor_type = detect(data[:_magic_len])
+        if compressor_type is None:
+            raise ValueError("unrecognized compression format")
     return _transforms[compressor_type].decompress_data(data, **kwds)
 
-def compress_handle(compressor_type, handle, level=9, **kwds):
+def compress_handle(compressor_type, handle, level=None, **kwds):
+    """
+    :param level: compression level; see :py:func:`compress_data`
+    """
     return _transforms[compressor_type].compress_handle(handle, level, **kwds)
 
-def decompress_handle(compressor_type, source, **kwds):
+def decompress_handle(compressor_type, source=None, **kwds):
+    """
+    :param compressor_type: compression format; if None (or if only the
+        source is given), detected via :py:func:`sniff`
+    """
+    compressor_type, source = _sniffed(compressor_type, source)
     return _transforms[compressor_type].decompress_handle(source, **kwds)
+
+def iter_decompress(compressor_type, handle=None, **kwds):
+    """
+    :param compressor_type: compression format; if None (or if only the
+        handle is given), detected via :py:func:`sniff`
+    """
+    compressor_type, handle = _sniffed(compressor_type, handle)
+    return _transforms[compressor_type].iter_decompress(handle, **kwds)
@@ -11,24 +11,27 @@ and compression.
 Should use this module unless its absolutely critical that bz2 module be used
 """
 
-__all__ = ("compress_data", "decompress_data")
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
 
-import sys
+import re
 
 from snakeoil import process, currying
-from snakeoil.compression import _util
+from snakeoil.compatibility import force_bytes
+from snakeoil.compression import _util, _stream
 
 # Unused import
 # pylint: disable-msg=W0611
 
-# if Bzip2 can't be found, throw an error.
-bz2_path = process.find_binary("bzip2")
+try:
+    bz2_path = process.find_binary("bzip2")
+except process.CommandNotFound:
+    bz2_path = None
 
 
 try:
     from bz2 import (compress as _compress_data,
-                     decompress as _decompress_data,
-                     BZ2File)
+                     BZ2File, BZ2Compressor, BZ2Decompressor)
     native = True
 except ImportError:
 
@@ -36,12 +39,22 @@ except ImportError:
     # (and some code needs to be able to check that).
     native = False
 
+    # if Bzip2 can't be found, throw an error.
+    if bz2_path is None:
+        raise ImportError("neither the bz2 module nor a bzip2 binary are "
+            "available")
+
     _compress_data = currying.partial(_util.compress_data, bz2_path)
     _decompress_data = currying.partial(_util.decompress_data, bz2_path)
 
 _compress_handle = currying.partial(_util.compress_handle, bz2_path)
 _decompress_handle = currying.partial(_util.decompress_handle, bz2_path)
 
+# stream header: 'BZh', the level, then either the block magic (pi), or the
+# end of stream magic (sqrt(pi)) for an empty stream.  Non ascii bytes are
+# escaped within the pattern, so force_bytes can't mangle them.
+stream_magic = re.compile(force_bytes(r'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'))
+
 lbzip2_path = None
 parallelizable = False
 lbzip2_compress_args = lbzip2_decompress_args = ()
@@ -59,33 +72,86 @@ except process.CommandNotFound:
     pass
 
 
-def compress_data(data, level=9, parallelize=False):
-    if parallelize and parallelizable:
+def _blocksize(level):
+    # match bzip2's own block size, so splitting costs next to nothing in
+    # compression ratio.  Level 9 (bzip2's default) needs ~7.6MiB per
+    # compressor, so workers aren't capped by memory as xz's are.
+    return max(level, 1) * 100000
+
+def compress_data(data, level=9, parallelize=False, workers=None):
+    if parallelize and parallelizable and workers is None:
         return _util.compress_data(lbzip2_path, data, level=level,
             extra_args=lbzip2_compress_args)
+    workers = _stream.get_workers(parallelize, workers)
+    if native and workers > 1:
+        return _stream.compress_data(data,
+            currying.partial(BZ2Compressor, level), workers=workers,
+            blocksize=_blocksize(level))
     return _compress_data(data, compresslevel=level)
 
-def decompress_data(data, parallelize=False):
-    if parallelize and parallelizable:
+def decompress_data(data, parallelize=False, workers=None):
+    if parallelize and parallelizable and workers is None:
         return _util.decompress_data(lbzip2_path, data,
             extra_args=lbzip2_decompress_args)
+    elif native:
+        # bz2.decompress prior to py3.3 stops at the end of the first
+        # stream; thus go through our decompressor which handles multiple.
+        return _stream.decompress_data(data, BZ2Decompressor,
+            magic=stream_magic,
+            workers=_stream.get_workers(parallelize, workers))
     return _decompress_data(data)
 
-def compress_handle(handle, level=9, parallelize=False):
-    if parallelize and parallelizable:
+def compress_handle(handle, level=9, parallelize=False, workers=None):
+    """
+    :return: file object compressing what's written to it into `handle`;
+        the stream is finalized upon close
+    """
+    if parallelize and parallelizable and workers is None:
         return _util.compress_handle(lbzip2_path, handle, level=level,
             extra_args=lbzip2_compress_args)
-    elif native and isinstance(handle, basestring):
-        return BZ2File(handle, mode='w', compresslevel=level)
+    elif native:
+        workers = _stream.get_workers(parallelize, workers)
+        if workers > 1:
+            return _stream.ParallelCompressionHandle(handle,
+                currying.partial(BZ2Compressor, level), workers,
+                blocksize=_blocksize(level))
+        return _stream.CompressionHandle(handle,
+            currying.partial(BZ2Compressor, level))
     return _compress_handle(handle, level=level)
 
-def decompress_handle(handle, parallelize=False):
-    if parallelize and parallelizable:
+def decompress_handle(handle, parallelize=False, workers=None, index=None):
+    """
+    :param index: see :py:class:`snakeoil.compression._stream.SeekIndex`;
+        ignored if the bz2 module is unavailable
+    :return: file object yielding the decompressed content of `handle`
+    """
+    if parallelize and parallelizable and workers is None and index is None:
         return _util.decompress_handle(lbzip2_path, handle,
             extra_args=lbzip2_decompress_args)
-    elif native and isinstance(handle, basestring) \
-        and sys.version_info[:3] >= (3,3):
-        # note that <3.3, bz2file doesn't handle multiple streams.
-        # thus don't use it.
-        return BZ2File(handle, mode='r')
+    elif native:
+        workers = _stream.get_workers(parallelize, workers)
+        if workers > 1:
+            return _stream.ParallelDecompressionHandle(handle,
+                BZ2Decompressor, stream_magic, workers, index=index)
+        # note that <3.3, BZ2File doesn't handle multiple streams; our
+        # handle does.
+        return _stream.DecompressionHandle(handle, BZ2Decompressor,
+            index=index)
     return _decompress_handle(handle)
+
+
+def iter_decompress(handle, blocksize=_stream.blocksize):
+    """
+    incrementally decompress a bzip2 file, yielding chunks of the result
+
+    Unlike :py:func:`decompress_data`, memory usage is bounded regardless of
+    the size of the payload.  Multiple concatenated streams (as produced by
+    lbzip2/pbzip2) are handled.
+
+    :param handle: file path, or file object to read from
+    :param blocksize: amount of compressed data to read at a time
+    """
+    if not native:
+        return _util.iter_decompress(bz2_path, handle, blocksize=blocksize)
+    return _stream.iter_decompress(handle, BZ2Decompressor,
+        blocksize=blocksize)
@@ -0,0 +1,79 @@
+# License: GPL2/BSD
+
+"""
+gzip decompression/compression
+
+Done in process via :py:mod:`zlib`; if parallelization is requested and pigz
+is available, it's used instead.  Otherwise parallel compression is done in
+process, in blocks of :py:data:`blocksize`.
+"""
+
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
+
+import zlib
+
+from snakeoil import process, currying
+from snakeoil.compression import _util, _stream
+
+native = True
+
+# pigz uses 128k, but primes each block's dictionary with the previous
+# block; we can't, so use larger blocks to limit the ratio loss.
+blocksize = 1 << 20
+
+pigz_path = None
+parallelizable = False
+pigz_args = ()
+try:
+    pigz_path = process.find_binary("pigz")
+    # see _bzip2 for why this is limited to physical cores.
+    pigz_args = ('-p%i' % process.get_physical_proc_count(),)
+    parallelizable = True
+except process.CommandNotFound:
+    pass
+
+
+def _compressor(level=9):
+    # wbits of 16 + MAX_WBITS is zlib for "write a gzip header and trailer".
+    # deflate's state is ~256KiB regardless of level, so -9 costs only time.
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def _decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def compress_data(data, level=9, parallelize=False, workers=None):
+    if parallelize and parallelizable and workers is None:
+        return _util.compress_data(pigz_path, data, level=level,
+            extra_args=pigz_args)
+    return _stream.compress_data(data, currying.partial(_compressor, level),
+        workers=_stream.get_workers(parallelize, workers),
+        blocksize=blocksize)
+
+# gzip member headers are too short to reliably split on, thus the workers
+# argument is accepted for compatibility, but decompression is serial.
+def decompress_data(data, parallelize=False, workers=None):
+    if parallelize and parallelizable and workers is None:
+        return _util.decompress_data(pigz_path, data, extra_args=pigz_args)
+    return _stream.decompress_data(data, _decompressor)
+
+def compress_handle(handle, level=9, parallelize=False, workers=None):
+    if parallelize and parallelizable and workers is None:
+        return _util.compress_handle(pigz_path, handle, level=level,
+            extra_args=pigz_args)
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.ParallelCompressionHandle(handle,
+            currying.partial(_compressor, level), workers,
+            blocksize=blocksize)
+    return _stream.CompressionHandle(handle,
+        currying.partial(_compressor, level))
+
+def decompress_handle(handle, parallelize=False, workers=None, index=None):
+    if parallelize and parallelizable and workers is None and index is None:
+        return _util.decompress_handle(pigz_path, handle, extra_args=pigz_args)
+    return _stream.DecompressionHandle(handle, _decompressor, index=index)
+
+def iter_decompress(handle, blocksize=_stream.blocksize):
+    return _stream.iter_decompress(handle, _decompressor, blocksize=blocksize)
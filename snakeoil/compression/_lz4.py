@@ -0,0 +1,103 @@
+# License: GPL2/BSD
+
+"""
+lz4 decompression/compression
+
+Done in process via the lz4 module (lz4.frame) if it's installed; else the
+lz4 binary is used.  Explicitly requesting `workers` compresses in parallel
+in process, in blocks of :py:data:`blocksize`.
+"""
+
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
+
+from snakeoil import compatibility, process, currying
+from snakeoil.compression import _util, _stream
+
+try:
+    from lz4 import frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    lz4_path = process.find_binary("lz4")
+except process.CommandNotFound:
+    lz4_path = None
+
+native = lz4_frame is not None
+if not native and lz4_path is None:
+    raise ImportError("neither the lz4 module nor an lz4 binary are "
+        "available")
+
+# lz4 is fast enough that the binary has no threading to speak of.
+parallelizable = False
+
+blocksize = 1 << 22
+_empty = compatibility.force_bytes('')
+
+
+class _compressor(object):
+
+    """
+    LZ4FrameCompressor, adapted to the compressobj interface
+
+    The frame header has to be requested explicitly via begin; we emit it
+    with the first output instead.
+    """
+
+    def __init__(self, level=9):
+        self._compressor = lz4_frame.LZ4FrameCompressor(
+            compression_level=level)
+        self._header = self._compressor.begin()
+
+    def _take_header(self):
+        header = self._header
+        self._header = _empty
+        return header
+
+    def compress(self, data):
+        return self._take_header() + self._compressor.compress(data)
+
+    def flush(self):
+        return self._take_header() + self._compressor.flush()
+
+
+def _decompressor():
+    return lz4_frame.LZ4FrameDecompressor()
+
+
+def compress_data(data, level=9, parallelize=False, workers=None):
+    if not native:
+        return _util.compress_data(lz4_path, data, level=level)
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.compress_data(data,
+            currying.partial(_compressor, level), workers=workers,
+            blocksize=blocksize)
+    return lz4_frame.compress(data, compression_level=level)
+
+def decompress_data(data, parallelize=False, workers=None):
+    if not native:
+        return _util.decompress_data(lz4_path, data)
+    return _stream.decompress_data(data, _decompressor)
+
+def compress_handle(handle, level=9, parallelize=False, workers=None):
+    if not native:
+        return _util.compress_handle(lz4_path, handle, level=level)
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.ParallelCompressionHandle(handle,
+            currying.partial(_compressor, level), workers,
+            blocksize=blocksize)
+    return _stream.CompressionHandle(handle,
+        currying.partial(_compressor, level))
+
+def decompress_handle(handle, parallelize=False, workers=None, index=None):
+    if not native:
+        return _util.decompress_handle(lz4_path, handle)
+    return _stream.DecompressionHandle(handle, _decompressor, index=index)
+
+def iter_decompress(handle, blocksize=_stream.blocksize):
+    if not native:
+        return _util.iter_decompress(lz4_path, handle, blocksize=blocksize)
+    return _stream.iter_decompress(handle, _decompressor, blocksize=blocksize)
@@ -0,0 +1,309 @@
+# License: GPL2/BSD
+
+"""
+pool of long lived helper processes for running compression binaries
+
+Spawning a binary directly from a large python process is expensive; the
+fork duplicates the parent's page tables, and close_fds walks every
+possible descriptor (up to RLIMIT_NOFILE) in the child.  For the many small
+blobs case that cost dwarfs the actual compression.
+
+Binaries like bzip2 compress a single stream per invocation, so they can't
+be reused; instead a pool of small python helpers is kept around.  Requests
+(argv and input) are sent to an idle helper as length prefixed marshal
+frames; it spawns the binary- cheaply, as it's small and holds no other
+descriptors- and sends back the exit code, stdout, and stderr.
+
+Do not use this module directly; :py:func:`snakeoil.compression._util`
+routes through it.
+"""
+
+__all__ = ("ProcessPool", "get_pool")
+
+import os
+import struct
+import sys
+import threading
+
+from snakeoil.compatibility import force_bytes
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'atexit',
+    'errno',
+    'marshal',
+    'select',
+    'signal',
+    'subprocess',
+    'time',
+    'snakeoil.process:get_proc_count',
+)
+
+_header = struct.Struct('!I')
+
+# the helpers need to find us; they're started via -c with this inserted
+# into sys.path.
+_root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+_worker_code = ("import sys; sys.path.insert(0, %r); "
+    "from snakeoil.compression import _pool; _pool._worker_main()" % (_root,))
+
+
+def _read_exact(read, length):
+    chunks = []
+    while length:
+        data = read(length)
+        if not data:
+            return None
+        chunks.append(data)
+        length -= len(data)
+    return force_bytes('').join(chunks)
+
+
+def _read_frame(read):
+    header = _read_exact(read, _header.size)
+    if header is None:
+        return None
+    payload = _read_exact(read, _header.unpack(header)[0])
+    if payload is None:
+        return None
+    return marshal.loads(payload)
+
+
+def _write_frame(write, obj):
+    payload = marshal.dumps(obj)
+    write(_header.pack(len(payload)) + payload)
+
+
+def _worker_main():
+    # runs in the helper; serve requests until our stdin is closed.
+    stdin = os.fdopen(os.dup(sys.stdin.fileno()), 'rb', 0)
+    stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    # nothing else should write to the frame stream.
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    while True:
+        request = _read_frame(stdin.read)
+        if request is None:
+            break
+        args, data = request
+        try:
+            # close_fds is pointless here; we hold nothing worth hiding.
+            p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate(data)
+            response = (p.returncode, out, err)
+        except EnvironmentError, e:
+            response = (None, force_bytes(''), str(e))
+        _write_frame(stdout.write, response)
+        stdout.flush()
+
+
+class _Worker(object):
+
+    def __init__(self):
+        # the helper leads its own process group, so that kill() can take
+        # down whatever binary it's running along with it.
+        self.process = subprocess.Popen([sys.executable, '-c', _worker_code],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True,
+            preexec_fn=os.setpgrp)
+        self.requests = 0
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def request(self, args, data, timeout):
+        _write_frame(self.process.stdin.write, (tuple(args), data))
+        self.process.stdin.flush()
+        fd = self.process.stdout.fileno()
+        read = self.process.stdout.read
+        if timeout is not None:
+            deadline = time.time() + timeout
+            def read(length):
+                remaining = deadline - time.time()
+                if remaining <= 0 or \
+                    not select.select([fd], [], [], remaining)[0]:
+                    raise EnvironmentError(errno.ETIMEDOUT,
+                        "%s didn't complete within %ss" % (args[0], timeout))
+                return os.read(fd, length)
+        response = _read_frame(read)
+        if response is None:
+            raise EnvironmentError(errno.EPIPE, "pool helper %i died"
+                % (self.process.pid,))
+        self.requests += 1
+        return response
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except EnvironmentError:
+            pass
+
+    def kill(self):
+        self.close()
+        # even if the helper already exited, the binary it spawned may not
+        # have.
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except EnvironmentError, e:
+            if e.errno != errno.ESRCH:
+                raise
+        self.process.wait()
+
+
+class ProcessPool(object):
+
+    """
+    bounded pool of helper processes running commands on our behalf
+
+    :ivar spawned: number of helpers started over the pool's lifetime
+    :ivar pid: pid of the process owning the helpers
+    """
+
+    def __init__(self, size=None, timeout=300, max_requests=1000):
+        """
+        :param size: maximum number of helpers; defaults to the number of
+            processors
+        :param timeout: seconds a request may take before its helper is
+            killed, and EnvironmentError(ETIMEDOUT) raised; None to disable
+        :param max_requests: helpers are replaced after this many requests,
+            bounding any leaks within them
+        """
+        if size is None:
+            size = get_proc_count() or 1
+        if size < 1:
+            raise ValueError("size must be positive, got %r" % (size,))
+        self.size = size
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.spawned = 0
+        self.pid = os.getpid()
+        self._idle = []
+        self._busy = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def _acquire(self):
+        self._cond.acquire()
+        try:
+            while True:
+                if self._closed:
+                    raise ValueError("pool %r is shut down" % (self,))
+                while self._idle:
+                    worker = self._idle.pop()
+                    # health check; discard anything that's exited.
+                    if worker.alive:
+                        self._busy += 1
+                        return worker
+                    worker.kill()
+                if self._busy < self.size:
+                    self._busy += 1
+                    break
+                self._cond.wait()
+        finally:
+            self._cond.release()
+        try:
+            worker = _Worker()
+        except:
+            self._release(None)
+            raise
+        self.spawned += 1
+        return worker
+
+    def _release(self, worker):
+        self._cond.acquire()
+        try:
+            self._busy -= 1
+            if worker is not None:
+                if self._closed or worker.requests >= self.max_requests:
+                    worker.close()
+                else:
+                    self._idle.append(worker)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def run(self, args, data):
+        """
+        run a command, feeding it data
+
+        :param args: argv of the command
+        :param data: bytes fed to its stdin
+        :return: (returncode, stdout, stderr); returncode is None if the
+            command couldn't be executed
+        """
+        # a helper dying between requests is caught by the health check; if
+        # it died mid request (say, the OOM killer), retry once.
+        for attempt in (True, False):
+            worker = self._acquire()
+            try:
+                response = worker.request(args, data, self.timeout)
+            except EnvironmentError, e:
+                worker.kill()
+                self._release(None)
+                if e.errno == errno.EPIPE and attempt:
+                    continue
+                raise
+            self._release(worker)
+            return response
+
+    def _abandon(self):
+        # forked copy of a pool; drop our ends of the parent's helpers
+        # without talking to them, or waiting on processes that aren't our
+        # children.
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for worker in idle:
+            for handle in (worker.process.stdin, worker.process.stdout):
+                try:
+                    handle.close()
+                except EnvironmentError:
+                    pass
+
+    def shutdown(self):
+        """
+        stop all idle helpers; busy helpers stop once their request is done
+        """
+        if self.pid != os.getpid():
+            self._abandon()
+            return
+        self._cond.acquire()
+        try:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for worker in idle:
+            worker.close()
+        for worker in idle:
+            worker.process.wait()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    :return: the shared :py:class:`ProcessPool`, created on first use and
+        shut down at exit.  A forked child gets a pool of its own; the
+        parent's helpers are left untouched.
+    """
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        _pool_lock.acquire()
+        try:
+            if _pool is None or _pool.pid != pid:
+                if _pool is not None:
+                    # inherited; writing to its helpers would interleave
+                    # with the parent's requests.
+                    _pool._abandon()
+                pool = ProcessPool()
+                atexit.register(pool.shutdown)
+                _pool = pool
+        finally:
+            _pool_lock.release()
+    return _pool
@@ -0,0 +1,729 @@
+# License: GPL2/BSD
+
+"""
+in process streaming (de)compression handles
+
+These wrap the incremental compressor/decompressor objects the stdlib
+provides (:py:mod:`zlib`, :py:mod:`bz2`, :py:mod:`lzma`), thus memory usage
+is bounded by the block size rather than the size of the payload.
+
+Compression can be parallelized in the manner of pigz/pbzip2: input is split
+into blocks, each compressed as an independent stream on a thread pool (all
+three modules release the GIL while compressing), and the streams are
+concatenated in order.  Each format treats concatenated streams as a single
+stream, at the cost of a slightly worse compression ratio.
+
+The reverse holds for decompression; multistream files (as produced by the
+above, pbzip2, lbzip2, pixz, etc) are split at stream headers, and the
+streams decompressed concurrently.
+
+Seeking within a compressed stream is normally a matter of decompressing
+from the start; a :py:class:`SeekIndex` records points decompression can be
+restarted from, making seeks proportional to the distance from the nearest
+point rather than the offset.
+
+Do not use this module directly; go through
+:py:func:`snakeoil.compression.compress_handle` and
+:py:func:`snakeoil.compression.decompress_handle`.
+"""
+
+__all__ = ("CompressionHandle", "ParallelCompressionHandle", "SeekIndex",
+    "DecompressionHandle", "ParallelDecompressionHandle", "iter_decompress",
+    "compress_data", "decompress_data", "get_workers")
+
+import bisect
+import itertools
+import os
+
+from snakeoil import compatibility, currying
+from snakeoil.weakrefs import WeakRefFinalizer
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'errno',
+    'snakeoil.fileutils:AtomicWriteFile',
+    'snakeoil.process:get_proc_count',
+    'snakeoil.stringio:bytes_readonly',
+    'snakeoil.threads:threaded_map',
+)
+
+blocksize = 1 << 17
+_empty = compatibility.force_bytes('')
+
+
+def _open(source, mode):
+    """
+    :return: (file object, boolean of whether we own it)
+    """
+    if isinstance(source, basestring):
+        return open(source, mode), True
+    elif isinstance(source, (int, long)):
+        return os.fdopen(os.dup(source), mode), True
+    if mode.startswith('r'):
+        if not hasattr(source, 'read'):
+            raise TypeError("source %r isn't a path, fd, nor a readable "
+                "file object" % (source,))
+    elif not hasattr(source, 'write'):
+        raise TypeError("target %r isn't a path, fd, nor a writable "
+            "file object" % (source,))
+    return source, False
+
+
+class SeekIndex(object):
+
+    """
+    points decompression of a stream can be restarted from
+
+    Each point maps an uncompressed offset to the compressed offset at which
+    decompression resumes.  Points are either stream boundaries, where a
+    fresh decompressor is used, or checkpoints holding a copy of the
+    decompressor's state.  The latter only work for decompressors
+    supporting copy (zlib), and exist only in memory; :py:meth:`save`
+    writes just the former.
+
+    Indexes are built as a :py:class:`DecompressionHandle` reads; pass the
+    same instance to later handles of the same source to reuse it.
+
+    :ivar spacing: minimum uncompressed distance between points
+    :ivar size: compressed size of the source, once fully indexed
+    :ivar length: uncompressed size of the source, once fully indexed
+    """
+
+    _header = "# snakeoil seek index v1"
+
+    def __init__(self, spacing=(4 << 20)):
+        if spacing < 1:
+            raise ValueError("spacing must be positive, got %r" % (spacing,))
+        self.spacing = spacing
+        self.clear()
+
+    def clear(self):
+        self.size = self.length = None
+        self._offsets = [0]
+        self._points = [(0, 0, None)]
+
+    def __len__(self):
+        return len(self._points)
+
+    def add(self, offset, compressed, decompressor=None):
+        """
+        record a point
+
+        Ignored if it's within :py:attr:`spacing` of the last point.
+
+        :param offset: uncompressed offset
+        :param compressed: compressed offset decompression resumes from
+        :param decompressor: if given, the decompressor's state at this
+            point; it's copied if the point is recorded.  If None, the
+            point is a stream boundary.
+        :return: True if the point was recorded
+        """
+        if offset < self._offsets[-1] + self.spacing:
+            return False
+        if decompressor is not None:
+            decompressor = decompressor.copy()
+        self._offsets.append(offset)
+        self._points.append((offset, compressed, decompressor))
+        return True
+
+    def lookup(self, offset):
+        """
+        :return: (uncompressed offset, compressed offset, decompressor state
+            or None) of the nearest point at or before `offset`
+        """
+        return self._points[bisect.bisect_right(self._offsets, offset) - 1]
+
+    def matches(self, size):
+        """
+        :return: False if this index is of a source of a different size
+        """
+        return self.size is None or size is None or self.size == size
+
+    def save(self, path):
+        """
+        write the stream boundaries of this index to `path`
+        """
+        f = AtomicWriteFile(path)
+        try:
+            f.write("%s\n" % (self._header,))
+            f.write("spacing %i\n" % (self.spacing,))
+            if self.size is not None:
+                f.write("size %i %i\n" % (self.size, self.length))
+            for offset, compressed, state in self._points[1:]:
+                if state is None:
+                    f.write("%i %i\n" % (offset, compressed))
+        except:
+            f.discard()
+            raise
+        f.close()
+
+    @classmethod
+    def load(cls, path):
+        """
+        load an index written by :py:meth:`save`
+
+        :return: :py:class:`SeekIndex` instance, or None if `path` doesn't
+            exist or isn't a valid index
+        """
+        try:
+            f = open(path, 'r')
+        except IOError, ie:
+            if ie.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            if f.readline().rstrip("\n") != cls._header:
+                return None
+            try:
+                obj = cls(int(f.readline().split()[1]))
+                for line in f:
+                    line = line.split()
+                    if line[0] == 'size':
+                        obj.size, obj.length = int(line[1]), int(line[2])
+                    else:
+                        obj.add(int(line[0]), int(line[1]))
+            except (IndexError, ValueError):
+                return None
+        finally:
+            f.close()
+        return obj
+
+
+class DecompressionHandle(object):
+
+    """
+    readonly file object decompressing a source as it's read
+
+    Concatenated streams (as lbzip2, pigz, and the like produce) are
+    decompressed as a single stream.
+
+    Seeking is supported, although it's emulated- seeking forward reads and
+    discards, seeking backwards restarts decompression from the beginning.
+    The latter requires a seekable source.  Given a :py:class:`SeekIndex`,
+    seeks restart from the nearest point in the index instead, if closer.
+    """
+
+    def __init__(self, source, decompressor, blocksize=blocksize, index=None):
+        """
+        :param source: file path, file descriptor, or file object of the
+            compressed data
+        :param decompressor: callable returning a new decompressor object;
+            this must have a decompress method and unused_data attribute
+        :param blocksize: amount of compressed data to read at a time
+        :param index: :py:class:`SeekIndex` instance to use and extend, or
+            True to build a new one; available as the index attribute
+        """
+        self._factory = decompressor
+        self.blocksize = blocksize
+        self._source, self._owned = _open(source, 'rb')
+        try:
+            self._origin = self._source.tell()
+        except (AttributeError, EnvironmentError):
+            self._origin = None
+        if index is True:
+            index = SeekIndex()
+        elif index is not None and not index.matches(self._source_size()):
+            # stale; the source was modified since.
+            index.clear()
+        self.index = index
+        self.closed = False
+        self._reset()
+
+    def _source_size(self):
+        try:
+            return os.fstat(self._source.fileno()).st_size - self._origin
+        except (AttributeError, EnvironmentError, TypeError):
+            return None
+
+    def _reset(self):
+        self._decompressor = self._factory()
+        self._buffer = _empty
+        self._offset = 0
+        self._eof = False
+        self.position = 0
+        # total decompressed, and compressed consumed, thus far.
+        self._produced = self._compressed = 0
+
+    def _checkpoint(self, offset, compressed, decompressor=None):
+        if self.index is not None:
+            self.index.add(offset, compressed, decompressor)
+
+    def _decompress(self, data):
+        output = []
+        produced = self._produced
+        end = self._compressed + len(data)
+        while data:
+            try:
+                chunk = self._decompressor.decompress(data)
+            except EOFError:
+                # the prior stream ended exactly at a read boundary.
+                self._decompressor = self._factory()
+                self._checkpoint(produced, end - len(data))
+                continue
+            if chunk:
+                output.append(chunk)
+                produced += len(chunk)
+            data = self._decompressor.unused_data
+            if data:
+                # another stream follows.
+                self._decompressor = self._factory()
+                self._checkpoint(produced, end - len(data))
+        if hasattr(self._decompressor, 'copy'):
+            self._checkpoint(produced, end, self._decompressor)
+        self._produced = produced
+        self._compressed = end
+        return _empty.join(output)
+
+    def _finished(self):
+        self._eof = True
+        if self.index is not None:
+            self.index.size = self._compressed
+            self.index.length = self._produced
+
+    def _fill(self):
+        # decompress until we have output, or hit the end of the source.
+        while not self._eof:
+            data = self._source.read(self.blocksize)
+            if not data:
+                self._finished()
+                break
+            data = self._decompress(data)
+            if data:
+                self._buffer = data
+                self._offset = 0
+                return True
+        return False
+
+    def read1(self, size=-1):
+        """
+        read at most `size` bytes, decompressing at most one block
+
+        Primarily useful for iterating over the output in chunks.
+        """
+        if self._offset >= len(self._buffer) and not self._fill():
+            return _empty
+        if size is None or size < 0:
+            end = len(self._buffer)
+        else:
+            end = self._offset + size
+        data = self._buffer[self._offset:end]
+        self._offset += len(data)
+        self.position += len(data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            output = []
+            data = self.read1()
+            while data:
+                output.append(data)
+                data = self.read1()
+            return _empty.join(output)
+        output = []
+        while size > 0:
+            data = self.read1(size)
+            if not data:
+                break
+            output.append(data)
+            size -= len(data)
+        return _empty.join(output)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            if self.index is None or self.index.length is None:
+                raise ValueError("seeking relative to the end requires a "
+                    "complete index")
+            offset += self.index.length
+        elif whence != 0:
+            raise ValueError("whence must be 0, 1, or 2, got %r" % (whence,))
+        if offset < 0:
+            raise ValueError("negative offset %i" % (offset,))
+        point = (0, 0, None)
+        if self.index is not None:
+            point = self.index.lookup(offset)
+        if offset < self.position or point[0] > self.position:
+            if self._origin is None:
+                raise TypeError("instance %s can't do negative seeks: asked "
+                    "for %i, was at %i" % (self, offset, self.position))
+            self._restore(point)
+        while offset > self.position:
+            if not self.read1(min(offset - self.position, self.blocksize)):
+                break
+        return self.position
+
+    def _restore(self, point):
+        offset, compressed, state = point
+        self._source.seek(self._origin + compressed)
+        self._reset()
+        if state is not None:
+            self._decompressor = state.copy()
+        self.position = self._produced = offset
+        self._compressed = compressed
+
+    def __iter__(self):
+        return iter(self.read1, _empty)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = _empty
+        if self._owned:
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ParallelDecompressionHandle(DecompressionHandle):
+
+    """
+    :py:class:`DecompressionHandle` decompressing streams in parallel
+
+    The source is scanned for stream headers (via `magic`), split into the
+    streams found, and those are decompressed concurrently; output is
+    yielded in order.
+
+    A match of `magic` isn't proof of a stream boundary; each stream is
+    verified to decompress fully, without trailing data.  If one fails,
+    decompression continues serially from that stream onward; likewise if a
+    stream exceeds `max_segment`, since it can't be split further.
+    """
+
+    def __init__(self, source, decompressor, magic, workers,
+        blocksize=(1 << 20), max_segment=(8 << 20), index=None):
+        """
+        :param magic: compiled regex matching the start of a stream
+        :param workers: number of threads to decompress with
+        :param blocksize: amount of compressed data to read at a time
+        :param max_segment: maximum amount of compressed data buffered
+            while searching for the end of a stream
+        """
+        if workers < 1:
+            raise ValueError("workers must be positive, got %r" % (workers,))
+        self.magic = magic
+        self.workers = workers
+        self.max_segment = max_segment
+        DecompressionHandle.__init__(self, source, decompressor,
+            blocksize=blocksize, index=index)
+
+    def _reset(self):
+        self._shutdown()
+        DecompressionHandle._reset(self)
+        self._abort = False
+        self._tail = ()
+        self._output = self._iter_output()
+
+    def _fill(self):
+        for data in self._output:
+            self._buffer = data
+            self._offset = 0
+            return True
+        self._finished()
+        return False
+
+    def _shutdown(self):
+        # stop the worker pool, if one is running.
+        output = getattr(self, '_output', None)
+        if output is not None:
+            output.close()
+
+    def close(self):
+        if not self.closed:
+            self._shutdown()
+        DecompressionHandle.close(self)
+
+    def _iter_segments(self):
+        buf = _empty
+        read = self._source.read
+        while not self._abort and len(buf) <= self.max_segment:
+            data = read(self.blocksize)
+            if not data:
+                if buf:
+                    yield buf
+                    buf = _empty
+                break
+            # position 0 is the header of the stream we're accumulating.
+            start = max(len(buf) - 32, 1)
+            buf += data
+            match = self.magic.search(buf, start)
+            while match is not None:
+                yield buf[:match.start()]
+                buf = buf[match.start():]
+                match = self.magic.search(buf, 1)
+        # whatever remains is handled serially.
+        self._tail = itertools.chain([buf],
+            iter(currying.partial(read, self.blocksize), _empty))
+
+    def _decompress_segment(self, data):
+        decompressor = self._factory()
+        try:
+            output = decompressor.decompress(data)
+            complete = not decompressor.unused_data and _at_eof(decompressor)
+        except Exception:
+            # corrupt, or a false boundary; the serial pass sorts out which.
+            output, complete = None, False
+        return output, complete, data
+
+    def _iter_output(self):
+        serial = False
+        for output, complete, data in threaded_map(self._decompress_segment,
+            self._iter_segments(), workers=self.workers):
+            if not serial and complete:
+                self._checkpoint(self._produced, self._compressed)
+                self._produced += len(output)
+                self._compressed += len(data)
+                if output:
+                    yield output
+                continue
+            if not serial:
+                serial = True
+                self._abort = True
+            output = self._decompress(data)
+            if output:
+                yield output
+        for data in self._tail:
+            output = self._decompress(data)
+            if output:
+                yield output
+
+
+def _at_eof(decompressor):
+    eof = getattr(decompressor, 'eof', None)
+    if eof is not None:
+        return eof
+    # py2k's bz2 lacks the eof attribute, but raises if fed after the end.
+    try:
+        decompressor.decompress(_empty)
+    except EOFError:
+        return True
+    return False
+
+
+class CompressionHandle(object):
+
+    """
+    writeonly file object compressing data as it's written
+
+    The compressed stream is finalized on :py:meth:`close`; until then the
+    target isn't a complete stream.
+    """
+
+    __metaclass__ = WeakRefFinalizer
+
+    def __init__(self, target, compressor):
+        """
+        :param target: file path, file descriptor, or file object to write
+            the compressed data to
+        :param compressor: callable returning a new compressor object; this
+            must have compress and flush methods
+        """
+        self.closed = True
+        self._target, self._owned = _open(target, 'wb')
+        self._compressor = compressor()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed handle %s" % (self,))
+        self.position += len(data)
+        data = self._compressor.compress(data)
+        if data:
+            self._target.write(data)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0, seek_size=(64 * 1024)):
+        if whence == 1:
+            offset += self.position
+        elif whence != 0:
+            raise ValueError("whence must be 0 or 1, got %r" % (whence,))
+        if offset < self.position:
+            raise TypeError("instance %s can't do negative seeks: asked for "
+                "%i, was at %i" % (self, offset, self.position))
+        # fill the gap with nulls, allocating the block only once.
+        null_block = compatibility.force_bytes('\0') * min(
+            offset - self.position, seek_size)
+        while offset > self.position:
+            self.write(null_block[:offset - self.position])
+        return self.position
+
+    def flush(self):
+        # note this flushes the target, not the compressor- doing the latter
+        # would terminate the stream for some formats.
+        self._target.flush()
+
+    def _finish(self):
+        data = self._compressor.flush()
+        if data:
+            self._target.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._finish()
+        finally:
+            if self._owned:
+                self._target.close()
+            else:
+                self._target.flush()
+
+    __del__ = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ParallelCompressionHandle(CompressionHandle):
+
+    """
+    :py:class:`CompressionHandle` compressing blocks in parallel
+
+    Writes are buffered until there is a block for each worker; those are
+    then compressed concurrently and written out in order.  Memory usage is
+    thus bounded by `workers` * `blocksize`.
+    """
+
+    def __init__(self, target, compressor, workers, blocksize=(1 << 20)):
+        """
+        :param workers: number of threads to compress with
+        :param blocksize: amount of uncompressed data per stream; larger
+            blocks compress better, but bound the parallelism possible
+        """
+        if workers < 1:
+            raise ValueError("workers must be positive, got %r" % (workers,))
+        if blocksize < 1:
+            raise ValueError("blocksize must be positive, got %r"
+                % (blocksize,))
+        self.closed = True
+        self._target, self._owned = _open(target, 'wb')
+        self._compress_block = currying.partial(_compress_block, compressor)
+        self.workers = workers
+        self.blocksize = blocksize
+        self._pending = []
+        self._pending_size = 0
+        self._emitted = False
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed handle %s" % (self,))
+        if not data:
+            return
+        self.position += len(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.blocksize * self.workers:
+            self._compress_pending()
+
+    def _compress_pending(self, final=False):
+        data = _empty.join(self._pending)
+        end = len(data)
+        if not final:
+            end -= end % self.blocksize
+        blocks = [data[x:x + self.blocksize]
+            for x in xrange(0, end, self.blocksize)]
+        for chunk in threaded_map(self._compress_block, blocks,
+            workers=min(self.workers, max(len(blocks), 1))):
+            self._target.write(chunk)
+            self._emitted = True
+        self._pending = []
+        self._pending_size = 0
+        if end < len(data):
+            self._pending.append(data[end:])
+            self._pending_size = len(data) - end
+
+    def _finish(self):
+        self._compress_pending(final=True)
+        if not self._emitted:
+            # nothing was written; emit a valid, empty stream.
+            self._target.write(self._compress_block(_empty))
+
+
+def _compress_block(compressor, data):
+    compressor = compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def get_workers(parallelize=False, workers=None):
+    """
+    normalize the parallelize/workers arguments the compression api takes
+
+    :param parallelize: if True, and `workers` isn't specified, use a worker
+        per processor
+    :param workers: explicit number of threads to use
+    :return: number of threads to compress with
+    """
+    if workers is None:
+        if not parallelize:
+            return 1
+        return get_proc_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be positive, got %r" % (workers,))
+    return workers
+
+
+def compress_data(data, compressor, workers=1, blocksize=(1 << 20)):
+    """
+    compress `data`, splitting it into streams of `blocksize` compressed in
+    parallel if `workers` is greater than 1
+
+    :param compressor: callable returning a new compressor object
+    """
+    if workers <= 1 or len(data) <= blocksize:
+        return _compress_block(compressor, data)
+    blocks = (data[x:x + blocksize] for x in xrange(0, len(data), blocksize))
+    return _empty.join(threaded_map(
+        currying.partial(_compress_block, compressor), blocks,
+        workers=workers))
+
+
+def iter_decompress(source, decompressor, blocksize=blocksize):
+    """
+    incrementally decompress `source`, yielding chunks of the output
+
+    see :py:class:`DecompressionHandle` for the parameters
+    """
+    handle = DecompressionHandle(source, decompressor, blocksize=blocksize)
+    try:
+        for data in handle:
+            yield data
+    finally:
+        handle.close()
+
+
+def decompress_data(data, decompressor, magic=None, workers=1):
+    """
+    decompress `data`, handling concatenated streams
+
+    :param decompressor: see :py:class:`DecompressionHandle`
+    :param magic: see :py:class:`ParallelDecompressionHandle`; required if
+        `workers` is greater than 1
+    :param workers: number of threads to decompress with
+    """
+    source = bytes_readonly(data)
+    if workers > 1:
+        return ParallelDecompressionHandle(source, decompressor, magic,
+            workers).read()
+    return DecompressionHandle(source, decompressor,
+        blocksize=max(len(data), 1)).read()
@@ -1,16 +1,36 @@
 # Copyright: 2006-2012 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
-__all__ = ("compress_data", "decompress_data")
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
 
+import errno
 import os
 import signal
 import subprocess
 
 from snakeoil import klass
 from snakeoil.weakrefs import WeakRefFinalizer
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'snakeoil.compression:_pool',
+)
+
+# inputs smaller than this are run through the helper pool
+# (snakeoil.compression._pool), amortizing spawning costs; larger inputs
+# aren't worth the extra copy through the helper.  0 disables the pool.
+pool_threshold = 1 << 20
 
 def _drive_process(args, mode, data):
+    if len(data) < pool_threshold:
+        returncode, stdout, stderr = _pool.get_pool().run(args, data)
+        if returncode is None:
+            raise EnvironmentError(errno.ENOENT, "failed executing %s: %s"
+                % (args[0], stderr))
+        if returncode != 0:
+            raise ValueError("%s returned %i exitcode from %s"
+                ", stderr=%r" % (mode, returncode, args[0], stderr))
+        return stdout
     p = subprocess.Popen(args,
         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
         stderr=subprocess.PIPE, close_fds=True)
@@ -18,7 +38,7 @@ def _drive_process(args, mode, data):
         stdout, stderr = p.communicate(data)
         if p.returncode != 0:
             raise ValueError("%s returned %i exitcode from %s"
-                ", stderr=%r" % (mode, p.returncode, binary, stderr))
+                ", stderr=%r" % (mode, p.returncode, args[0], stderr))
         return stdout
     finally:
         if p is not None and p.returncode is None:
@@ -183,3 +203,22 @@ def decompress_handle(binary_path, handle, extra_args=()):
     args = [binary_path, '-dc']
     args.extend(extra_args)
     return _process_handle(handle, args, True)
+
+def iter_decompress(binary_path, handle, blocksize=(1 << 17), extra_args=()):
+    close = False
+    if isinstance(handle, basestring):
+        handle = open(handle, 'rb')
+        close = True
+    try:
+        # spawn the binary, and read its output in chunks.
+        proc = decompress_handle(binary_path, handle, extra_args=extra_args)
+        try:
+            data = proc.read(blocksize)
+            while data:
+                yield data
+                data = proc.read(blocksize)
+        finally:
+            proc.close()
+    finally:
+        if close:
+            handle.close()
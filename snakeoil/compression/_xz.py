@@ -0,0 +1,146 @@
+# License: GPL2/BSD
+
+"""
+xz decompression/compression
+
+Done in process via :py:mod:`lzma` (py3.3 and up, or backports.lzma); if
+that's unavailable, or parallelization is requested, the xz binary is used.
+Explicitly requesting `workers` compresses in parallel in process, in blocks
+of :py:data:`blocksize`.
+
+Compression defaults to preset 6, as xz does; each in process worker needs
+the preset's memory (see :py:data:`preset_memory`), so workers are capped
+accordingly.
+"""
+
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
+
+import os
+import re
+
+from snakeoil import process, currying
+from snakeoil.compatibility import force_bytes
+from snakeoil.compression import _util, _stream
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    xz_path = process.find_binary("xz")
+except process.CommandNotFound:
+    xz_path = None
+
+native = lzma is not None
+if not native and xz_path is None:
+    raise ImportError("neither the lzma module nor an xz binary are "
+        "available")
+
+parallelizable = xz_path is not None
+# xz >=5.2 threads compression; >=5.4 decompression as well.  The memory
+# limit makes xz drop threads rather than need a preset's worth per thread.
+xz_parallel_args = ('-T%i' % process.get_physical_proc_count(),
+    '--memlimit-compress=25%')
+
+# non ascii bytes are escaped within the pattern, so force_bytes can't
+# mangle them.
+stream_magic = re.compile(force_bytes(r'\xfd7zXZ\x00'))
+
+# xz -T defaults to blocks of three times the dictionary size (24MiB at the
+# default -6); every worker holds a block of input, so we trade a bit of ratio
+# for less.
+blocksize = 1 << 23
+
+# xz's own default; higher presets mostly buy a larger dictionary.
+default_level = 6
+
+# approximate compressor memory use per preset, in MiB, per xz(1).  Each
+# worker has its own compressor; -9 is ~674MiB apiece, so the in process
+# parallel paths cap workers to what fits in a quarter of physical memory.
+preset_memory = (3, 9, 17, 32, 48, 94, 94, 186, 370, 674)
+
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        return None
+
+def _cap_workers(workers, level):
+    if workers <= 1:
+        return workers
+    memory = _physical_memory()
+    if not memory:
+        return workers
+    per_worker = preset_memory[min(max(level, 0), 9)] << 20
+    return max(1, min(workers, (memory >> 2) // per_worker))
+
+
+def _compressor(level=default_level):
+    return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+
+def _decompressor():
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+def _use_binary(parallelize, workers=None, index=None):
+    return not native or (parallelize and parallelizable and workers is None
+        and index is None)
+
+def _binary_args(parallelize):
+    if parallelize:
+        return xz_parallel_args
+    return ()
+
+
+def compress_data(data, level=default_level, parallelize=False,
+    workers=None):
+    if _use_binary(parallelize, workers):
+        return _util.compress_data(xz_path, data, level=level,
+            extra_args=_binary_args(parallelize))
+    workers = _cap_workers(_stream.get_workers(parallelize, workers), level)
+    if workers > 1:
+        return _stream.compress_data(data,
+            currying.partial(_compressor, level), workers=workers,
+            blocksize=blocksize)
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+def decompress_data(data, parallelize=False, workers=None):
+    if _use_binary(parallelize, workers):
+        return _util.decompress_data(xz_path, data,
+            extra_args=_binary_args(parallelize))
+    return _stream.decompress_data(data, _decompressor, magic=stream_magic,
+        workers=_stream.get_workers(parallelize, workers))
+
+def compress_handle(handle, level=default_level, parallelize=False,
+    workers=None):
+    if _use_binary(parallelize, workers):
+        return _util.compress_handle(xz_path, handle, level=level,
+            extra_args=_binary_args(parallelize))
+    workers = _cap_workers(_stream.get_workers(parallelize, workers), level)
+    if workers > 1:
+        return _stream.ParallelCompressionHandle(handle,
+            currying.partial(_compressor, level), workers,
+            blocksize=blocksize)
+    return _stream.CompressionHandle(handle,
+        currying.partial(_compressor, level))
+
+def decompress_handle(handle, parallelize=False, workers=None, index=None):
+    if _use_binary(parallelize, workers, index):
+        return _util.decompress_handle(xz_path, handle,
+            extra_args=_binary_args(parallelize))
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.ParallelDecompressionHandle(handle, _decompressor,
+            stream_magic, workers, index=index)
+    return _stream.DecompressionHandle(handle, _decompressor, index=index)
+
+def iter_decompress(handle, blocksize=_stream.blocksize):
+    if not native:
+        return _util.iter_decompress(xz_path, handle, blocksize=blocksize)
+    return _stream.iter_decompress(handle, _decompressor, blocksize=blocksize)
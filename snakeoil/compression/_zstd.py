@@ -0,0 +1,99 @@
+# License: GPL2/BSD
+
+"""
+zstd decompression/compression
+
+Done in process via the zstandard module if it's installed; else, or if
+parallelization is requested, the zstd binary is used.  Explicitly
+requesting `workers` compresses in parallel in process, in blocks of
+:py:data:`blocksize`.
+"""
+
+__all__ = ("compress_data", "decompress_data", "compress_handle",
+    "decompress_handle", "iter_decompress")
+
+from snakeoil import process, currying
+from snakeoil.compression import _util, _stream
+
+try:
+    import zstandard
+    # older releases lack unused_data, which concatenated frames require.
+    if not hasattr(zstandard.ZstdDecompressor().decompressobj(),
+        'unused_data'):
+        zstandard = None
+except ImportError:
+    zstandard = None
+
+try:
+    zstd_path = process.find_binary("zstd")
+except process.CommandNotFound:
+    zstd_path = None
+
+native = zstandard is not None
+if not native and zstd_path is None:
+    raise ImportError("neither the zstandard module nor a zstd binary are "
+        "available")
+
+parallelizable = zstd_path is not None
+zstd_parallel_args = ('-T%i' % process.get_physical_proc_count(), '-q')
+
+blocksize = 1 << 22
+
+
+def _compressor(level=9):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+def _decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _use_binary(parallelize, workers=None):
+    return not native or (parallelize and parallelizable and workers is None)
+
+def _binary_args(parallelize):
+    if parallelize:
+        return zstd_parallel_args
+    return ('-q',)
+
+
+def compress_data(data, level=9, parallelize=False, workers=None):
+    if _use_binary(parallelize, workers):
+        return _util.compress_data(zstd_path, data, level=level,
+            extra_args=_binary_args(parallelize))
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.compress_data(data,
+            currying.partial(_compressor, level), workers=workers,
+            blocksize=blocksize)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+def decompress_data(data, parallelize=False, workers=None):
+    if not native:
+        return _util.decompress_data(zstd_path, data,
+            extra_args=_binary_args(False))
+    return _stream.decompress_data(data, _decompressor)
+
+def compress_handle(handle, level=9, parallelize=False, workers=None):
+    if _use_binary(parallelize, workers):
+        return _util.compress_handle(zstd_path, handle, level=level,
+            extra_args=_binary_args(parallelize))
+    workers = _stream.get_workers(parallelize, workers)
+    if workers > 1:
+        return _stream.ParallelCompressionHandle(handle,
+            currying.partial(_compressor, level), workers,
+            blocksize=blocksize)
+    return _stream.CompressionHandle(handle,
+        currying.partial(_compressor, level))
+
+def decompress_handle(handle, parallelize=False, workers=None, index=None):
+    # decompression doesn't thread; the native path is always preferable.
+    if not native:
+        return _util.decompress_handle(zstd_path, handle,
+            extra_args=_binary_args(False))
+    return _stream.DecompressionHandle(handle, _decompressor, index=index)
+
+def iter_decompress(handle, blocksize=_stream.blocksize):
+    if not native:
+        return _util.iter_decompress(zstd_path, handle, blocksize=blocksize,
+            extra_args=_binary_args(False))
+    return _stream.iter_decompress(handle, _decompressor, blocksize=blocksize)
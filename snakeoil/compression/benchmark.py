@@ -0,0 +1,337 @@
+# License: GPL2/BSD
+
+"""
+compression benchmark
+
+Run via ``python -m snakeoil.compression.benchmark``; see ``--help`` for
+options.  Results are printed as tables, or written as JSON via ``--json``.
+
+The suites are:
+
+* ``workers``: in process compression throughput of each format as the
+  number of workers scales, along with the compression ratio cost of
+  splitting the input into independent blocks.  Note that scaling is bounded
+  by the processors available; runs with more workers than processors are
+  still reported, but only measure overhead.
+* ``seek``: the cost of building a
+  :py:class:`snakeoil.compression.SeekIndex` while reading, and the latency
+  of random seeks with and without one.
+* ``pool``: compressing many small blobs via a compression binary, spawning
+  it directly per blob versus via the helper pool.
+"""
+
+__all__ = ("mk_data", "bench_workers", "bench_seek", "bench_pool", "run",
+    "main")
+
+import os
+import random
+import sys
+
+from snakeoil.version import __version__
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'json',
+    'optparse',
+    'platform',
+    'shutil',
+    'tempfile',
+    'snakeoil:compression,process',
+    'snakeoil.compression:_util',
+    'snakeoil.chksum.benchmark:best_of',
+    'snakeoil.process:get_proc_count',
+)
+
+formats = ('bzip2', 'gzip', 'xz', 'zstd', 'lz4')
+worker_counts = (1, 2, 4, 8, 16)
+
+# suite name, and the columns to display for it: (key, header, format).
+suites = (
+    ('workers', (('format', 'format', '%-6s'), ('workers', 'workers', '%7i'),
+        ('seconds', 'seconds', '%9.3f'), ('mb_per_sec', 'MiB/s', '%10.1f'),
+        ('speedup', 'speedup', '%7.2f'), ('ratio', 'ratio', '%6.3f'))),
+    ('seek', (('format', 'format', '%-6s'), ('mode', 'mode', '%-8s'),
+        ('points', 'points', '%6i'), ('read_seconds', 'read', '%9.3f'),
+        ('seek_ms', 'ms/seek', '%9.2f'))),
+    ('pool', (('binary', 'binary', '%-6s'), ('mode', 'mode', '%-5s'),
+        ('blobs', 'blobs', '%6i'), ('seconds', 'seconds', '%9.3f'),
+        ('blobs_per_sec', 'blobs/s', '%9.1f'))),
+)
+
+
+def mk_data(size, seed=0):
+    """
+    generate compressible, but not trivially so, data
+
+    Random data doesn't compress, and repetitive data compresses far faster
+    than anything real; text with random tokens sits between the two.
+    """
+    rand = random.Random(seed)
+    words = ['%x' % rand.getrandbits(24) for x in xrange(4096)]
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rand.choice(words) for x in xrange(12)) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+
+def bench_workers(data, names=formats, workers=worker_counts, level=6,
+    repeat=3):
+    """
+    time compress_data for each format and worker count
+
+    :param data: bytes to compress
+    :param names: compression formats to measure; formats lacking in process
+        support are skipped
+    :param workers: sequence of worker counts
+    :return: list of dicts, one per (format, workers)
+    """
+    results = []
+    size = len(data)
+    for name in names:
+        transform = compression._transforms[name]
+        if not transform.available or \
+            not getattr(transform.module, 'native', False):
+            continue
+        baseline = None
+        for count in workers:
+            # the closure captures the output so we can report the ratio.
+            out = []
+            def f():
+                out[:] = [compression.compress_data(name, data, level=level,
+                    workers=count)]
+            elapsed = best_of(f, repeat)
+            if baseline is None:
+                baseline = elapsed
+            results.append({'format': name, 'workers': count,
+                'seconds': elapsed,
+                'mb_per_sec': (size / float(1 << 20)) / max(elapsed, 1e-9),
+                'speedup': baseline / max(elapsed, 1e-9),
+                'ratio': len(out[0]) / float(max(size, 1))})
+    return results
+
+
+def _seek_sources(names, data, directory):
+    # multistream, so there are stream boundaries to index; gzip is a single
+    # stream, relying on checkpoints.
+    for name in names:
+        transform = compression._transforms[name]
+        if not transform.available or \
+            not getattr(transform.module, 'native', False):
+            continue
+        workers = None
+        if name != 'gzip':
+            workers = 2
+        path = os.path.join(directory, 'seek.%s' % (name,))
+        f = open(path, 'wb')
+        try:
+            f.write(compression.compress_data(name, data, level=6,
+                workers=workers))
+        finally:
+            f.close()
+        yield name, path
+
+
+def bench_seek(data, names=formats, seeks=20, spacing=(1 << 20),
+    directory=None, repeat=3):
+    """
+    measure index building cost, and random seek latency
+
+    For each format, times a full read without an index and with one being
+    built, then `seeks` random seeks (each reading 4KiB) without an index,
+    and with the built index.
+
+    :param data: bytes to compress and seek within
+    :param seeks: number of random seeks per measurement
+    :param spacing: see :py:class:`snakeoil.compression.SeekIndex`
+    :return: list of dicts, one per (format, mode)
+    """
+    rand = random.Random(0)
+    offsets = [rand.randrange(len(data)) for x in xrange(seeks)]
+    workdir = tempfile.mkdtemp(dir=directory, prefix='snakeoil-bench-')
+    try:
+        results = []
+        for name, path in _seek_sources(names, data, workdir):
+            for mode in ('none', 'index'):
+                indexes = []
+                def build():
+                    index = None
+                    if mode == 'index':
+                        index = compression.SeekIndex(spacing)
+                    handle = compression.decompress_handle(name, path,
+                        index=index)
+                    try:
+                        handle.read()
+                    finally:
+                        handle.close()
+                    indexes[:] = [index]
+                read_seconds = best_of(build, repeat)
+                index = indexes[0]
+                def seek():
+                    handle = compression.decompress_handle(name, path,
+                        index=index)
+                    try:
+                        for offset in offsets:
+                            handle.seek(offset)
+                            handle.read(4096)
+                    finally:
+                        handle.close()
+                elapsed = best_of(seek, repeat)
+                points = 0
+                if index is not None:
+                    points = len(index)
+                results.append({'format': name, 'mode': mode,
+                    'points': points, 'read_seconds': read_seconds,
+                    'seek_ms': elapsed * 1000 / max(seeks, 1)})
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def bench_pool(data, binaries=('gzip', 'bzip2', 'xz'), count=200,
+    blob_size=4096, repeat=3):
+    """
+    time compressing many small blobs through compression binaries
+
+    :param data: source of the blobs
+    :param binaries: binaries to measure; those not installed are skipped
+    :param count: number of blobs
+    :return: list of dicts, one per (binary, mode)
+    """
+    blobs = [data[x:x + blob_size]
+        for x in xrange(0, min(len(data), count * blob_size), blob_size)]
+    results = []
+    for binary in binaries:
+        try:
+            path = process.find_binary(binary)
+        except process.CommandNotFound:
+            continue
+        for mode, threshold in (('spawn', 0), ('pool', _util.pool_threshold)):
+            def f():
+                orig = _util.pool_threshold
+                _util.pool_threshold = threshold
+                try:
+                    for blob in blobs:
+                        _util.compress_data(path, blob, level=6)
+                finally:
+                    _util.pool_threshold = orig
+            elapsed = best_of(f, repeat)
+            results.append({'binary': binary, 'mode': mode,
+                'blobs': len(blobs), 'seconds': elapsed,
+                'blobs_per_sec': len(blobs) / max(elapsed, 1e-9)})
+    return results
+
+
+def environment():
+    """
+    :return: dict describing the machine and software benchmarked
+    """
+    return {
+        'snakeoil': __version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processors': get_proc_count(),
+    }
+
+
+def run(names=None, compressors=formats, size=(32 << 20),
+    workers=worker_counts, level=6, repeat=3, directory=None):
+    """
+    run benchmark suites
+
+    :param names: sequence of suite names to run; defaults to all
+    :param compressors: compression formats to measure
+    :param size: amount of data to compress per measurement
+    :param directory: directory to create temporary files in
+    :return: dict of suite name to list of result dicts
+    """
+    if names is None:
+        names = [x[0] for x in suites]
+    unknown = set(names).difference(x[0] for x in suites)
+    if unknown:
+        raise ValueError("unknown suites: %s" % ", ".join(sorted(unknown)))
+    unknown = set(compressors).difference(formats)
+    if unknown:
+        raise ValueError("unknown formats: %s" % ", ".join(sorted(unknown)))
+    data = mk_data(size)
+    results = {}
+    if 'workers' in names:
+        results['workers'] = bench_workers(data, names=compressors,
+            workers=workers, level=level, repeat=repeat)
+    if 'seek' in names:
+        results['seek'] = bench_seek(data, names=compressors,
+            directory=directory, repeat=repeat)
+    if 'pool' in names:
+        results['pool'] = bench_pool(data, repeat=repeat)
+    return results
+
+
+def main(argv=None, out=None):
+    if out is None:
+        out = sys.stdout
+    parser = optparse.OptionParser(
+        description="benchmark parallel compression in snakeoil.compression")
+    parser.add_option("--suites", default=None,
+        help="comma separated suites to run, out of %s; defaults to all"
+        % ", ".join(x[0] for x in suites))
+    parser.add_option("--formats", default=",".join(formats),
+        help="comma separated formats to run; defaults to %default")
+    parser.add_option("--workers", default=",".join(map(str, worker_counts)),
+        help="comma separated worker counts; defaults to %default")
+    parser.add_option("--size", type="int", default=32,
+        help="MiB of data to compress; defaults to %default")
+    parser.add_option("--level", type="int", default=6,
+        help="compression level; defaults to %default")
+    parser.add_option("--repeat", type="int", default=3,
+        help="take the best of this many runs; defaults to %default")
+    parser.add_option("--dir", default=None,
+        help="directory to create test files in")
+    parser.add_option("--json", default=None, metavar="PATH",
+        help="write results as JSON to PATH ('-' for stdout) rather than "
+        "printing a table")
+    options, args = parser.parse_args(argv)
+
+    names = None
+    if options.suites is not None:
+        names = [x.strip() for x in options.suites.split(",") if x.strip()]
+    try:
+        results = run(names,
+            [x.strip() for x in options.formats.split(",") if x.strip()],
+            size=(options.size << 20),
+            workers=[int(x) for x in options.workers.split(",")],
+            level=options.level, repeat=options.repeat,
+            directory=options.dir)
+    except ValueError, e:
+        parser.error(str(e))
+
+    if options.json is not None:
+        data = {'format': 1, 'environment': environment(), 'results': results}
+        if options.json == '-':
+            json.dump(data, out, indent=2, sort_keys=True)
+            out.write("\n")
+        else:
+            f = open(options.json, 'w')
+            try:
+                json.dump(data, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+        return 0
+
+    for name, columns in suites:
+        if name not in results:
+            continue
+        out.write("%s:\n" % (name,))
+        # '%7.2f' -> '%7s'; headers share the width of their column.
+        out.write(" ".join("%%%ss" % (fmt[1:].split('.')[0].rstrip('sif'),)
+            % (header,) for key, header, fmt in columns).rstrip() + "\n")
+        for result in results[name]:
+            out.write(" ".join(fmt % (result[key],)
+                for key, header, fmt in columns).rstrip() + "\n")
+        out.write("\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -41,18 +41,35 @@ TypeError:
 we caught the exception.
 """
 
-__all__ = ("base", "bz2_source", "data_source", "local_source", "text_data_source",
-    "bytes_data_source", "invokable_data_source")
+__all__ = ("base", "bz2_source", "compressed_source", "data_source",
+    "gzip_source", "local_source", "mmap_source", "text_data_source",
+    "bytes_data_source", "invokable_data_source", "xz_source")
 
 import errno
+import io
+import os
+import stat
+import threading
 
 from snakeoil.currying import post_curry, partial
 from snakeoil import compatibility, demandload, stringio, klass
+from snakeoil.weakrefs import WeakRefFinalizer
 demandload.demandload(globals(),
     'codecs',
-    'snakeoil:compression,fileutils',
+    'snakeoil:compression,fileutils,osutils',
 )
 
+_empty = compatibility.force_bytes('')
+
+#: default size of the chunks :py:meth:`base.iter_chunks` yields
+chunk_size = 1 << 17
+
+# py2.6 lacks memoryview; buffer objects are the closest equivalent.
+try:
+    _memoryview = memoryview
+except NameError:
+    _memoryview = None
+
 
 def _mk_writable_cls(base, name):
     """
@@ -173,25 +190,76 @@ class base(object):
         """
         raise NotImplementedError(self, "bytes_fileobj")
 
+    def _raw_fileobj(self):
+        # bytes level handle used for chunked reads; overridable for sources
+        # able to supply a cheaper handle than bytes_fileobj.
+        return self.bytes_fileobj()
+
+    def iter_chunks(self, size=chunk_size, buf=None):
+        """iterate over the bytes content of this data in chunks
+
+        Chunks are memoryviews of at most `size` bytes, sliced directly from
+        the backing data where the source allows it; buffer objects are
+        used where memoryviews can't be (py2.6, py2k mmaps).  Note that
+        under py2k many consumers (StringIO, zlib) reject memoryviews.
+
+        :param size: maximum size of each chunk
+        :param buf: optional writable buffer, a bytearray for example, to
+            read into rather than allocating per chunk.  If given, chunks are
+            at most len(buf) bytes, and each is only valid until the next is
+            requested.  Sources already holding their content in memory
+            (:py:class:`data_source`, :py:class:`mmap_source`) treat it as a
+            hint, handing out views of that content rather than copying.
+        :return: iterator of chunks
+        """
+        return _iter_fileobj_chunks(self._raw_fileobj, size, buf)
+
+    def readinto(self, buf, offset=0):
+        """read the bytes content of this data into a writable buffer
+
+        :param buf: writable buffer to fill
+        :param offset: position within the data to start reading from
+        :return: number of bytes read; less than len(buf) only if the end
+            of the data was reached
+        """
+        handle = self._raw_fileobj()
+        try:
+            if offset:
+                handle.seek(offset)
+            return _readinto_fileobj(handle, buf)
+        finally:
+            handle.close()
+
     def transfer_to_path(self, path):
         return self.transfer_to_data_source(
             local_source(path, mutable=True, encoding=None))
 
     def transfer_to_data_source(self, write_source):
-        read_f, m, write_f = None, None, None
+        read_f, write_f = None, None
         try:
             write_f = write_source.bytes_fileobj(True)
+            write_fd = _fileno(write_f)
             if self.path is not None:
-                m, read_f = fileutils.mmap_or_open_for_read(self.path)
-            else:
-                read_f = self.bytes_fileobj()
-
-            if read_f is not None:
-                transfer_between_files(read_f, write_f)
+                if write_fd is not None:
+                    # both ends are real files; let the kernel do the copy.
+                    read_f = open(self.path, 'rb')
+                    write_f.flush()
+                    osutils.copy_data(read_f.fileno(), write_fd)
+                    return
+                # the ondisk content, as is; for bz2_source that's the
+                # compressed form.
+                chunks = _iter_fileobj_chunks(
+                    partial(open_file, self.path, 'rb', 0), chunk_size, None)
             else:
-                write_f.write(m)
+                chunks = self.iter_chunks()
+            write = write_f.write
+            if write_fd is None:
+                # in memory handles want strings, not buffers.
+                write = lambda chunk: write_f.write(_tobytes(chunk))
+            for chunk in chunks:
+                write(chunk)
         finally:
-            for x in (read_f, write_f, m):
+            for x in (read_f, write_f):
                 if x is None:
                     continue
                 try:
@@ -256,16 +324,412 @@ class local_source(base):
                 raise
             return open_file(self.path, 'wb+', self.buffering_window)
 
+    def _raw_fileobj(self):
+        # reads are chunk sized already; buffering would only add a copy.
+        return open_file(self.path, 'rb', 0)
+
+
+def _map_view(data, offset=0, size=None):
+    # py2k mmap objects only support the old buffer protocol.
+    try:
+        view = _memoryview(data)
+    except TypeError:
+        if size is None:
+            return buffer(data, offset)
+        return buffer(data, offset, size)
+    if size is None:
+        return view[offset:]
+    return view[offset:offset + size]
+
+
+class _mmap_fileobj(io.RawIOBase):
+
+    """readonly file object over the mapping of a :py:class:`mmap_source`"""
+
+    exceptions = (EnvironmentError, TypeError, ValueError)
+
+    def __init__(self, source):
+        io.RawIOBase.__init__(self)
+        self._source = source
+        self._map = source.acquire()
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def write(self, data):
+        raise TypeError("%s isn't opened for writing" % (self,))
+
+    writelines = truncate = write
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        self._checkClosed()
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._map)
+        elif whence != 0:
+            raise ValueError("invalid whence %r" % (whence,))
+        if offset < 0:
+            raise ValueError("negative seek position %r" % (offset,))
+        self._pos = offset
+        return offset
+
+    def read(self, size=-1):
+        self._checkClosed()
+        start = min(self._pos, len(self._map))
+        end = len(self._map)
+        if size is not None and size >= 0:
+            end = min(start + size, end)
+        self._pos = end
+        return self._map[start:end]
+
+    readall = read
+
+    def readinto(self, buf):
+        self._checkClosed()
+        view = _memoryview(buf)
+        count = max(min(len(view), len(self._map) - self._pos), 0)
+        view[:count] = _map_view(self._map, self._pos, count)
+        self._pos += count
+        return count
+
+    def readline(self, size=-1):
+        self._checkClosed()
+        start = min(self._pos, len(self._map))
+        end = self._map.find(compatibility.force_bytes("\n"), start) + 1
+        if end <= 0:
+            end = len(self._map)
+        if size is not None and size >= 0:
+            end = min(start + size, end)
+        self._pos = end
+        return self._map[start:end]
+
+    def close(self):
+        if not self.closed:
+            self._map = None
+            self._source.release()
+        io.RawIOBase.close(self)
+
+
+class mmap_source(base):
+
+    """locally accessible file, memory mapped once and shared between readers
+
+    The mapping is created when the first reference is taken and unmapped
+    once the last is dropped; handles from :py:meth:`bytes_fileobj` and
+    :py:meth:`text_fileobj`, and :py:meth:`iter_chunks` iteration, each hold
+    a reference for their lifetime.  Callers reading the file repeatedly
+    should hold a reference via :py:meth:`acquire` to keep it mapped
+    between reads.
+
+    Note this is readonly; the file shouldn't be modified while mapped.
+    """
+
+    __slots__ = ("path", "encoding", "_map", "_refs", "_lock")
+
+    def __init__(self, path, encoding=None):
+        """
+        :param path: file path of the data source
+        :param encoding: the text encoding to force, if any
+        """
+        base.__init__(self)
+        self.path = path
+        self.encoding = encoding
+        self._map = None
+        self._refs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def refs(self):
+        """number of references currently held on the mapping"""
+        return self._refs
+
+    def acquire(self):
+        """take a reference to the mapping, mapping the file if necessary
 
-class bz2_source(base):
+        Each call must be paired with a :py:meth:`release`.
+
+        :return: the mapping
+        """
+        self._lock.acquire()
+        try:
+            if self._map is None:
+                m, f = fileutils.mmap_or_open_for_read(self.path)
+                if m is None:
+                    # empty files can't be mapped.
+                    f.close()
+                    m = compatibility.force_bytes('')
+                self._map = m
+            self._refs += 1
+            return self._map
+        finally:
+            self._lock.release()
+
+    def release(self):
+        """drop a reference taken via :py:meth:`acquire`
+
+        The file is unmapped once no references remain; any views of the
+        mapping are invalid from that point on.
+        """
+        self._lock.acquire()
+        try:
+            if self._refs <= 0:
+                raise ValueError("%r has no references to release" % (self,))
+            self._refs -= 1
+            if self._refs:
+                return
+            m, self._map = self._map, None
+        finally:
+            self._lock.release()
+        if hasattr(m, 'close'):
+            try:
+                m.close()
+            except BufferError:
+                # views are still exported; the mapping goes once they do.
+                pass
+
+    def view(self, offset=0, length=None):
+        """zero copy view of part of the file
+
+        A reference must be held (see :py:meth:`acquire`) for as long as the
+        view is used.
+
+        :param offset: start of the view
+        :param length: length of the view; defaults to the rest of the file
+        :return: a memoryview, or a buffer object under py2k
+        """
+        if self._map is None:
+            raise ValueError("%r isn't mapped; acquire a reference first"
+                % (self,))
+        return _map_view(self._map, offset, length)
+
+    @klass.steal_docs(base)
+    def bytes_fileobj(self, writable=False):
+        if writable:
+            raise TypeError("data source %s is immutable" % (self,))
+        return _mmap_fileobj(self)
+
+    @klass.steal_docs(base)
+    def text_fileobj(self, writable=False):
+        handle = self.bytes_fileobj(writable)
+        if compatibility.is_py3k:
+            return io.TextIOWrapper(io.BufferedReader(handle),
+                encoding=self.encoding)
+        if self.encoding:
+            return codecs.getreader(self.encoding)(handle)
+        return handle
+
+    _raw_fileobj = bytes_fileobj
+
+    @klass.steal_docs(base)
+    def iter_chunks(self, size=chunk_size, buf=None):
+        # views of the map beat copying into buf; just honor its length.
+        if buf is not None:
+            size = min(size, len(buf))
+        m = self.acquire()
+        try:
+            offset = 0
+            while offset < len(m):
+                yield _map_view(m, offset, size)
+                offset += size
+        finally:
+            self.release()
+
+    @klass.steal_docs(base)
+    def readinto(self, buf, offset=0):
+        m = self.acquire()
+        try:
+            view = _memoryview(buf)
+            count = max(min(len(view), len(m) - offset), 0)
+            view[:count] = _map_view(m, offset, count)
+            return count
+        finally:
+            self.release()
+
+
+class _rewrite_fileobj(object):
+
+    """writable handle over a compressed file, compressing as it's written
+
+    Behaves as an uncompressed file opened 'rb+' would: writes overwrite the
+    existing content from the start, reads return the existing content at
+    the current position, and existing content past the last position
+    written is kept.  Everything is streamed- the existing content is
+    decompressed, and the output compressed, incrementally- into a
+    replacement that atomically takes the file's place upon close.
+
+    Seeking backwards isn't possible.  If the handle is discarded without
+    being closed, the file is left untouched.
     """
-    locally accessible bz2 archive
 
-    Literally a bz2 file on disk.
+    __metaclass__ = WeakRefFinalizer
+
+    exceptions = (EnvironmentError, TypeError, ValueError)
+
+    def __init__(self, path, compressor_type):
+        self.closed = True
+        self._original = None
+        self._target = None
+        perms = None
+        try:
+            self._original = compression.decompress_handle(compressor_type,
+                path)
+            perms = stat.S_IMODE(os.stat(path).st_mode)
+        except EnvironmentError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        try:
+            self._target = fileutils.AtomicWriteFile(path, binary=True,
+                perms=perms)
+            self._output = compression.compress_handle(compressor_type,
+                self._target)
+        except:
+            self._discard()
+            raise
+        # logical position, and how much has been written to the output;
+        # they differ only when seeking past the end of the content.
+        self.position = self._written = 0
+        self.closed = False
+
+    def _check(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed handle %s" % (self,))
+
+    def _passthrough(self, size):
+        # copy existing content to the output, returning it.
+        if self._original is None or self.position != self._written:
+            return _empty
+        data = self._original.read(size)
+        if not data:
+            self._original.close()
+            self._original = None
+            return _empty
+        self._output.write(data)
+        self._written += len(data)
+        self.position = self._written
+        return data
+
+    def read(self, size=-1):
+        self._check()
+        if size is not None and size >= 0:
+            return self._passthrough(size)
+        chunks = []
+        data = self._passthrough(chunk_size)
+        while data:
+            chunks.append(data)
+            data = self._passthrough(chunk_size)
+        return _empty.join(chunks)
+
+    def write(self, data):
+        self._check()
+        if self.position > self._written:
+            # fill the hole left by seeking past the end.
+            self._output.write(
+                compatibility.force_bytes('\0') * (self.position - self._written))
+        self._output.write(data)
+        self._written = self.position = self.position + len(data)
+        # drop the existing content we just overwrote.
+        remaining = len(data)
+        while remaining and self._original is not None:
+            skipped = len(self._original.read(min(remaining, chunk_size)))
+            if not skipped:
+                self._original.close()
+                self._original = None
+            remaining -= skipped
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        self._check()
+        if whence == 1:
+            offset += self.position
+        elif whence != 0:
+            raise ValueError("whence must be 0 or 1, got %r" % (whence,))
+        if offset < self.position:
+            raise TypeError("instance %s can't do negative seeks: asked for "
+                "%i, was at %i" % (self, offset, self.position))
+        while self.position < offset and \
+            self._passthrough(min(offset - self.position, chunk_size)):
+            pass
+        self.position = offset
+        return offset
+
+    def flush(self):
+        self._check()
+        self._output.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            while self._passthrough(chunk_size):
+                pass
+            self._output.close()
+        except:
+            self._discard()
+            raise
+        self.closed = True
+        self._target.close()
+
+    def _discard(self):
+        self.closed = True
+        if self._original is not None:
+            self._original.close()
+            self._original = None
+        if self._target is not None:
+            self._target.discard()
+
+    __del__ = _discard
+
+
+class _decompressed_fileobj(object):
+
+    """readonly wrapper of a decompression handle, as data_sources hand out"""
+
+    exceptions = _rewrite_fileobj.exceptions
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    def write(self, data):
+        raise TypeError("%s isn't opened for writing" % (self,))
+
+    writelines = truncate = write
+
+    def __iter__(self):
+        return iter(self._handle)
+
+    __getattr__ = klass.GetAttrProxy("_handle")
+
+
+class compressed_source(base):
+
+    """locally accessible compressed file
+
+    Reads decompress incrementally, and writable handles compress straight
+    through into a replacement of the file, which takes its place upon
+    close; memory usage is bounded regardless of file size.  Writable
+    handles behave as an uncompressed file opened 'rb+' would, save that
+    they can't seek backwards.
+
+    Derivatives set :py:attr:`compressor_type`.
+
+    :ivar compressor_type: :py:mod:`snakeoil.compression` format of the file
     """
 
     __slots__ = ("path", "mutable")
 
+    compressor_type = None
+
     def __init__(self, path, mutable=False):
         """
         :param path: file path of the data source
@@ -275,30 +739,59 @@ class bz2_source(base):
         self.path = path
         self.mutable = mutable
 
+    @klass.steal_docs(base)
     def text_fileobj(self, writable=False):
-        data = compression.decompress_data('bzip2',
-            fileutils.readfile_bytes(self.path)).decode()
-        if writable:
-            if not self.mutable:
-                raise TypeError("data source %s is not mutable" % (self,))
-            return text_wr_StringIO(self._set_data, data)
-        return text_ro_StringIO(data)
+        handle = self.bytes_fileobj(writable)
+        if compatibility.is_py3k:
+            if writable:
+                return codecs.getwriter('utf8')(handle)
+            return codecs.getreader('utf8')(handle)
+        return handle
 
+    @klass.steal_docs(base)
     def bytes_fileobj(self, writable=False):
-        data = compression.decompress_data('bzip2',
-            fileutils.readfile_bytes(self.path))
         if writable:
             if not self.mutable:
                 raise TypeError("data source %s is not mutable" % (self,))
-            return bytes_wr_StringIO(self._set_data, data)
-        return bytes_ro_StringIO(data)
+            return _rewrite_fileobj(self.path, self.compressor_type)
+        return _decompressed_fileobj(compression.decompress_handle(
+            self.compressor_type, self.path))
 
-    def _set_data(self, data):
-        if compatibility.is_py3k:
-            if isinstance(data, str):
-                data = data.encode()
-        open(self.path, "wb").write(
-            compression.compress_data('bzip2', data))
+    @klass.steal_docs(base)
+    def iter_chunks(self, size=chunk_size, buf=None):
+        if buf is not None and _memoryview is not None:
+            return _iter_fileobj_chunks(self.bytes_fileobj, size, buf)
+        return _iter_split(compression.iter_decompress(self.compressor_type,
+            self.path, blocksize=size), size)
+
+
+class bz2_source(compressed_source):
+    """
+    locally accessible bz2 archive
+
+    Literally a bz2 file on disk.
+    """
+
+    __slots__ = ()
+    compressor_type = 'bzip2'
+
+
+class gzip_source(compressed_source):
+    """
+    locally accessible gzip archive
+    """
+
+    __slots__ = ()
+    compressor_type = 'gzip'
+
+
+class xz_source(compressed_source):
+    """
+    locally accessible xz archive
+    """
+
+    __slots__ = ()
+    compressor_type = 'xz'
 
 
 class data_source(base):
@@ -370,6 +863,21 @@ class data_source(base):
                 self._convert_data('bytes'))
         return bytes_ro_StringIO(self._convert_data('bytes'))
 
+    @klass.steal_docs(base)
+    def iter_chunks(self, size=chunk_size, buf=None):
+        # slices of the data itself; no copies at all.
+        if buf is not None:
+            size = min(size, len(buf))
+        return _iter_split([self._convert_data('bytes')], size)
+
+    @klass.steal_docs(base)
+    def readinto(self, buf, offset=0):
+        data = self._convert_data('bytes')
+        view = _memoryview(buf)
+        count = max(min(len(view), len(data) - offset), 0)
+        view[:count] = _view(data, offset, count)
+        return count
+
 
 if not compatibility.is_py3k:
     text_data_source = data_source
@@ -451,6 +959,9 @@ class invokable_data_source(data_source):
             raise TypeError("data source %s data is immutable" % (self,))
         return self.data(False)
 
+    iter_chunks = base.iter_chunks
+    readinto = base.readinto
+
     @classmethod
     def wrap_function(cls, invokable, returns_text=True, returns_handle=False, encoding_hint=None):
         """
@@ -500,6 +1011,78 @@ class invokable_data_source(data_source):
         return bytes_ro_StringIO(data)
 
 
+def _view(data, offset=0, size=None):
+    if _memoryview is not None:
+        if size is None:
+            return _memoryview(data)[offset:]
+        return _memoryview(data)[offset:offset + size]
+    if size is None:
+        return buffer(data, offset)
+    return buffer(data, offset, size)
+
+
+def _tobytes(chunk):
+    # str() of a py2k memoryview is its repr; buffers lack tobytes.
+    tobytes = getattr(chunk, 'tobytes', None)
+    if tobytes is None:
+        return str(chunk)
+    return tobytes()
+
+
+def _iter_split(chunks, size):
+    # split an iterable of strings into views of at most size bytes.
+    for chunk in chunks:
+        offset = 0
+        while offset < len(chunk):
+            yield _view(chunk, offset, size)
+            offset += size
+
+
+def _readinto_fileobj(handle, buf):
+    view = _memoryview(buf)
+    length = len(view)
+    readinto = getattr(handle, 'readinto', None)
+    total = 0
+    while total < length:
+        if readinto is not None:
+            count = readinto(view[total:])
+        else:
+            # StringIO and friends; a copy is unavoidable.
+            data = handle.read(length - total)
+            count = len(data)
+            view[total:total + count] = data
+        if not count:
+            break
+        total += count
+    return total
+
+
+def _iter_fileobj_chunks(opener, size, buf):
+    handle = opener()
+    try:
+        if buf is None or _memoryview is None:
+            data = handle.read(size)
+            while data:
+                yield _view(data)
+                data = handle.read(size)
+        else:
+            view = _memoryview(buf)
+            count = _readinto_fileobj(handle, view)
+            while count:
+                yield view[:count]
+                count = _readinto_fileobj(handle, view)
+    finally:
+        handle.close()
+
+
+def _fileno(handle):
+    try:
+        return handle.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        # py3k's io.UnsupportedOperation derives from ValueError.
+        return None
+
+
 def transfer_between_files(read_file, write_file, bufsize=(32 * 1024)):
     data = read_file.read(bufsize)
     while data:
@@ -194,6 +194,8 @@ kls_descriptors = frozenset([
         '__int__', '__long__', '__float__', '__oct__', '__hex__',
         '__coerce__', '__trunc__', '__radd__', '__floor__', '__ceil__',
         '__round__',
+        # context manager protocols...
+        '__enter__', '__exit__', '__aenter__', '__aexit__',
         # remaining...
         '__call__'])
 
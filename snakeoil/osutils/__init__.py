@@ -37,17 +37,23 @@ reading files, scanning directories, etc, these optimizations start adding up
 pretty quickly.
 """
 
-__all__ = ('abspath', 'abssymlink', 'ensure_dirs', 'join', 'pjoin',
+__all__ = ('abspath', 'abssymlink', 'ensure_dirs', 'ensure_dirs_many',
+    'join', 'pjoin',
     'listdir_files', 'listdir_dirs', 'listdir',
-    'readdir', 'normpath', 'unlink_if_exists',
+    'readdir', 'readdir_stat', 'normpath', 'unlink_if_exists', 'fadvise',
+    'copy_data',
+    'iter_tree', 'walk', 'CachedDirectoryView',
     'FsLock', 'GenericFailed',
-    'LockException', 'NonExistent',
+    'LockException', 'LockStats', 'NonExistent', 'lock_stats',
 )
 
 import errno
 import fcntl
 import os
+import Queue
 import stat
+import threading
+import time
 
 # imported for compatibility.  Will be removed in 0.5
 from snakeoil.fileutils import (
@@ -73,9 +79,13 @@ listdir = module.listdir
 listdir_dirs = module.listdir_dirs
 listdir_files = module.listdir_files
 readdir = module.readdir
+_stat_dir = module.stat_dir
 
 del module
 
+from snakeoil.osutils import _inotify
+from snakeoil.osutils.native_readdir import DirStats
+
 def _safe_mkdir(path, mode):
     try:
         os.mkdir(path, mode)
@@ -87,6 +97,16 @@ def _safe_mkdir(path, mode):
             return False
     return True
 
+def _fix_perms(path, st, gid, uid, mode, minimal):
+    if ((gid != -1 and gid != st.st_gid) or
+        (uid != -1 and uid != st.st_uid)):
+        os.chown(path, uid, gid)
+    if minimal:
+        if mode != (st.st_mode & mode):
+            os.chmod(path, st.st_mode | mode)
+    elif mode != (st.st_mode & 07777):
+        os.chmod(path, mode)
+
 def ensure_dirs(path, gid=-1, uid=-1, mode=0777, minimal=True):
     """
     ensure dirs exist, creating as needed with (optional) gid, uid, and mode.
@@ -165,19 +185,220 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0777, minimal=True):
         return True
     else:
         try:
-            if ((gid != -1 and gid != st.st_gid) or
-                (uid != -1 and uid != st.st_uid)):
-                os.chown(path, uid, gid)
-            if minimal:
-                if mode != (st.st_mode & mode):
-                    os.chmod(path, st.st_mode | mode)
-            elif mode != (st.st_mode & 07777):
-                os.chmod(path, mode)
+            _fix_perms(path, st, gid, uid, mode, minimal)
         except OSError:
             return False
     return True
 
 
+if getattr(os, 'supports_dir_fd', ()) and os.mkdir in os.supports_dir_fd:
+    # py3.3 and up.
+    def _mkdirat(dir_fd, name, mode):
+        os.mkdir(name, mode, dir_fd=dir_fd)
+    def _openat(dir_fd, name, flags):
+        return os.open(name, flags, dir_fd=dir_fd)
+    _O_PATH = getattr(os, 'O_PATH', 0)
+else:
+    try:
+        from snakeoil._posix import mkdirat as _mkdirat, openat as _openat
+        from snakeoil import _posix
+        _O_PATH = getattr(_posix, 'O_PATH', 0)
+        del _posix
+    except ImportError:
+        _mkdirat = _openat = None
+
+
+class _fd_dir_ops(object):
+
+    # directories are held open, children created and opened relative to
+    # them; O_PATH where available, so unreadable (0300) dirs can be held.
+    flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+    if _openat is not None:
+        flags |= _O_PATH
+
+    @staticmethod
+    def root():
+        return os.open(os.path.sep, _fd_dir_ops.flags)
+
+    @staticmethod
+    def open(parent, name):
+        fd = _openat(parent, name, _fd_dir_ops.flags)
+        try:
+            return fd, os.fstat(fd)
+        except EnvironmentError:
+            os.close(fd)
+            raise
+
+    @staticmethod
+    def mkdir(parent, name, mode):
+        _mkdirat(parent, name, mode)
+
+    close = staticmethod(os.close)
+
+
+class _path_dir_ops(object):
+
+    # fallback lacking *at support; handles are the paths themselves.
+
+    @staticmethod
+    def root():
+        return os.path.sep
+
+    @staticmethod
+    def open(parent, name):
+        path = join(parent, name)
+        st = os.stat(path)
+        if not stat.S_ISDIR(st.st_mode):
+            raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return path, st
+
+    @staticmethod
+    def mkdir(parent, name, mode):
+        os.mkdir(join(parent, name), mode)
+
+    @staticmethod
+    def close(handle):
+        pass
+
+
+def ensure_dirs_many(paths, gid=-1, uid=-1, mode=0777, minimal=True):
+    """
+    :py:func:`ensure_dirs` for many paths at once
+
+    Existing paths cost a stat apiece, as with :py:func:`ensure_dirs`.  The
+    rest are normalized, deduplicated, and walked in depth first order, so
+    each directory is checked (or created) once no matter how many of the
+    paths share it; where supported, components are opened and created
+    relative to their parent's fd rather than resolving the full path each
+    time.  The umask is cleared once for the lot, and permissions
+    temporarily added to parents are restored at the end.
+
+    As with :py:func:`ensure_dirs`, created directories get `mode`, `uid`,
+    and `gid`, and the same permission fixes are applied to already
+    existing targets.
+
+    :param paths: iterable of directories to ensure exist
+    :return: list of the paths that couldn't be created or fixed; empty on
+        success
+    """
+    failed = []
+    sep = os.path.sep
+    cwd = None
+    missing = {}
+    # as with ensure_dirs, existing targets only cost a stat.
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            apath = path
+            if not path.startswith(sep):
+                if cwd is None:
+                    cwd = os.getcwd()
+                apath = join(cwd, path)
+            missing.setdefault(normpath(apath), []).append(path)
+            continue
+        try:
+            if not stat.S_ISDIR(st.st_mode):
+                failed.append(path)
+            else:
+                _fix_perms(path, st, gid, uid, mode, minimal)
+        except EnvironmentError:
+            failed.append(path)
+    if not missing:
+        return failed
+
+    ops = _path_dir_ops
+    if _openat is not None:
+        ops = _fd_dir_ops
+    # depth first; '/a', '/a/b', '/a-b' rather than '/a', '/a-b', '/a/b'.
+    # null can't occur in paths, and sorts before everything.
+    ordered = sorted(missing, key=lambda x: x.replace(sep, '\0'))
+    # if the dir perms would lack +wx, we have to force it
+    force_temp_perms = ((mode & 0300) != 0300)
+    chown = (uid != -1 or gid != -1)
+    missing_failed = set()
+    # (path, mode to restore, target responsible)
+    resets = []
+    # (name, handle, path, setgid) of each directory currently descended.
+    stack = []
+
+    um = os.umask(0)
+    try:
+        root = ops.root()
+        try:
+            for index, target in enumerate(ordered):
+                # whether later targets descend into this one.
+                parent_of_next = (index + 1 < len(ordered) and
+                    ordered[index + 1].startswith(join(target, '')))
+                names = [x for x in target.split(sep) if x]
+                depth = 0
+                while depth < len(stack) and depth < len(names) and \
+                    stack[depth][0] == names[depth]:
+                    depth += 1
+                while len(stack) > depth:
+                    ops.close(stack.pop()[1])
+
+                try:
+                    for name in names[depth:]:
+                        parent, parent_path, sgid = root, sep, False
+                        if stack:
+                            parent, parent_path, sgid = stack[-1][1:]
+                        path = join(parent_path, name)
+                        is_target = (path == target)
+                        try:
+                            handle, st = ops.open(parent, name)
+                        except EnvironmentError, e:
+                            if e.errno != errno.ENOENT:
+                                raise
+                            try:
+                                if force_temp_perms:
+                                    ops.mkdir(parent, name, 0700)
+                                else:
+                                    ops.mkdir(parent, name, mode)
+                            except EnvironmentError, e:
+                                # created by someone else meanwhile; fine.
+                                if e.errno != errno.EEXIST:
+                                    raise
+                            if chown:
+                                os.chown(path, uid, gid)
+                            if force_temp_perms:
+                                resets.append((path, mode, target))
+                            elif sgid or (mode & 07000):
+                                # a setgid parent is inherited; enforce mode.
+                                os.chmod(path, mode)
+                            if is_target and not parent_of_next:
+                                # a leaf; no need to hold it open.
+                                continue
+                            handle, st = ops.open(parent, name)
+                        else:
+                            if is_target:
+                                _fix_perms(path, st, gid, uid, mode, minimal)
+                            elif (st.st_mode & 0300) != 0300:
+                                # it's a parent, we need +wx at least
+                                os.chmod(path, st.st_mode | 0300)
+                                resets.append((path, st.st_mode, target))
+                        stack.append((name, handle, path,
+                            bool(st.st_mode & stat.S_ISGID)))
+                except EnvironmentError:
+                    missing_failed.add(target)
+        finally:
+            while stack:
+                ops.close(stack.pop()[1])
+            ops.close(root)
+
+        for path, m, target in reversed(resets):
+            try:
+                os.chmod(path, m)
+            except EnvironmentError:
+                missing_failed.add(target)
+    finally:
+        os.umask(um)
+
+    for target in ordered:
+        if target in missing_failed:
+            failed.extend(missing[target])
+    return failed
+
 def abssymlink(path):
     """
     Return the absolute path of a symlink
@@ -239,6 +460,601 @@ except ImportError:
 # convenience.  importing join into a namespace is ugly, pjoin less so
 pjoin = join
 
+
+def native_fadvise(fd, offset, length, advice):
+    """
+    fallback for systems lacking posix_fadvise; does nothing
+
+    Advice is purely a hint, thus ignoring it is always safe.
+    """
+
+_fadvise_constants = ('POSIX_FADV_NORMAL', 'POSIX_FADV_SEQUENTIAL',
+    'POSIX_FADV_RANDOM', 'POSIX_FADV_NOREUSE', 'POSIX_FADV_WILLNEED',
+    'POSIX_FADV_DONTNEED')
+
+if hasattr(os, 'posix_fadvise'):
+    # py3.3 and up.
+    fadvise = os.posix_fadvise
+    _fadvise_module = os
+else:
+    try:
+        from snakeoil._posix import fadvise
+        from snakeoil import _posix as _fadvise_module
+    except ImportError:
+        fadvise = native_fadvise
+        _fadvise_module = None
+
+#: True if :py:func:`fadvise` actually passes the advice to the kernel
+fadvise_supported = _fadvise_module is not None
+if fadvise_supported:
+    for _x in _fadvise_constants:
+        globals()[_x] = getattr(_fadvise_module, _x)
+else:
+    # values are irrelevant, but keep them distinct.
+    for _val, _x in enumerate(_fadvise_constants):
+        globals()[_x] = _val
+    del _val
+del _x, _fadvise_module
+
+if hasattr(os, 'copy_file_range'):
+    # py3.8 and up.
+    def _copy_file_range(src_fd, dst_fd, count):
+        return os.copy_file_range(src_fd, dst_fd, count)
+else:
+    try:
+        from snakeoil._posix import copy_file_range as _copy_file_range
+    except ImportError:
+        _copy_file_range = None
+
+if hasattr(os, 'sendfile'):
+    # py3.3 and up.
+    _sendfile = os.sendfile
+else:
+    try:
+        from snakeoil._posix import sendfile as _sendfile
+    except ImportError:
+        _sendfile = None
+
+# linux's FICLONE; _IOW(0x94, 9, int).
+_FICLONE = 0x40049409
+
+#: methods :py:func:`copy_data` tries, in order, if available
+copy_methods = ('reflink', 'copy_file_range', 'sendfile', 'readwrite')
+
+# errnos meaning the method isn't usable for this pair of fds, as opposed to
+# an actual IO failure.
+_copy_unsupported = frozenset(getattr(errno, _x) for _x in
+    ('ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY', 'EBADF',
+    'ESPIPE', 'ETXTBSY', 'EPERM') if hasattr(errno, _x))
+
+
+def _copy_reflink(src_fd, dst_fd, length):
+    # whole file clones only; partial clones need block aligned ranges.
+    try:
+        if os.lseek(src_fd, 0, os.SEEK_CUR) != 0 or \
+            os.lseek(dst_fd, 0, os.SEEK_CUR) != 0 or \
+            os.fstat(dst_fd).st_size != 0 or \
+            (length is not None and length != os.fstat(src_fd).st_size):
+            return 0, False
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+    except EnvironmentError, e:
+        if e.errno not in _copy_unsupported:
+            raise
+        return 0, False
+    size = os.fstat(src_fd).st_size
+    os.lseek(src_fd, size, os.SEEK_SET)
+    os.lseek(dst_fd, size, os.SEEK_SET)
+    return size, True
+
+
+def _copy_kernel(functor, src_fd, dst_fd, length):
+    copied = 0
+    blocksize = 1 << 30
+    while length is None or copied < length:
+        count = blocksize
+        if length is not None:
+            count = min(count, length - copied)
+        try:
+            ret = functor(src_fd, dst_fd, count)
+        except EnvironmentError, e:
+            # a failure on the first call means the method doesn't apply;
+            # mid copy, the fds may be in an inconsistent state.
+            if copied or e.errno not in _copy_unsupported:
+                raise
+            return 0, False
+        if not ret:
+            # some pseudo filesystems claim a size, yet copy_file_range
+            # returns nothing; read/write can still get at the content.
+            return copied, copied > 0 and length is None
+        copied += ret
+    return copied, True
+
+
+def _copy_sendfile(src_fd, dst_fd, count):
+    # sendfile leaves the source offset alone when given one explicitly.
+    offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+    ret = _sendfile(dst_fd, src_fd, offset, count)
+    os.lseek(src_fd, offset + ret, os.SEEK_SET)
+    return ret
+
+
+def _copy_readwrite(src_fd, dst_fd, length, blocksize=(1 << 20)):
+    copied = 0
+    while length is None or copied < length:
+        count = blocksize
+        if length is not None:
+            count = min(count, length - copied)
+        data = os.read(src_fd, count)
+        if not data:
+            break
+        while data:
+            written = os.write(dst_fd, data)
+            data = data[written:]
+            copied += written
+    return copied, True
+
+
+def copy_data(src_fd, dst_fd, length=None, methods=copy_methods):
+    """
+    copy data between file descriptors, within the kernel where possible
+
+    Copies from the current offset of `src_fd` to the current offset of
+    `dst_fd`, advancing both; the behaviour matches a read/write loop.
+
+    The methods tried, in order:
+
+    * ``reflink``: FICLONE, sharing the extents rather than copying them
+      (btrfs, xfs, ...); only when the whole of `src_fd` is being copied
+      into an empty `dst_fd`.
+    * ``copy_file_range``: in kernel copy between regular files; servers
+      and filesystems may offload it further.
+    * ``sendfile``: in kernel copy from a file to any fd.
+    * ``readwrite``: read/write via userland.
+
+    Methods unsupported by the platform, or refused for this pair of fds
+    (cross filesystem, an fd that isn't a regular file, etc), fall through to
+    the next.
+
+    :param src_fd: fd to read from
+    :param dst_fd: fd to write to
+    :param length: number of bytes to copy; if None, copy until EOF
+    :param methods: sequence of methods to try, a subset of
+        :py:data:`copy_methods`
+    :return: (bytes copied, method used)
+    """
+    copied = 0
+    for method in methods:
+        remaining = length
+        if length is not None:
+            remaining = length - copied
+        if method == 'reflink':
+            if copied:
+                continue
+            ret, done = _copy_reflink(src_fd, dst_fd, length)
+        elif method == 'copy_file_range':
+            if _copy_file_range is None:
+                continue
+            ret, done = _copy_kernel(_copy_file_range, src_fd, dst_fd,
+                remaining)
+        elif method == 'sendfile':
+            if _sendfile is None:
+                continue
+            ret, done = _copy_kernel(_copy_sendfile, src_fd, dst_fd,
+                remaining)
+        elif method == 'readwrite':
+            ret, done = _copy_readwrite(src_fd, dst_fd, remaining)
+        else:
+            raise ValueError("unknown copy method %r" % (method,))
+        copied += ret
+        if done:
+            return copied, method
+    raise ValueError("no usable copy method in %r" % (methods,))
+
+
+def readdir_stat(path, follow_symlinks=False):
+    """
+    Given a directory, return its entries along with their stat data
+
+    Every entry is stat'd (relative to the directory's fd when the extension
+    is available) in one call, with the results held packed rather than as
+    an os.stat_result apiece; see
+    :py:class:`snakeoil.osutils.native_readdir.DirStats`.
+
+    :param path: path of a directory to scan
+    :param follow_symlinks: stat what symlinks point at rather than the
+        symlinks themselves; dangling symlinks are reported as symlinks
+    :return: :py:class:`snakeoil.osutils.native_readdir.DirStats` instance
+    """
+    names, records = _stat_dir(path, follow_symlinks)
+    return DirStats(names, records)
+
+
+def _scan_dir(path, follow_symlinks):
+    # split a directory's entries into subdirectories to descend into,
+    # everything else as (name, kind), and the names of the subdirectories
+    # that are actually symlinks.
+    dirs, others, links = [], [], ()
+    for name, kind in readdir(path):
+        if kind == 'directory':
+            dirs.append(name)
+        elif kind == 'symlink' and follow_symlinks:
+            try:
+                is_dir = stat.S_ISDIR(os.stat(join(path, name)).st_mode)
+            except EnvironmentError:
+                # dangling, or a loop.
+                is_dir = False
+            if is_dir:
+                dirs.append(name)
+                if not links:
+                    links = set()
+                links.add(name)
+            else:
+                others.append((name, kind))
+        else:
+            others.append((name, kind))
+    return dirs, others, links
+
+
+def _scan_worker(tasks, results, follow_symlinks):
+    while True:
+        path = tasks.get()
+        if path is None:
+            return
+        try:
+            results.put((path, _scan_dir(path, follow_symlinks)))
+        except Exception, e:
+            results.put((path, e))
+
+
+def _iter_scans(top, follow_symlinks, workers, onerror):
+    # yield (dirpath, dirnames, others, links) top down; dirnames may be
+    # modified by the consumer before resuming us, controlling what's
+    # descended into.
+    visited = set()
+
+    def unvisited(path):
+        # only needed when following symlinks, where loops are possible.
+        if not follow_symlinks:
+            return True
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            return True
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
+    if workers <= 1:
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if not unvisited(path):
+                continue
+            try:
+                dirs, others, links = _scan_dir(path, follow_symlinks)
+            except EnvironmentError, e:
+                if onerror is not None:
+                    onerror(e)
+                continue
+            yield path, dirs, others, links
+            stack.extend(join(path, x) for x in reversed(dirs))
+        return
+
+    tasks, results = Queue.Queue(), Queue.Queue()
+    threads = []
+    for x in xrange(workers):
+        thread = threading.Thread(target=_scan_worker,
+            args=(tasks, results, follow_symlinks))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        pending = 0
+        if unvisited(top):
+            tasks.put(top)
+            pending = 1
+        while pending:
+            path, result = results.get()
+            pending -= 1
+            if isinstance(result, Exception):
+                if not isinstance(result, EnvironmentError):
+                    raise result
+                if onerror is not None:
+                    onerror(result)
+                continue
+            dirs, others, links = result
+            yield path, dirs, others, links
+            for name in dirs:
+                subdir = join(path, name)
+                if unvisited(subdir):
+                    tasks.put(subdir)
+                    pending += 1
+    finally:
+        # abandoned scans are drained by the workers exiting.
+        for thread in threads:
+            tasks.put(None)
+
+
+def iter_tree(top, prune=None, follow_symlinks=False, workers=1,
+    onerror=None):
+    """
+    stream every entry beneath a directory
+
+    Entry types come from :py:func:`readdir`, thus from d_type where the
+    filesystem provides it; nothing is stat'd unless symlinks are being
+    followed.
+
+    With multiple workers, directories are scanned concurrently (the C
+    readdir releases the GIL), and entries are yielded in whatever order
+    the scans complete; otherwise the order is depth first.
+
+    :param top: directory to walk
+    :param prune: if given, a callable invoked with the path of each
+        directory found; if it returns True, that directory isn't descended
+        into (it's still yielded)
+    :param follow_symlinks: if True, symlinks to directories are descended
+        into (still being reported as symlinks).  Each directory is only
+        descended into once, however it's reached; this breaks loops.
+    :param workers: number of threads scanning directories
+    :param onerror: if given, invoked with the EnvironmentError for each
+        directory that couldn't be read; by default these are skipped, as
+        :py:func:`os.walk` does
+    :return: iterator of (dirpath, name, kind) tuples; kind is one of the
+        :py:data:`snakeoil.osutils.native_readdir.d_type_mapping` values
+    """
+    for dirpath, dirs, others, links in _iter_scans(top, follow_symlinks,
+        workers, onerror):
+        for name, kind in others:
+            yield dirpath, name, kind
+        for name in dirs:
+            if name in links:
+                yield dirpath, name, 'symlink'
+            else:
+                yield dirpath, name, 'directory'
+        if prune is not None:
+            dirs[:] = [x for x in dirs if not prune(join(dirpath, x))]
+
+
+def walk(top, topdown=True, follow_symlinks=False, workers=1, onerror=None):
+    """
+    :py:func:`os.walk` workalike built on :py:func:`readdir`
+
+    Yields (dirpath, dirnames, filenames) per directory, where filenames is
+    every non directory.  As with :py:func:`os.walk`, when topdown is True
+    dirnames may be modified in place to control what's descended into.
+
+    Unlike :py:func:`os.walk`, types come from d_type rather than a stat
+    per entry.  Thus symlinks to directories are listed in filenames unless
+    `follow_symlinks` is True, in which case they're in dirnames and
+    descended into; see :py:func:`iter_tree`.
+
+    :param topdown: if False, each directory is yielded after its
+        subdirectories; this requires `workers` be 1
+    :param workers: see :py:func:`iter_tree`; with more than one,
+        directories are yielded in the order their scans complete, parents
+        always before children
+    :param onerror: see :py:func:`iter_tree`
+    """
+    if topdown:
+        for dirpath, dirs, others, links in _iter_scans(top, follow_symlinks,
+            workers, onerror):
+            yield dirpath, dirs, [name for name, kind in others]
+        return
+    if workers > 1:
+        raise ValueError("bottom up walks can't be parallelized")
+    scans = _iter_scans(top, follow_symlinks, 1, onerror)
+    # the scans are depth first; hold each directory back until the scan
+    # moves out of it.
+    held = []
+    for dirpath, dirs, others, links in scans:
+        while held and not dirpath.startswith(join(held[-1][0], '')):
+            yield held.pop()
+        held.append((dirpath, dirs, [name for name, kind in others]))
+    while held:
+        yield held.pop()
+
+
+class CachedDirectoryView(object):
+
+    """
+    memoizing wrapper around :py:func:`listdir`, :py:func:`listdir_dirs`,
+    :py:func:`listdir_files`, and :py:func:`readdir`
+
+    Results are cached per directory until it changes.  Changes are noticed
+    via inotify where available: each access drains pending events
+    (nonblocking reads until none remain) and drops the affected
+    directories.  Where inotify is unavailable, or a watch can't be added
+    (the user's watch limit was hit, or `max_watches` were already added),
+    the directory's mtime is checked on every access instead.
+
+    Only the directory itself is watched; for listings following symlinks,
+    changes to what a symlink points at aren't noticed.  The mtime fallback
+    is only as precise as the filesystem's timestamps.
+
+    Results are copied on return, so callers may modify them.
+
+    :ivar hits: number of lookups answered from the cache
+    :ivar misses: number of lookups requiring a scan
+    :ivar invalidations: number of times a cached directory was dropped due
+        to it changing
+    """
+
+    __metaclass__ = WeakRefFinalizer
+
+    # what changes a listing; attribute changes can't change entry types.
+    _watch_mask = (_inotify.IN_CREATE | _inotify.IN_DELETE |
+        _inotify.IN_MOVED_FROM | _inotify.IN_MOVED_TO |
+        _inotify.IN_DELETE_SELF | _inotify.IN_MOVE_SELF | _inotify.IN_ONLYDIR)
+
+    def __init__(self, use_inotify=True, max_watches=None):
+        """
+        :param use_inotify: if False, always use the mtime fallback
+        :param max_watches: maximum number of inotify watches to use; the
+            mtime fallback is used for directories beyond that
+        """
+        self.max_watches = max_watches
+        self.hits = self.misses = self.invalidations = 0
+        # path -> (mtime token or None if watched, {key: result})
+        self._entries = {}
+        # wd -> set of paths; a path and its symlinks share a wd.
+        self._wds = {}
+        self._path_wds = {}
+        self._lock = threading.RLock()
+        self._inotify = None
+        if use_inotify:
+            if _inotify.available():
+                try:
+                    self._inotify = _inotify.Inotify()
+                except EnvironmentError:
+                    pass
+
+    @property
+    def watched(self):
+        """number of directories watched via inotify"""
+        return len(self._path_wds)
+
+    def listdir(self, path):
+        return self._lookup(path, ('listdir',), listdir, path)
+
+    def listdir_dirs(self, path, followSymlinks=True):
+        return self._lookup(path, ('dirs', bool(followSymlinks)),
+            listdir_dirs, path, followSymlinks)
+
+    def listdir_files(self, path, followSymlinks=True):
+        return self._lookup(path, ('files', bool(followSymlinks)),
+            listdir_files, path, followSymlinks)
+
+    def readdir(self, path):
+        return self._lookup(path, ('readdir',), readdir, path)
+
+    listdir.__doc__ = globals()['listdir'].__doc__
+    listdir_dirs.__doc__ = globals()['listdir_dirs'].__doc__
+    listdir_files.__doc__ = globals()['listdir_files'].__doc__
+    readdir.__doc__ = globals()['readdir'].__doc__
+
+    @staticmethod
+    def _stat_token(path):
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino, st.st_mtime, st.st_ctime)
+
+    def _watch(self, path):
+        # returns True if the path is now watched.
+        if self._inotify is None:
+            return False
+        if path in self._path_wds:
+            return True
+        if self.max_watches is not None and \
+            len(self._path_wds) >= self.max_watches:
+            return False
+        try:
+            wd = self._inotify.add_watch(path, self._watch_mask)
+        except EnvironmentError:
+            # ENOSPC/ENOMEM for watch limits; anything else (ENOENT say)
+            # surfaces from the scan itself.
+            return False
+        self._wds.setdefault(wd, set()).add(path)
+        self._path_wds[path] = wd
+        return True
+
+    def _unwatch(self, wd, remove=True):
+        for path in self._wds.pop(wd, ()):
+            self._path_wds.pop(path, None)
+            self._drop(path)
+        if remove:
+            try:
+                self._inotify.rm_watch(wd)
+            except EnvironmentError:
+                pass
+
+    def _drop(self, path):
+        if self._entries.pop(path, None) is not None:
+            self.invalidations += 1
+
+    def _process_events(self):
+        events = self._inotify.read_events()
+        for wd, mask, cookie, name in events:
+            if mask & _inotify.IN_Q_OVERFLOW:
+                # events were lost.
+                for path in list(self._path_wds):
+                    self._drop(path)
+            elif mask & _inotify.IN_IGNORED:
+                # the kernel removed the watch.
+                self._unwatch(wd, False)
+            elif mask & (_inotify.IN_DELETE_SELF | _inotify.IN_MOVE_SELF):
+                # the directory is gone, or elsewhere; our paths no longer
+                # refer to it.
+                self._unwatch(wd)
+            else:
+                for path in self._wds.get(wd, ()):
+                    self._drop(path)
+
+    def _lookup(self, path, key, functor, *args):
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try:
+            if self._inotify is not None:
+                self._process_events()
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] is not None:
+                try:
+                    token = self._stat_token(path)
+                except EnvironmentError:
+                    token = None
+                if token != entry[0]:
+                    self._drop(path)
+                    entry = None
+            if entry is not None and key in entry[1]:
+                self.hits += 1
+                return list(entry[1][key])
+            self.misses += 1
+            if entry is None:
+                # watch, or note the mtime, prior to scanning so that changes
+                # during the scan aren't missed.
+                token = None
+                if not self._watch(path):
+                    try:
+                        token = self._stat_token(path)
+                    except EnvironmentError:
+                        return functor(*args)
+                entry = self._entries[path] = (token, {})
+            result = entry[1][key] = functor(*args)
+            return list(result)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, path=None):
+        """
+        drop cached results for a directory, or for all if path is None
+        """
+        self._lock.acquire()
+        try:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        drop all cached results, and release the inotify instance
+        """
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._wds.clear()
+            self._path_wds.clear()
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+        finally:
+            self._lock.release()
+
+    __del__ = close
+
+
 class LockException(Exception):
     """Base lock exception class"""
     def __init__(self, path, reason):
@@ -266,20 +1082,227 @@ class GenericFailed(LockException):
             self.path, self.reason)
 
 
-# should the fd be left open indefinitely?
-# IMO, it shouldn't, but opening/closing everytime around is expensive
+class LockStats(object):
+
+    """
+    contention metrics for a lock path, across every :py:class:`FsLock` for it
+
+    :ivar acquisitions: number of locks acquired
+    :ivar contended: number of acquisitions (or failed attempts) that found
+        the lock held, and had to wait or give up
+    :ivar failures: number of attempts that gave up; nonblocking attempts
+        finding the lock held, and timeouts
+    :ivar wait_total: seconds spent waiting, in total
+    :ivar wait_max: longest wait in seconds
+    :ivar histogram: counts of waits per :py:attr:`buckets`; the final entry
+        counts waits beyond the last bound
+    """
+
+    __slots__ = ("path", "acquisitions", "contended", "failures",
+        "wait_total", "wait_max", "histogram")
+
+    #: upper bounds, in seconds, of the histogram buckets
+    buckets = (0.001, 0.01, 0.1, 1.0, 10.0)
+
+    def __init__(self, path):
+        self.path = path
+        self.acquisitions = self.contended = self.failures = 0
+        self.wait_total = self.wait_max = 0.0
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+    def record(self, waited, contended, acquired):
+        """
+        :param waited: seconds spent acquiring
+        :param contended: whether the lock was found held
+        :param acquired: whether the lock was acquired
+        """
+        if acquired:
+            self.acquisitions += 1
+        else:
+            self.failures += 1
+        if contended:
+            self.contended += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        for index, bound in enumerate(self.buckets):
+            if waited < bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.histogram[index] += 1
+
+    def __repr__(self):
+        return "<%s path=%r acquisitions=%i contended=%i failures=%i>" % (
+            self.__class__.__name__, self.path, self.acquisitions,
+            self.contended, self.failures)
+
+
+_lock_stats = {}
+_lock_states = {}
+_lock_states_lock = threading.Lock()
+# pid _lock_states belongs to; a forked child must not reuse the parent's
+# fds, as flock wouldn't exclude the two.
+_lock_states_pid = os.getpid()
+
+
+def lock_stats():
+    """
+    :return: dict of lock path to its :py:class:`LockStats`, for every path
+        an :py:class:`FsLock` was acquired on by this process
+    """
+    return dict(_lock_stats)
+
+
+class _LockState(object):
+
+    # process local state of a lock path, shared by every FsLock for it.
+    # flock locks belong to the open file, so holders within this process
+    # are tracked here, and only the transitions hit flock.
+
+    __slots__ = ("path", "fd", "pid", "refs", "readers", "writer", "busy",
+        "cond", "stats")
+
+    def __init__(self, path, fd):
+        self.path = path
+        self.fd = fd
+        self.pid = os.getpid()
+        self.refs = 0
+        self.readers = 0
+        self.writer = False
+        # a thread is changing the flock; others wait for it.
+        self.busy = False
+        self.cond = threading.Condition(threading.Lock())
+        self.stats = _lock_stats.get(path)
+        if self.stats is None:
+            self.stats = _lock_stats[path] = LockStats(path)
+
+
+def _get_lock_state(path, create):
+    global _lock_states_pid
+    _lock_states_lock.acquire()
+    try:
+        pid = os.getpid()
+        if pid != _lock_states_pid:
+            # forked; the inherited states are left to the FsLocks still
+            # referencing them.
+            _lock_states.clear()
+            _lock_states_pid = pid
+        state = _lock_states.get(path)
+        if state is None:
+            flags = os.R_OK
+            if create:
+                flags |= os.O_CREAT
+            try:
+                fd = os.open(path, flags)
+            except OSError, oe:
+                compatibility.raise_from(GenericFailed(path, oe))
+            state = _lock_states[path] = _LockState(path, fd)
+        state.refs += 1
+        return state
+    finally:
+        _lock_states_lock.release()
+
+
+def _put_lock_state(state):
+    _lock_states_lock.acquire()
+    try:
+        state.refs -= 1
+        if state.refs:
+            return
+        if _lock_states.get(state.path) is state:
+            del _lock_states[state.path]
+    finally:
+        _lock_states_lock.release()
+    os.close(state.fd)
+
+
+class _AsyncAcquire(object):
+
+    # awaitable polling for a lock with backoff, so the event loop is never
+    # blocked.  An iterator rather than a generator, since generators can't
+    # return values under py2k.
+
+    def __init__(self, lock, exclusive, timeout, result):
+        self.lock = lock
+        self.exclusive = exclusive
+        self.result = result
+        self.start = time.time()
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = self.start + timeout
+        self.delay = lock.backoff_min
+        self.contended = False
+
+    def __await__(self):
+        return self
+
+    __iter__ = __await__
+
+    def __next__(self):
+        lock = self.lock
+        if lock._attempt(self.exclusive)[0]:
+            lock._record(self.start, self.contended, True)
+            raise StopIteration(self.result)
+        self.contended = True
+        delay = self.delay
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                lock._record(self.start, True, False)
+                if self.result is lock:
+                    raise GenericFailed(lock.path,
+                        "timed out after %ss" % (self.deadline - self.start,))
+                raise StopIteration(False)
+            delay = min(delay, remaining)
+        self.delay = min(self.delay * 2, lock.backoff_max)
+        import asyncio
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        loop.call_later(delay, _wake, waiter)
+        # the future's own iterator yields it, telling the task to wait on it.
+        return next(iter(waiter))
+
+    next = __next__
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _Completed(object):
+
+    # awaitable resulting in None, immediately.
+
+    def __await__(self):
+        return iter(())
+
+_completed = _Completed()
 
 
 class FsLock(object):
 
     """
     fnctl based filesystem lock
+
+    Every FsLock for a path within this process shares one fd, reference
+    counted; the locks held are tracked process locally, so instances still
+    exclude each other as if they each had their own fd.  Acquisitions are
+    recorded in the path's :py:class:`LockStats`.
+
+    Supports ``async with``, taking a write lock without blocking the event
+    loop; see :py:meth:`acquire_write_lock_async`.
     """
 
     __metaclass__ = WeakRefFinalizer
-    __slots__ = ("path", "fd", "create")
+    __slots__ = ("path", "create", "timeout", "_state", "_held")
+
+    #: initial delay between attempts when polling, doubling each attempt
+    backoff_min = 0.001
+    #: maximum delay between attempts when polling
+    backoff_max = 0.1
 
-    def __init__(self, path, create=False):
+    def __init__(self, path, create=False, timeout=None):
         """
         :param path: fs path for the lock
         :param create: controls whether the file will be created
@@ -287,78 +1310,274 @@ class FsLock(object):
             If true, the base dir must exist, and it will create a file.
             If you want to lock via a dir, you have to ensure it exists
             (create doesn't suffice).
+        :param timeout: seconds ``async with`` waits for the lock before
+            raising :py:class:`GenericFailed`; None to wait indefinitely
         :raise NonExistent: if no file/dir exists for that path,
             and cannot be created
         """
         self.path = path
-        self.fd = None
         self.create = create
+        self.timeout = timeout
+        self._state = None
+        # None, or whether it's an exclusive lock we hold.
+        self._held = None
         if not create:
             if not os.path.exists(path):
                 raise NonExistent(path)
 
-    def _acquire_fd(self):
-        flags = os.R_OK
-        if self.create:
-            flags |= os.O_CREAT
+    @property
+    def fd(self):
+        """the shared fd for the lock, or None if it's not yet been used"""
+        if self._state is None:
+            return None
+        return self._state.fd
+
+    @property
+    def stats(self):
+        """:py:class:`LockStats` for this lock's path"""
+        if self._state is not None:
+            return self._state.stats
+        path = os.path.abspath(self.path)
+        stats = _lock_stats.get(path)
+        if stats is None:
+            stats = _lock_stats.setdefault(path, LockStats(path))
+        return stats
+
+    def _get_state(self):
+        if self._state is not None and self._state.pid != os.getpid():
+            # inherited across a fork; whatever the parent held isn't ours.
+            self._release()
+            _put_lock_state(self._state)
+            self._state = None
+        if self._state is None:
+            self._state = _get_lock_state(os.path.abspath(self.path),
+                self.create)
+        return self._state
+
+    def _flock(self, flags):
         try:
-            self.fd = os.open(self.path, flags)
-        except OSError, oe:
-            compatibility.raise_from(GenericFailed(self.path, oe))
-
-    def _enact_change(self, flags, blocking):
-        if self.fd is None:
-            self._acquire_fd()
-        # we do it this way, due to the fact try/except is a bit of a hit
-        if not blocking:
-            try:
-                fcntl.flock(self.fd, flags|fcntl.LOCK_NB)
-            except IOError, ie:
-                if ie.errno == errno.EAGAIN:
-                    return False
-                compatibility.raise_from(GenericFailed(self.path, ie))
-        else:
-            fcntl.flock(self.fd, flags)
+            fcntl.flock(self._state.fd, flags)
+        except IOError, ie:
+            if ie.errno == errno.EAGAIN:
+                return False
+            compatibility.raise_from(GenericFailed(self.path, ie))
         return True
 
-    def acquire_write_lock(self, blocking=True):
+    def _conflicts(self, exclusive):
+        # whether other holders within this process block us.
+        state = self._state
+        if exclusive:
+            readers = state.readers
+            if self._held is False:
+                readers -= 1
+            return readers > 0 or (state.writer and not self._held)
+        return state.writer and not self._held
+
+    def _update(self, exclusive):
+        state = self._state
+        if self._held is not None:
+            if self._held:
+                state.writer = False
+            else:
+                state.readers -= 1
+        if exclusive:
+            state.writer = True
+        else:
+            state.readers += 1
+        self._held = exclusive
+
+    def _attempt(self, exclusive, wait=False, deadline=None):
+        # returns (acquired, contended); only the local wait and the flock
+        # itself block, per wait and deadline.
+        state = self._get_state()
+        if self._held == exclusive:
+            return True, False
+        upgrade = exclusive and self._held is False
+        contended = False
+        state.cond.acquire()
+        try:
+            while state.busy or self._conflicts(exclusive):
+                contended = True
+                if not wait or (upgrade and state.readers > 1):
+                    # an upgrade waiting on other local readers deadlocks
+                    # if they upgrade too; fail it instead.
+                    return False, True
+                if deadline is None:
+                    state.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False, True
+                    state.cond.wait(remaining)
+            if not exclusive and self._held is None and state.readers:
+                # other readers hold LOCK_SH already; join them.
+                self._update(exclusive)
+                return True, contended
+            state.busy = True
+        finally:
+            state.cond.release()
+
+        flags = fcntl.LOCK_SH
+        if exclusive:
+            flags = fcntl.LOCK_EX
+        # whether a failed conversion lost the LOCK_SH we held.
+        lost = []
+
+        def try_flock():
+            if self._flock(flags|fcntl.LOCK_NB):
+                return True
+            if upgrade and not lost:
+                # a failed conversion may drop the LOCK_SH we held (linux
+                # does); take it back, without blocking.  If a writer got
+                # in first, the read lock is gone.
+                if not self._flock(fcntl.LOCK_SH|fcntl.LOCK_NB):
+                    lost.append(True)
+            return False
+
+        acquired = False
+        try:
+            acquired = try_flock()
+            if not acquired:
+                contended = True
+            if not acquired and wait:
+                if deadline is None:
+                    acquired = self._flock(flags)
+                else:
+                    delay = self.backoff_min
+                    while not acquired:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        time.sleep(min(delay, remaining))
+                        delay = min(delay * 2, self.backoff_max)
+                        acquired = try_flock()
+        finally:
+            state.cond.acquire()
+            try:
+                state.busy = False
+                if lost:
+                    state.readers -= 1
+                    self._held = None
+                if acquired:
+                    self._update(exclusive)
+                state.cond.notifyAll()
+            finally:
+                state.cond.release()
+        return acquired, contended
+
+    def _record(self, start, contended, acquired):
+        _lock_states_lock.acquire()
+        try:
+            self._state.stats.record(time.time() - start, contended, acquired)
+        finally:
+            _lock_states_lock.release()
+
+    def _acquire(self, exclusive, blocking, timeout):
+        start = time.time()
+        deadline = None
+        if timeout is not None:
+            deadline = start + timeout
+        acquired, contended = self._attempt(exclusive, blocking, deadline)
+        self._record(start, contended, acquired)
+        return acquired
+
+    def acquire_write_lock(self, blocking=True, timeout=None):
         """
         Acquire an exclusive lock
 
-        Note if you have a read lock, it implicitly upgrades atomically
+        Note if you have a read lock, it implicitly upgrades atomically.
+        Upgrades fail immediately, even if blocking, while other FsLocks in
+        this process hold read locks on the path.  A failed upgrade keeps
+        the read lock unless a writer elsewhere took the lock in between.
 
         :param blocking: if enabled, don't return until we have the lock
+        :param timeout: if blocking, give up after this many seconds; the
+            lock is polled with exponential backoff
+            (:py:attr:`backoff_min` to :py:attr:`backoff_max`)
         :return: True if lock is acquired, False if not.
         """
-        return self._enact_change(fcntl.LOCK_EX, blocking)
+        return self._acquire(True, blocking, timeout)
 
-    def acquire_read_lock(self, blocking=True):
+    def acquire_read_lock(self, blocking=True, timeout=None):
         """
         Acquire a shared lock
 
         Note if you have a write lock, it implicitly downgrades atomically
 
         :param blocking: if enabled, don't return until we have the lock
+        :param timeout: see :py:meth:`acquire_write_lock`
         :return: True if lock is acquired, False if not.
         """
-        return self._enact_change(fcntl.LOCK_SH, blocking)
+        return self._acquire(False, blocking, timeout)
+
+    def acquire_write_lock_async(self, timeout=None):
+        """
+        Acquire an exclusive lock from a coroutine, without blocking the
+        event loop
+
+        The lock is polled with exponential backoff; ``await`` the result.
+
+        :param timeout: give up after this many seconds
+        :return: awaitable resulting in True if the lock is acquired, False
+            if not
+        """
+        self._get_state()
+        return _AsyncAcquire(self, True, timeout, True)
+
+    def acquire_read_lock_async(self, timeout=None):
+        """
+        Acquire a shared lock from a coroutine, without blocking the event
+        loop; see :py:meth:`acquire_write_lock_async`
+        """
+        self._get_state()
+        return _AsyncAcquire(self, False, timeout, True)
+
+    def _release(self):
+        state = self._state
+        if state is None or self._held is None:
+            return
+        if state.pid != os.getpid():
+            # the fd is shared with the parent; unlocking it would drop the
+            # parent's lock.
+            self._held = None
+            return
+        state.cond.acquire()
+        try:
+            # the flock is dropped once the last local holder is gone.
+            if self._held:
+                state.writer = False
+            else:
+                state.readers -= 1
+            self._held = None
+            if not (state.writer or state.readers):
+                fcntl.flock(state.fd, fcntl.LOCK_UN)
+            state.cond.notifyAll()
+        finally:
+            state.cond.release()
 
     def release_write_lock(self):
         """Release an write/exclusive lock if held"""
-        self._enact_change(fcntl.LOCK_UN, False)
+        self._release()
 
     def release_read_lock(self):
         """Release an shared/read lock if held"""
-        self._enact_change(fcntl.LOCK_UN, False)
+        self._release()
+
+    def __aenter__(self):
+        self._get_state()
+        return _AsyncAcquire(self, True, self.timeout, self)
+
+    def __aexit__(self, exc_type, exc_value, traceback):
+        self._release()
+        return _completed
 
     def __del__(self):
-        # alright, it's 5:45am, yes this is weird code.
-        try:
-            if self.fd is not None:
-                self.release_read_lock()
-        finally:
-            if self.fd is not None:
-                os.close(self.fd)
+        if self._state is not None:
+            try:
+                self._release()
+            finally:
+                _put_lock_state(self._state)
+                self._state = None
 
 
 def fallback_access(path, mode, root=0):
@@ -0,0 +1,129 @@
+# License: GPL2/BSD
+
+"""
+minimal inotify bindings, via ctypes
+
+Only what :py:class:`snakeoil.osutils.CachedDirectoryView` needs; do not use
+this module directly.
+"""
+
+__all__ = ("Inotify", "available")
+
+import errno
+import os
+import struct
+import sys
+
+from snakeoil.compatibility import force_bytes, is_py3k
+from snakeoil.demandload import demandload
+demandload(globals(), 'ctypes')
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+
+# wd, mask, cookie, len; followed by len bytes of the (null padded) name.
+_event = struct.Struct("=iIII")
+_nul = force_bytes("\0")
+
+_libc = None
+
+def _load():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            for name in ("inotify_init1", "inotify_add_watch",
+                "inotify_rm_watch"):
+                getattr(libc, name)
+        except (AttributeError, EnvironmentError):
+            libc = False
+        _libc = libc
+    return _libc
+
+
+def available():
+    """
+    :return: True if inotify is usable on this system
+    """
+    try:
+        return bool(_load())
+    except ImportError:
+        return False
+
+
+def _check(ret):
+    if ret == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify(object):
+
+    """
+    nonblocking inotify instance
+
+    :ivar fd: the inotify fd, or None once closed
+    """
+
+    def __init__(self):
+        libc = _load()
+        if not libc:
+            raise OSError(errno.ENOSYS, "inotify isn't available")
+        self._libc = libc
+        self.fd = _check(libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """
+        :return: the watch descriptor; the same path (or inode) yields the
+            same descriptor
+        :raise OSError: ENOSPC if the watch limit was hit, amongst others
+        """
+        if isinstance(path, unicode):
+            # ctypes would pass it as wchar_t.
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        return _check(self._libc.inotify_add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        _check(self._libc.inotify_rm_watch(self.fd, wd))
+
+    def read_events(self, bufsize=65536):
+        """
+        :return: list of (wd, mask, cookie, name) for every pending event;
+            empty if there are none
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, bufsize)
+            except OSError, oe:
+                if oe.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _event.unpack_from(data, offset)
+                offset += _event.size
+                name = data[offset:offset + length].rstrip(_nul)
+                if is_py3k:
+                    name = os.fsdecode(name)
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
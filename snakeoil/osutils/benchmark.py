@@ -0,0 +1,415 @@
+# License: GPL2/BSD
+
+"""
+osutils benchmark
+
+Run via ``python -m snakeoil.osutils.benchmark``; see ``--help`` for options.
+Results are printed as tables, or written as JSON via ``--json``.
+
+The suites are:
+
+* ``copy``: copying files of various sizes via each
+  :py:func:`snakeoil.osutils.copy_data` method usable on the filesystem
+  holding the test files, along with the userland 32KiB loop
+  :py:func:`snakeoil.data_source.transfer_between_files` that
+  :py:meth:`snakeoil.data_source.base.transfer_to_data_source` used prior.
+  Timings include creating the destination, and fsync'ing it if ``--sync``
+  is given; without it, large copies mostly measure the page cache.
+* ``walk``: traversing a generated tree (500k entries by default) via
+  :py:func:`os.walk`, and :py:func:`snakeoil.osutils.walk` and
+  :py:func:`snakeoil.osutils.iter_tree` with various worker counts.  The
+  tree is walked once beforehand, so this measures a warm dentry cache;
+  parallel scans pay off most on cold caches and network filesystems.
+* ``mkdirs``: ensuring a layout of directories (50k by default) exists via
+  a loop of :py:func:`snakeoil.osutils.ensure_dirs`, versus a single
+  :py:func:`snakeoil.osutils.ensure_dirs_many` call; both creating the
+  layout, and checking an already existing one.
+"""
+
+__all__ = ("parse_size", "bench_copy", "mk_tree", "bench_walk",
+    "mk_dir_paths", "bench_mkdirs", "run", "main")
+
+import os
+import re
+import sys
+
+from snakeoil.version import __version__
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'json',
+    'optparse',
+    'platform',
+    'shutil',
+    'tempfile',
+    'snakeoil:osutils',
+    'snakeoil.chksum.benchmark:best_of,mk_datafile',
+    'snakeoil.data_source:transfer_between_files',
+    'snakeoil.process:get_proc_count',
+)
+
+copy_sizes = (1 << 10, 64 << 10, 1 << 20, 16 << 20, 256 << 20)
+walk_workers = (1, 2, 4, 8)
+
+# suite name, and the columns to display for it: (key, header, format).
+suites = (
+    ('copy', (('mode', 'mode', '%-22s'), ('size', 'bytes', '%11i'),
+        ('seconds', 'seconds', '%9.4f'), ('mb_per_sec', 'MiB/s', '%10.1f'))),
+    ('walk', (('mode', 'mode', '%-9s'), ('workers', 'workers', '%7i'),
+        ('entries', 'entries', '%8i'), ('seconds', 'seconds', '%9.3f'),
+        ('entries_per_sec', 'entries/s', '%11.0f'))),
+    ('mkdirs', (('mode', 'mode', '%-16s'), ('state', 'state', '%-8s'),
+        ('dirs', 'dirs', '%7i'), ('seconds', 'seconds', '%9.3f'),
+        ('dirs_per_sec', 'dirs/s', '%9.0f'))),
+)
+
+_size_suffixes = {'': 0, 'k': 10, 'm': 20, 'g': 30}
+
+
+def parse_size(value):
+    """
+    convert a size such as '4k', '16M', or '4G' into bytes
+    """
+    match = re.match(r"^\s*(\d+)\s*([kmg]?)i?b?\s*$", value, re.I)
+    if match is None:
+        raise ValueError("invalid size %r" % (value,))
+    return int(match.group(1)) << _size_suffixes[match.group(2).lower()]
+
+
+def _copy_legacy(src, dst):
+    read_f = open(src, 'rb')
+    try:
+        write_f = open(dst, 'wb')
+        try:
+            transfer_between_files(read_f, write_f)
+        finally:
+            write_f.close()
+    finally:
+        read_f.close()
+
+
+def _copy(src, dst, methods, sync):
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0644)
+        try:
+            osutils.copy_data(src_fd, dst_fd, methods=methods)
+            if sync:
+                os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def bench_copy(paths, methods=None, repeat=3, sync=False):
+    """
+    time copying each file via each copy method
+
+    :param paths: files to copy; the copies are made alongside them
+    :param methods: :py:data:`snakeoil.osutils.copy_methods` to measure,
+        defaulting to all; those unusable for the test files are skipped.
+        The legacy userland loop is always measured, as
+        ``transfer_between_files``.
+    :param sync: fsync each copy, so the timing includes writeback
+    :return: list of dicts, one per (path, mode)
+    """
+    if methods is None:
+        methods = osutils.copy_methods
+    results = []
+    for path in paths:
+        size = os.stat(path).st_size
+        dst = path + '.copy'
+        modes = [(x, (x,)) for x in methods]
+        modes.append(('transfer_between_files', None))
+        for mode, mode_methods in modes:
+            def f():
+                if os.path.exists(dst):
+                    os.unlink(dst)
+                if mode_methods is None:
+                    _copy_legacy(path, dst)
+                    if sync:
+                        fd = os.open(dst, os.O_WRONLY)
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+                else:
+                    _copy(path, dst, mode_methods, sync)
+            try:
+                elapsed = best_of(f, repeat)
+            except ValueError:
+                # method isn't usable here; reflink on ext4 for example.
+                continue
+            finally:
+                if os.path.exists(dst):
+                    os.unlink(dst)
+            results.append({'mode': mode, 'size': size, 'seconds': elapsed,
+                'mb_per_sec': (size / float(1 << 20)) / max(elapsed, 1e-9)})
+    return results
+
+
+def mk_tree(directory, entries, fanout=32, files=64):
+    """
+    create a tree of empty files and directories
+
+    :param directory: existing directory to populate
+    :param entries: total number of files and directories to create
+    :param fanout: subdirectories per directory
+    :param files: files per directory
+    :return: number of entries created
+    """
+    created = 0
+    queue = [directory]
+    while queue and created < entries:
+        path = queue.pop(0)
+        for x in xrange(min(files, entries - created)):
+            os.close(os.open(os.path.join(path, 'f%i' % x),
+                os.O_WRONLY|os.O_CREAT, 0644))
+            created += 1
+        for x in xrange(min(fanout, entries - created)):
+            subdir = os.path.join(path, 'd%i' % x)
+            os.mkdir(subdir)
+            queue.append(subdir)
+            created += 1
+    return created
+
+
+def _os_walk(top, workers):
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(top):
+        count += len(dirnames) + len(filenames)
+    return count
+
+
+def _walk(top, workers):
+    count = 0
+    for dirpath, dirnames, filenames in osutils.walk(top, workers=workers):
+        count += len(dirnames) + len(filenames)
+    return count
+
+
+def _iter_tree(top, workers):
+    count = 0
+    for entry in osutils.iter_tree(top, workers=workers):
+        count += 1
+    return count
+
+
+walk_modes = (
+    ('os.walk', _os_walk, False),
+    ('walk', _walk, True),
+    ('iter_tree', _iter_tree, True),
+)
+
+
+def bench_walk(top, workers=walk_workers, repeat=3):
+    """
+    time walking a tree via each of the :py:data:`walk_modes`
+
+    :param top: root of the tree
+    :param workers: worker counts to measure the snakeoil walkers with
+    :return: list of dicts, one per (mode, workers)
+    """
+    # prime the caches, so the first mode measured isn't penalized.
+    _os_walk(top, 1)
+    results = []
+    for mode, functor, parallel in walk_modes:
+        counts = [1]
+        if parallel:
+            counts = workers
+        for count in counts:
+            entries = []
+            def f():
+                entries[:] = [functor(top, count)]
+            elapsed = best_of(f, repeat)
+            results.append({'mode': mode, 'workers': count,
+                'entries': entries[0], 'seconds': elapsed,
+                'entries_per_sec': entries[0] / max(elapsed, 1e-9)})
+    return results
+
+
+def mk_dir_paths(directory, count):
+    """
+    generate paths for a three level layout of directories
+
+    :param directory: root of the layout
+    :param count: number of leaf directories
+    :return: list of leaf directory paths
+    """
+    return [os.path.join(directory, 'l%i' % (x // 4096),
+        'm%i' % ((x // 64) % 64), 'n%i' % (x,)) for x in xrange(count)]
+
+
+def _ensure_dirs(paths):
+    for path in paths:
+        if not osutils.ensure_dirs(path, mode=0755):
+            raise AssertionError("failed creating %r" % (path,))
+
+
+def _ensure_dirs_many(paths):
+    failed = osutils.ensure_dirs_many(paths, mode=0755)
+    if failed:
+        raise AssertionError("failed creating %r" % (failed[0],))
+
+
+mkdirs_modes = (
+    ('ensure_dirs', _ensure_dirs),
+    ('ensure_dirs_many', _ensure_dirs_many),
+)
+
+
+def bench_mkdirs(directory, count=50000, repeat=3):
+    """
+    time ensuring a layout of directories via each of the
+    :py:data:`mkdirs_modes`
+
+    :param directory: existing directory to create layouts in
+    :param count: number of leaf directories in the layout
+    :return: list of dicts, one per (mode, state); state is 'create' for
+        creating the layout from scratch, 'existing' for an already
+        existing layout
+    """
+    results = []
+    runs = [0]
+    for mode, functor in mkdirs_modes:
+        def create():
+            # a fresh layout every run.
+            runs[0] += 1
+            functor(mk_dir_paths(os.path.join(directory, 'r%i' % runs[0]),
+                count))
+        paths = mk_dir_paths(os.path.join(directory, 'existing'), count)
+        _ensure_dirs_many(paths)
+        for state, f in (('create', create), ('existing',
+            lambda: functor(paths))):
+            elapsed = best_of(f, repeat)
+            results.append({'mode': mode, 'state': state, 'dirs': count,
+                'seconds': elapsed, 'dirs_per_sec': count / max(elapsed, 1e-9)})
+    return results
+
+
+def environment():
+    """
+    :return: dict describing the machine and software benchmarked
+    """
+    return {
+        'snakeoil': __version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processors': get_proc_count(),
+    }
+
+
+def run(names=None, sizes=copy_sizes, repeat=3, directory=None, sync=False,
+    entries=500000, workers=walk_workers, dirs=50000):
+    """
+    run benchmark suites
+
+    :param names: sequence of suite names to run; defaults to all
+    :param sizes: file sizes to use for the copy suite
+    :param directory: directory to create temporary files in; the copy and
+        walk suites measure the filesystem it's on
+    :param sync: see :py:func:`bench_copy`
+    :param entries: size of the tree for the walk suite
+    :param workers: see :py:func:`bench_walk`
+    :param dirs: number of leaf directories for the mkdirs suite
+    :return: dict of suite name to list of result dicts
+    """
+    if names is None:
+        names = [x[0] for x in suites]
+    unknown = set(names).difference(x[0] for x in suites)
+    if unknown:
+        raise ValueError("unknown suites: %s" % ", ".join(sorted(unknown)))
+
+    workdir = tempfile.mkdtemp(dir=directory, prefix='snakeoil-bench-')
+    try:
+        results = {}
+        if 'copy' in names:
+            paths = [mk_datafile(x, workdir) for x in sizes]
+            results['copy'] = bench_copy(paths, repeat=repeat, sync=sync)
+        if 'walk' in names:
+            top = os.path.join(workdir, 'tree')
+            os.mkdir(top)
+            mk_tree(top, entries)
+            results['walk'] = bench_walk(top, workers=workers, repeat=repeat)
+        if 'mkdirs' in names:
+            top = os.path.join(workdir, 'mkdirs')
+            os.mkdir(top)
+            results['mkdirs'] = bench_mkdirs(top, dirs, repeat=repeat)
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None, out=None):
+    if out is None:
+        out = sys.stdout
+    parser = optparse.OptionParser(
+        description="benchmark snakeoil.osutils")
+    parser.add_option("--suites", default=None,
+        help="comma separated suites to run, out of %s; defaults to all"
+        % ", ".join(x[0] for x in suites))
+    parser.add_option("--sizes", default="1k,64k,1m,16m,256m",
+        help="comma separated file sizes for the copy suite, with optional "
+        "k/m/g suffixes (up to 4g is sensible); defaults to %default")
+    parser.add_option("--entries", type="int", default=500000,
+        help="number of entries in the walk suite's tree; defaults to "
+        "%default")
+    parser.add_option("--workers", default=",".join(map(str, walk_workers)),
+        help="comma separated worker counts for the walk suite; defaults to "
+        "%default")
+    parser.add_option("--dirs", type="int", default=50000,
+        help="number of directories in the mkdirs suite's layout; defaults "
+        "to %default")
+    parser.add_option("--repeat", type="int", default=3,
+        help="take the best of this many runs; defaults to %default")
+    parser.add_option("--dir", default=None,
+        help="directory to create test files in")
+    parser.add_option("--sync", action="store_true", default=False,
+        help="fsync copies, including writeback in the timings")
+    parser.add_option("--json", default=None, metavar="PATH",
+        help="write results as JSON to PATH ('-' for stdout) rather than "
+        "printing tables")
+    options, args = parser.parse_args(argv)
+
+    names = None
+    if options.suites is not None:
+        names = [x.strip() for x in options.suites.split(",") if x.strip()]
+    try:
+        sizes = [parse_size(x) for x in options.sizes.split(",") if x.strip()]
+        results = run(names, sizes=sizes, repeat=options.repeat,
+            directory=options.dir, sync=options.sync, entries=options.entries,
+            workers=[int(x) for x in options.workers.split(",")],
+            dirs=options.dirs)
+    except ValueError, e:
+        parser.error(str(e))
+
+    if options.json is not None:
+        data = {'format': 1, 'environment': environment(), 'results': results}
+        if options.json == '-':
+            json.dump(data, out, indent=2, sort_keys=True)
+            out.write("\n")
+        else:
+            f = open(options.json, 'w')
+            try:
+                json.dump(data, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+        return 0
+
+    for name, columns in suites:
+        if name not in results:
+            continue
+        out.write("%s:\n" % (name,))
+        # '%9.4f' -> '%9s'; headers share the width of their column.
+        out.write(" ".join("%%%ss" % (fmt[1:].split('.')[0].rstrip('sif'),)
+            % (header,) for key, header, fmt in columns).rstrip() + "\n")
+        for result in results[name]:
+            out.write(" ".join(fmt % (result[key],)
+                for key, header, fmt in columns).rstrip() + "\n")
+        out.write("\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,10 +7,13 @@
 
 import errno
 import os
+import struct
 from stat import (S_IFDIR, S_IFREG, S_IFCHR, S_IFBLK, S_IFIFO, S_IFLNK, S_IFSOCK,
     S_IFMT, S_ISDIR, S_ISREG)
 
+from snakeoil.compatibility import force_bytes
 from snakeoil.mappings import ProtectedDict
+from snakeoil.sequences import namedtuple
 
 listdir = os.listdir
 
@@ -18,6 +21,8 @@ listdir = os.listdir
 # import cycle.
 pjoin = os.path.join
 
+_empty = force_bytes('')
+
 def stat_swallow_enoent(path, check, default=False, stat=os.stat):
     try:
         return check(stat(path).st_mode)
@@ -93,3 +98,104 @@ def readdir(path):
     lstat = os.lstat
     dt = d_type_mapping
     return [(name, dt[S_IFMT(lstat(pjf(path, name)).st_mode)]) for name in things]
+
+
+dirent_stat = namedtuple("dirent_stat",
+    ("name", "kind", "size", "mtime_ns", "inode", "mode"))
+
+
+class DirStats(object):
+
+    """
+    compact stat results for every entry of a directory
+
+    Rather than an os.stat_result per entry, the stat fields are held packed
+    in a single string- 28 bytes per entry- and only unpacked when accessed.
+    Indexing and iteration yield :py:class:`dirent_stat` tuples; ``kind`` is
+    a :py:data:`d_type_mapping` value.
+    """
+
+    __slots__ = ("names", "_records")
+
+    # inode, size, mtime in nanoseconds, st_mode
+    record = struct.Struct("=QqqI")
+
+    def __init__(self, names, records):
+        """
+        :param names: list of entry names
+        :param records: string of packed :py:attr:`record`, one per name
+        """
+        if len(records) != len(names) * self.record.size:
+            raise ValueError("got %i records for %i names"
+                % (len(records) // self.record.size, len(names)))
+        self.names = names
+        self._records = records
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        names = self.names
+        if index < 0:
+            index += len(names)
+        if not 0 <= index < len(names):
+            raise IndexError("index %r out of range" % (index,))
+        inode, size, mtime_ns, mode = self.record.unpack_from(
+            self._records, index * self.record.size)
+        return dirent_stat(names[index], d_type_mapping.get(S_IFMT(mode),
+            "unknown"), size, mtime_ns, inode, mode)
+
+    def __iter__(self):
+        for index in xrange(len(self.names)):
+            yield self[index]
+
+    def column(self, field):
+        """
+        :param field: one of the :py:class:`dirent_stat` fields
+        :return: list of that field's value for every entry
+        """
+        if field == "name":
+            return list(self.names)
+        index = dirent_stat._fields.index(field)
+        return [x[index] for x in self]
+
+    def __repr__(self):
+        return "<%s entries=%i @%#8x>" % (self.__class__.__name__,
+            len(self.names), id(self))
+
+
+def stat_dir(path, follow_symlinks=False):
+    """
+    stat every entry of a directory
+
+    :param path: directory to scan
+    :param follow_symlinks: report what symlinks point at; dangling symlinks
+        are reported as the symlink itself
+    :return: (list of names, string of packed :py:attr:`DirStats.record`)
+    """
+    pjf = pjoin
+    stat, lstat = os.stat, os.lstat
+    if not follow_symlinks:
+        stat = lstat
+    pack = DirStats.record.pack
+    names, records = [], []
+    for name in listdir(path):
+        try:
+            try:
+                st = stat(pjf(path, name))
+            except OSError, oe:
+                if oe.errno != errno.ENOENT or not follow_symlinks:
+                    raise
+                st = lstat(pjf(path, name))
+        except OSError, oe:
+            # removed since the listdir.
+            if oe.errno == errno.ENOENT:
+                continue
+            raise
+        # os.stat only offers float mtimes under py2k.
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1000000000)
+        names.append(name)
+        records.append(pack(st.st_ino, st.st_size, mtime_ns, st.st_mode))
+    return names, _empty.join(records)
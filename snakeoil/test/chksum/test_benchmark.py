@@ -0,0 +1,46 @@
+# License: GPL2/BSD
+
+import json
+
+from snakeoil.test.mixins import TempDirMixin
+from snakeoil.chksum import benchmark
+from snakeoil.osutils import pjoin
+from snakeoil.stringio import text_writable
+
+
+class TestBenchmark(TempDirMixin):
+
+    def test_suites(self):
+        path = benchmark.mk_datafile(100000, self.dir)
+        results = benchmark.bench_get_chksums(path, counts=(1, 2, 100),
+            repeat=1)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(sorted(set(x['strategy'] for x in results)),
+            ['mmap', 'serial', 'threaded'])
+        results = benchmark.bench_handlers(["md5", "size"], size=1000,
+            repeat=1)
+        self.assertEqual(set(x['chksum'] for x in results), set(["md5"]))
+        results = benchmark.bench_small_files(self.dir, count=10, size=100,
+            repeat=1)
+        self.assertEqual([x['mode'] for x in results],
+            ['get_chksums', 'get_chksums_many'])
+        self.assertEqual([x['files'] for x in results], [10, 10])
+        self.assertEqual(len(benchmark.bench_io([path], repeat=1)),
+            len(benchmark.io_modes))
+
+    def test_json(self):
+        out = text_writable()
+        self.assertEqual(benchmark.main(["--json", "-", "--suites", "fanout",
+            "--size", "1", "--repeat", "1", "--dir", self.dir], out), 0)
+        data = json.loads(out.getvalue())
+        self.assertEqual(data['format'], 1)
+        self.assertEqual(sorted(data['results']), ['fanout'])
+        self.assertTrue(data['environment']['implementations'])
+        self.assertTrue(all('mb_per_sec' in x
+            for x in data['results']['fanout']))
+        path = pjoin(self.dir, "results")
+        benchmark.main(["--json", path, "--suites", "handlers", "--repeat",
+            "1"], out)
+        self.assertEqual(sorted(json.load(open(path))['results']),
+            ['handlers'])
+        self.assertRaises(ValueError, benchmark.run, ["monkeys"])
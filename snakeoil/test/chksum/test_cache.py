@@ -0,0 +1,146 @@
+# License: GPL2/BSD
+
+import bz2
+import os
+import time
+
+from snakeoil.test.mixins import TempDirMixin
+from snakeoil import chksum
+from snakeoil.chksum.cache import ChksumCache, racy_window
+from snakeoil.data_source import bz2_source, local_source, data_source
+from snakeoil.osutils import pjoin
+
+
+class TestChksumCache(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.fn = pjoin(self.dir, "target")
+        self.write("foon" * 1000)
+        self.cache_path = pjoin(self.dir, "cache")
+
+    def write(self, data, path=None, age=60):
+        path = path or self.fn
+        f = open(path, "w")
+        f.write(data)
+        f.close()
+        # freshly modified files aren't cached; see test_racy.
+        when = time.time() - age
+        os.utime(path, (when, when))
+
+    def expected(self, *chfs):
+        return chksum.get_chksums(self.fn, *chfs)
+
+    def test_hits_and_misses(self):
+        cache = ChksumCache()
+        expected = self.expected("md5", "sha1")
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", "sha1",
+            cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", "sha1",
+            cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        # partial hits only compute what's missing.
+        self.assertEqual(chksum.get_chksums(self.fn, "sha1", "sha256",
+            cache=cache), self.expected("sha1", "sha256"))
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(len(cache), 1)
+
+    def test_data_source(self):
+        cache = ChksumCache()
+        expected = self.expected("md5")
+        self.assertEqual(chksum.get_chksums(local_source(self.fn), "md5",
+            cache=cache), expected)
+        self.assertEqual(cache.misses, 1)
+        # no path; passed through without touching the cache.
+        self.assertEqual(chksum.get_chksums(data_source("foon" * 1000), "md5",
+            cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        # bz2_source's path is the compressed form; not its content.
+        bz2_path = pjoin(self.dir, "target.bz2")
+        f = open(bz2_path, "wb")
+        f.write(bz2.compress("foon" * 1000))
+        f.close()
+        self.assertEqual(chksum.get_chksums(bz2_source(bz2_path), "md5",
+            cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 1, 1))
+
+    def test_modification(self):
+        cache = ChksumCache()
+        chksum.get_chksums(self.fn, "md5", cache=cache)
+        st = os.stat(self.fn)
+        self.write("dar" * 1000)
+        os.utime(self.fn, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", cache=cache),
+            self.expected("md5"))
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_racy(self):
+        cache = ChksumCache()
+        self.write("dar" * 1000, age=0)
+        expected = self.expected("md5")
+        for x in xrange(2):
+            self.assertEqual(chksum.get_chksums(self.fn, "md5", cache=cache),
+                expected)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 2, 0))
+        # fine once the modification is old enough relative to the hashing.
+        st = os.stat(self.fn)
+        cache.update(st, {"md5": expected[0]},
+            hashed_at=st.st_mtime + racy_window + 1)
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", cache=cache),
+            expected)
+        self.assertEqual(cache.hits, 1)
+
+    def test_persistence(self):
+        cache = ChksumCache(self.cache_path)
+        expected = chksum.get_chksums(self.fn, "md5", "sha1", cache=cache)
+        cache.flush()
+        cache = ChksumCache(self.cache_path)
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", "sha1",
+            cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_merge(self):
+        other = pjoin(self.dir, "other")
+        self.write("monkey", other)
+        cache1 = ChksumCache(self.cache_path)
+        cache2 = ChksumCache(self.cache_path)
+        chksum.get_chksums(self.fn, "md5", cache=cache1)
+        chksum.get_chksums(other, "md5", cache=cache2)
+        cache1.flush()
+        cache2.flush()
+        cache = ChksumCache(self.cache_path)
+        self.assertEqual(len(cache), 2)
+
+    def test_corrupt(self):
+        self.write("this isn't a cache\n1 2 3\n", self.cache_path)
+        cache = ChksumCache(self.cache_path)
+        self.assertEqual(len(cache), 0)
+        chksum.get_chksums(self.fn, "md5", cache=cache)
+        self.assertEqual(cache.misses, 1)
+
+    def test_eviction(self):
+        self.assertRaises(ValueError, ChksumCache, max_entries=0)
+        cache = ChksumCache(max_entries=10)
+        paths = []
+        for x in xrange(11):
+            path = pjoin(self.dir, str(x))
+            self.write(str(x), path)
+            paths.append(path)
+            chksum.get_chksums(path, "md5", cache=cache)
+        self.assertEqual(len(cache), 9)
+        self.assertEqual(cache.evictions, 2)
+        # the least recently used are the ones dropped.
+        chksum.get_chksums(paths[-1], "md5", cache=cache)
+        self.assertEqual(cache.hits, 1)
+        chksum.get_chksums(paths[0], "md5", cache=cache)
+        self.assertEqual(cache.hits, 1)
+
+    def test_lazily_hashed_path(self):
+        cache = ChksumCache()
+        obj = chksum.LazilyHashedPath(self.fn, cache=cache)
+        self.assertEqual(obj.md5, self.expected("md5")[0])
+        self.assertEqual(cache.misses, 1)
+        obj = chksum.LazilyHashedPath(self.fn, cache=cache)
+        self.assertEqual(obj.md5, self.expected("md5")[0])
+        self.assertEqual(cache.hits, 1)
@@ -1,6 +1,7 @@
 # Copyright: 2006-2011 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
+import bz2
 import os
 import tempfile
 
@@ -8,7 +9,7 @@ from snakeoil.test import TestCase, SkipTest
 from snakeoil.currying import post_curry
 from snakeoil.compatibility import is_py3k
 from snakeoil import chksum, fileutils
-from snakeoil.data_source import data_source, local_source
+from snakeoil.data_source import bz2_source, data_source, local_source
 
 data = "afsd123klawerponzzbnzsdf;h89y23746123;haas"
 multi = 40000
@@ -108,3 +109,467 @@ class get_chksums_test(base, TestCase):
 
     def get_chf(self):
         self.chf = post_curry(chksum.get_chksums, *self.chfs)
+
+
+class get_chksums_many_test(TestCase):
+
+    chfs = get_chksums_test.chfs
+
+    def setUp(self):
+        self.fns = []
+        for x in xrange(20):
+            fn = tempfile.mktemp()
+            f = open(fn, "w")
+            f.write(data * (x + 1))
+            f.close()
+            self.fns.append(fn)
+
+    def tearDown(self):
+        for fn in self.fns:
+            try:
+                os.unlink(fn)
+            except EnvironmentError:
+                pass
+
+    def test_ordered(self):
+        expected = [(fn, chksum.get_chksums(fn, *self.chfs)) for fn in self.fns]
+        for workers in (1, 4):
+            self.assertEqual(list(chksum.get_chksums_many(self.fns, *self.chfs,
+                **dict(workers=workers))), expected)
+
+    def test_unordered(self):
+        expected = sorted((fn, chksum.get_chksums(fn, *self.chfs))
+            for fn in self.fns)
+        self.assertEqual(sorted(chksum.get_chksums_many(iter(self.fns),
+            *self.chfs, **dict(workers=4, ordered=False))), expected)
+
+    def test_errors(self):
+        self.assertRaises(KeyError, chksum.get_chksums_many, self.fns,
+            "not-a-chksum")
+        os.unlink(self.fns[5])
+        results = chksum.get_chksums_many(self.fns, *self.chfs,
+            **dict(workers=4))
+        for x in xrange(5):
+            results.next()
+        self.assertRaises(EnvironmentError, results.next)
+
+
+class BlockFanOutTest(TestCase):
+
+    def setUp(self):
+        self.fn = tempfile.mktemp()
+        f = open(self.fn, "wb")
+        for i in xrange(multi):
+            f.write(data)
+        f.close()
+
+    def tearDown(self):
+        try:
+            os.unlink(self.fn)
+        except EnvironmentError:
+            pass
+
+    def test_fanout(self):
+        import hashlib
+        from snakeoil.chksum import defaults
+        expected = [long(getattr(hashlib, chf)(data * multi).hexdigest(), 16)
+            for chf in ('md5', 'sha1', 'sha256')]
+        chfs = [hashlib.md5(), hashlib.sha1(), hashlib.sha256()]
+        # small, few buffers to force recycling.
+        fanout = defaults.BlockFanOut([chf.update for chf in chfs],
+            buffers=2, size=1024)
+        f = open(self.fn, "rb")
+        try:
+            fanout.feed(f)
+        finally:
+            f.close()
+        fanout.finish()
+        self.assertEqual([long(chf.hexdigest(), 16) for chf in chfs], expected)
+
+        chfs = [hashlib.md5, hashlib.sha1, hashlib.sha256]
+        for parallelize in (True, False):
+            f = open(self.fn, "rb")
+            try:
+                self.assertEqual(defaults.chksum_loop_over_file(f, chfs,
+                    parallelize=parallelize), expected)
+            finally:
+                f.close()
+
+    def test_errors(self):
+        from snakeoil.chksum import defaults
+        seen = []
+        def fail(data):
+            raise ValueError("monkeys")
+        fanout = defaults.BlockFanOut([fail, lambda x: seen.append(len(x))],
+            buffers=1, size=1024)
+        f = open(self.fn, "rb")
+        try:
+            fanout.feed(f)
+        finally:
+            f.close()
+        self.assertRaises(ValueError, fanout.finish)
+        # the other consumer must not have been starved.
+        self.assertEqual(sum(seen), len(data) * multi)
+
+
+class AdaptivePolicyTest(TestCase):
+
+    def test_choose(self):
+        from snakeoil.chksum.defaults import AdaptivePolicy
+        policy = AdaptivePolicy(mmap_threshold=1024, proc_count=4)
+        big = 1 << 30
+        self.assertEqual(policy.choose(10, ['md5', 'sha1', 'sha512']), 'serial')
+        self.assertEqual(policy.choose(big, ['md5']), 'mmap')
+        self.assertEqual(policy.choose(big, ['md5', 'size']), 'mmap')
+        self.assertEqual(policy.choose(big, ['md5', 'sha512']), 'threaded')
+        self.assertEqual(policy.choose(None, ['md5', 'sha512']), 'threaded')
+        self.assertEqual(policy.choose(big, ['md5', 'sha512'],
+            parallelize=False), 'mmap')
+        self.assertEqual(policy.counts,
+            {'serial': 1, 'mmap': 3, 'threaded': 2})
+        policy.reset()
+        self.assertEqual(policy.counts, {'serial': 0, 'mmap': 0, 'threaded': 0})
+
+        # estimates come from the implementation in use.
+        from snakeoil.chksum.defaults import resolve
+        self.assertEqual(policy.get_throughput('md5'),
+            resolve('md5').implementation.throughput << 20)
+        self.assertEqual(policy.get_throughput('monkeys'),
+            policy.fallback_throughput)
+        # one hasher dominating leaves nothing to gain from threads.
+        policy.throughput['sha1'] = 1
+        self.assertEqual(policy.get_throughput('sha1'), 1)
+        self.assertEqual(policy.choose(big, ['md5', 'sha1']), 'mmap')
+        # nor does threading on a single core.
+        policy = AdaptivePolicy(mmap_threshold=1024, proc_count=1)
+        self.assertEqual(policy.choose(big, ['md5', 'sha512']), 'mmap')
+        # expensive threads push the crossover point up.
+        policy = AdaptivePolicy(mmap_threshold=1024, proc_count=4,
+            thread_cost=10)
+        self.assertEqual(policy.choose(big, ['md5', 'sha512']), 'mmap')
+
+    def test_calibrate(self):
+        from snakeoil.chksum.defaults import AdaptivePolicy
+        policy = AdaptivePolicy()
+        handlers = chksum.get_handlers(['md5', 'sha1', 'size'])
+        measured = policy.calibrate(handlers, size=1 << 16, repeat=1)
+        self.assertEqual(sorted(measured), ['md5', 'sha1'])
+        for val in measured.itervalues():
+            self.assertTrue(val > 0)
+        self.assertEqual(policy.throughput['md5'], measured['md5'])
+        self.assertTrue(policy.thread_cost > 0)
+
+    def test_get_chksums(self):
+        from snakeoil.chksum.defaults import AdaptivePolicy
+        fn = tempfile.mktemp()
+        f = open(fn, "w")
+        f.write(data * multi)
+        f.close()
+        try:
+            expected = [checksums[k][0] for k in ('md5', 'sha1')]
+            for threshold, strategy in ((1 << 30, 'serial'), (1024, 'mmap')):
+                policy = AdaptivePolicy(mmap_threshold=threshold,
+                    proc_count=1)
+                self.assertEqual(chksum.get_chksums(fn, 'md5', 'sha1',
+                    policy=policy), expected)
+                self.assertEqual(policy.counts[strategy], 1)
+            policy = AdaptivePolicy(mmap_threshold=1024, proc_count=4)
+            self.assertEqual(chksum.get_chksums(fn, 'md5', 'sha1', 'sha512',
+                policy=policy)[:2], expected)
+            self.assertEqual(policy.counts['threaded'], 1)
+        finally:
+            os.unlink(fn)
+
+
+class WhirlpoolImplementationTest(TestCase):
+
+    vectors = (
+        ("", "19fa61d75522a4669b44e39c1d2e1726c530232130d407f89afee0964997f7a7"
+            "3e83be698b288febcf88e3e03c4f0757ea8964e59b63d93708b138cc42a66eb3"),
+        ("The quick brown fox jumps over the lazy dog",
+            "b97de512e91e3828b40d2b0fdce9ceb3c4a71f9bea8d88e75c4fa854df36725f"
+            "d2b52eb6544edcacd6f8beddfea403cb55ae31f03ad62a5ef54e42ee82c3fb35"),
+    )
+
+    def setUp(self):
+        try:
+            from snakeoil.chksum import _whirlpool_c
+        except ImportError:
+            raise SkipTest("whirlpool extension isn't built")
+        self.ext = _whirlpool_c
+
+    def test_vectors(self):
+        from snakeoil.compatibility import force_bytes
+        for data, expected in self.vectors:
+            self.assertEqual(self.ext.new(force_bytes(data)).hexdigest(),
+                expected)
+
+    def test_matches_fallback(self):
+        from snakeoil.chksum._whirlpool import Whirlpool
+        data = os.urandom(1000)
+        # cover every padding boundary.
+        for size in (31, 32, 33, 63, 64, 65, 1000):
+            self.assertEqual(self.ext.new(data[:size]).hexdigest(),
+                Whirlpool(data[:size]).hexdigest())
+
+    def test_hashlib_api(self):
+        from snakeoil.compatibility import force_bytes
+        data, expected = self.vectors[1]
+        chf = self.ext.new()
+        chf.update(force_bytes(data[:20]))
+        copy = chf.copy()
+        chf.update(force_bytes(data[20:]))
+        self.assertEqual(chf.hexdigest(), expected)
+        self.assertEqual(len(chf.digest()), 64)
+        self.assertEqual(chf.digest_size, 64)
+        self.assertEqual(chf.name, "whirlpool")
+        # digest shouldn't finalize the object.
+        self.assertEqual(chf.hexdigest(), expected)
+        copy.update(force_bytes(data[20:]))
+        self.assertEqual(copy.hexdigest(), expected)
+        self.assertRaises(TypeError, chf.update, 1)
+
+    def test_preferred(self):
+        handler = chksum.get_handler("whirlpool")
+        self.assertNotEqual(handler.obj, __import__(
+            "snakeoil.chksum._whirlpool", fromlist=["Whirlpool"]).Whirlpool)
+
+
+class verify_chksums_test(TestCase):
+
+    class stream(object):
+        # file object that can't report its size upfront.
+        def __init__(self, data):
+            self.data = data
+            self.pos = 0
+        def seek(self, offset, whence=0):
+            self.pos = offset
+        def tell(self):
+            return self.pos
+        def read(self, size=-1):
+            if size < 0:
+                size = len(self.data)
+            data = self.data[self.pos:self.pos + size]
+            self.pos += len(data)
+            return data
+
+    def setUp(self):
+        fd, self.fn = tempfile.mkstemp()
+        os.write(fd, data * multi)
+        os.close(fd)
+        self.expected = dict(zip(("size", "md5", "sha1"),
+            chksum.get_chksums(self.fn, "size", "md5", "sha1")))
+
+    def tearDown(self):
+        try:
+            os.unlink(self.fn)
+        except EnvironmentError:
+            pass
+
+    def test_valid(self):
+        for location in (self.fn, local_source(self.fn),
+            data_source(data * multi)):
+            self.assertEqual(chksum.verify_chksums(location, self.expected),
+                {})
+            self.assertEqual(chksum.verify_chksums(location, self.expected,
+                parallelize=False), {})
+        self.assertEqual(chksum.verify_chksums(self.stream(data * multi),
+            self.expected), {})
+        # verified by content; not the compressed ondisk form.
+        bz2_path = self.fn + ".bz2"
+        f = open(bz2_path, "wb")
+        try:
+            f.write(bz2.compress(data * multi))
+        finally:
+            f.close()
+        try:
+            self.assertEqual(chksum.verify_chksums(bz2_source(bz2_path),
+                self.expected), {})
+        finally:
+            os.unlink(bz2_path)
+        self.assertRaises(KeyError, chksum.verify_chksums, self.fn,
+            {"foon": 1})
+
+    def test_mismatch(self):
+        expected = dict(self.expected)
+        expected["md5"] += 1
+        self.assertEqual(chksum.verify_chksums(self.fn, expected),
+            {"md5": (expected["md5"], self.expected["md5"])})
+        # without a size, everything is still hashed.
+        del expected["size"]
+        self.assertEqual(sorted(chksum.verify_chksums(self.fn, expected)),
+            ["md5"])
+
+    def test_size_mismatch(self):
+        expected = dict(self.expected)
+        expected["size"] -= 1
+        # known via stat; nothing is hashed.
+        self.assertEqual(chksum.verify_chksums(self.fn, expected),
+            {"size": (expected["size"], self.expected["size"]),
+             "md5": (expected["md5"], None),
+             "sha1": (expected["sha1"], None)})
+        # stream of unknown length; aborted once it exceeds the size.
+        expected["size"] = 100
+        result = chksum.verify_chksums(self.stream(data * multi), expected)
+        self.assertEqual(result["md5"], (expected["md5"], None))
+        self.assertTrue(100 < result["size"][1] < self.expected["size"])
+        result = chksum.verify_chksums(self.stream(data * multi), expected,
+            abort=False)
+        self.assertEqual(result, {"size": (100, self.expected["size"])})
+
+    def test_size_only(self):
+        size = self.expected["size"]
+        # verified via stat alone; nothing is read.
+        def unreadable(*args, **kwds):
+            raise AssertionError("file was read")
+        orig, chksum.loop_over_file = chksum.loop_over_file, unreadable
+        try:
+            self.assertEqual(chksum.verify_chksums(self.fn, {"size": size}),
+                {})
+            self.assertEqual(chksum.verify_chksums(self.fn,
+                {"size": size + 1}), {"size": (size + 1, size)})
+        finally:
+            chksum.loop_over_file = orig
+        # streams of unknown length still have to be read.
+        self.assertEqual(chksum.verify_chksums(self.stream(data * multi),
+            {"size": size}), {})
+        self.assertEqual(chksum.verify_chksums(self.stream(data * multi),
+            {"size": 100}, abort=False), {"size": (100, size)})
+
+
+class stream_sources_test(TestCase):
+
+    chfs = ("md5", "sha1", "size")
+
+    def setUp(self):
+        self.data = data * multi
+        self.expected = chksum.get_chksums(data_source(self.data), *self.chfs)
+
+    def assertChksums(self, location, **kwds):
+        self.assertEqual(chksum.get_chksums(location, *self.chfs, **kwds),
+            self.expected)
+
+    def test_buffers(self):
+        self.assertChksums(bytearray(self.data))
+        self.assertChksums(buffer(self.data))
+        for parallelize in (True, False):
+            self.assertChksums(bytearray(self.data), parallelize=parallelize)
+
+    def test_chunks(self):
+        chunks = [self.data[x:x + 1000] for x in
+            xrange(0, len(self.data), 1000)]
+        self.assertChksums(chunks)
+        self.assertChksums(iter(chunks), parallelize=False)
+        self.assertRaises(TypeError, chksum.get_chksums, 1, "md5", "sha1")
+
+    def test_fanout_backpressure(self):
+        from snakeoil.chksum import defaults
+        seen = []
+        fanout = defaults.BlockFanOut([seen.append], buffers=1)
+        for x in xrange(100):
+            fanout.publish(str(x))
+            self.assertTrue(len(fanout._blocks) <= 1)
+        fanout.finish()
+        self.assertEqual(seen, map(str, xrange(100)))
+
+    def test_bz2_source(self):
+        from snakeoil import compression
+        from snakeoil.data_source import bz2_source
+        fd, path = tempfile.mkstemp()
+        try:
+            # two streams, as lbzip2/pbzip2 would produce.
+            half = len(self.data) // 2
+            os.write(fd, compression.compress_data("bzip2", self.data[:half]))
+            os.write(fd, compression.compress_data("bzip2", self.data[half:]))
+            os.close(fd)
+            # hashing must stream rather than decompress it in one go.
+            orig = compression.decompress_data
+            def fail(*args, **kwds):
+                raise AssertionError("decompress_data was invoked")
+            compression.decompress_data = fail
+            try:
+                for parallelize in (True, False):
+                    self.assertChksums(bz2_source(path),
+                        parallelize=parallelize)
+            finally:
+                compression.decompress_data = orig
+        finally:
+            os.unlink(path)
+
+    def test_max_size(self):
+        from snakeoil.chksum import defaults
+        for location in (self.data, [self.data[:10], self.data[10:]]):
+            if isinstance(location, str):
+                location = bytearray(location)
+            seen = []
+            self.assertRaises(defaults.SizeLimitExceeded,
+                defaults.loop_over_file, location, [seen.append],
+                max_size=len(self.data) - 1)
+            self.assertNotEqual(sum(map(len, seen)), len(self.data))
+
+
+class ReadStrategyTest(TestCase):
+
+    def setUp(self):
+        from snakeoil import osutils
+        self.fn = tempfile.mktemp()
+        f = open(self.fn, "wb")
+        f.write(data * multi)
+        f.close()
+        self.advice = []
+        self._orig = osutils.fadvise
+        osutils.fadvise = lambda fd, offset, length, advice: \
+            self.advice.append(advice)
+
+    def tearDown(self):
+        from snakeoil import osutils
+        osutils.fadvise = self._orig
+        os.unlink(self.fn)
+
+    def test_advice(self):
+        from snakeoil import osutils
+        from snakeoil.chksum import defaults
+        expected = chksum.get_chksums(data_source(data * multi), "md5", "sha1")
+        del self.advice[:]
+
+        strategy = defaults.ReadStrategy(dontneed=True)
+        self.assertEqual(chksum.get_chksums(self.fn, "md5", "sha1",
+            read_strategy=strategy, policy=defaults.AdaptivePolicy(
+            mmap_threshold=len(data) * multi + 1)), expected)
+        self.assertEqual(self.advice, [osutils.POSIX_FADV_SEQUENTIAL,
+            osutils.POSIX_FADV_DONTNEED])
+
+        # fadvise on an fd is pointless for mmap; only path level advice.
+        del self.advice[:]
+        strategy = defaults.ReadStrategy(willneed=True)
+        self.assertEqual(defaults.chksum_loop_over_file(self.fn,
+            [chksum.get_handler(x).new() for x in ("md5", "sha1")],
+            use_mmap=True, read_strategy=strategy), expected)
+        self.assertEqual(self.advice, [osutils.POSIX_FADV_WILLNEED])
+
+        # nothing to advise for in memory data.
+        del self.advice[:]
+        chksum.get_chksums(data_source(data), "md5", read_strategy=strategy)
+        self.assertEqual(self.advice, [])
+
+    def test_blocksize(self):
+        from snakeoil.chksum import defaults
+        sizes = []
+        class reader(object):
+            def __init__(self, handle):
+                self.handle = handle
+            def seek(self, *args):
+                return self.handle.seek(*args)
+            def read(self, size):
+                sizes.append(size)
+                return self.handle.read(size)
+        f = open(self.fn, "rb")
+        try:
+            for parallelize in (False, True):
+                del sizes[:]
+                defaults.loop_over_file(reader(f), [len, len],
+                    parallelize=parallelize,
+                    read_strategy=defaults.ReadStrategy(blocksize=1000))
+                self.assertEqual(set(sizes), set([1000]))
+        finally:
+            f.close()
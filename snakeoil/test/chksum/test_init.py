@@ -34,11 +34,65 @@ class Test_funcs(test.TestCase):
 
     def test_get_handler(self):
         self.assertRaises(KeyError, chksum.get_handler, "x")
-        self.assertEqual(self._inited_count, 1)
         chksum.chksum_types["x"] = 1
         self.assertRaises(KeyError, chksum.get_handler, "y")
         chksum.chksum_types["y"] = 2
         self.assertEqual(1, chksum.get_handler("x"))
         self.assertEqual(2, chksum.get_handler("y"))
-        self.assertEqual(self._inited_count, 1)
+        # handlers are resolved on demand, rather than via init.
+        self.assertEqual(self._inited_count, 0)
+        handler = chksum.get_handler("sha1")
+        self.assertEqual(handler.chf_type, "sha1")
+        self.assertTrue(chksum.get_handler("sha1") is handler)
+        self.assertEqual(self._inited_count, 0)
+
+
+class Test_registry(test.TestCase):
+
+    def test_get_implementations(self):
+        from snakeoil.chksum import defaults
+        impls = chksum.get_implementations("whirlpool")
+        self.assertEqual(impls, defaults.get_implementations("whirlpool"))
+        self.assertEqual(impls[-1].backend, "python")
+        self.assertEqual([x.chf_type for x in impls],
+            ["whirlpool"] * len(impls))
+        self.assertEqual(impls[0].digest_size, 64)
+        self.assertEqual(len(chksum.get_implementations()),
+            len(defaults.implementations))
+
+    def test_lazy_loading(self):
+        from snakeoil.chksum import defaults
+        loaded = []
+        def loader():
+            loaded.append(1)
+            return 1
+        def unavailable():
+            loaded.append(0)
+            raise ImportError("not here")
+        impls = [defaults.Implementation("foon", "missing", unavailable, 4),
+            defaults.Implementation("foon", "there", loader, 4, throughput=1),
+            defaults.Implementation("foon", "fast", loader, 4, throughput=2),
+            defaults.Implementation("bar", "there", loader, 4)]
+        orig = defaults.implementations
+        defaults.implementations = tuple(impls)
+        try:
+            self.assertEqual(defaults.chksum_names(), ["foon", "bar"])
+            handler = defaults.resolve("foon")
+            self.assertTrue(handler.implementation is impls[1])
+            # the rest weren't touched.
+            self.assertEqual(loaded, [0, 1])
+            self.assertFalse(impls[0].available)
+            self.assertTrue(defaults.resolve("foon") is handler)
+            self.assertEqual(loaded, [0, 1])
+            self.assertTrue(defaults.resolve("foon", fastest=True)
+                .implementation is impls[2])
+            self.assertEqual(defaults.resolve("dar"), None)
+        finally:
+            defaults.implementations = orig
+
+    def test_get_fastest_handler(self):
+        handler = chksum.get_fastest_handler("md5")
+        self.assertEqual(handler.chf_type, "md5")
+        self.assertTrue(handler.implementation.available)
+        self.assertRaises(KeyError, chksum.get_fastest_handler, "monkeys")
 
@@ -0,0 +1,658 @@
+# License: GPL2/BSD
+
+import errno
+import os
+import re
+import signal
+import time
+import zlib
+
+from snakeoil.test import TestCase, SkipTest
+from snakeoil.test.mixins import TempDirMixin
+from snakeoil import compression
+from snakeoil.compression import _pool, _stream, _util
+from snakeoil.compatibility import force_bytes
+from snakeoil.osutils import pjoin
+from snakeoil.stringio import bytes_readonly
+from snakeoil.threads import threaded_map
+
+
+class TestIterDecompress(TestCase):
+
+    data = force_bytes("Are we dealing with a mad dog, or a mad scientist?"
+        * 1000)
+
+    def test_bzip2(self):
+        raw = compression.compress_data("bzip2", self.data)
+        chunks = list(compression.iter_decompress("bzip2",
+            bytes_readonly(raw), blocksize=100))
+        self.assertEqual(force_bytes("").join(chunks), self.data)
+
+    def test_multiple_streams(self):
+        raw = compression.compress_data("bzip2", self.data)
+        for blocksize in (100, len(raw), len(raw) * 2):
+            chunks = compression.iter_decompress("bzip2",
+                bytes_readonly(raw * 3), blocksize=blocksize)
+            self.assertEqual(force_bytes("").join(chunks), self.data * 3)
+
+
+class TestHandles(TempDirMixin):
+
+    data = force_bytes("".join("%i monkeys\n" % x for x in xrange(20000)))
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, "target")
+
+    def compress(self, compressor, data=None):
+        handle = compression.compress_handle(compressor, self.path)
+        handle.write(data or self.data)
+        handle.close()
+
+    def test_roundtrip(self):
+        for compressor in ("bzip2", "gzip", "xz"):
+            raw = compression.compress_data(compressor, self.data)
+            self.assertEqual(compression.decompress_data(compressor, raw),
+                self.data, msg=compressor)
+            self.compress(compressor)
+            f = open(self.path, 'rb')
+            self.assertEqual(compression.decompress_data(compressor,
+                f.read()), self.data, msg=compressor)
+            f.close()
+            handle = compression.decompress_handle(compressor, self.path)
+            self.assertEqual(handle.read(), self.data, msg=compressor)
+            handle.close()
+            self.assertEqual(force_bytes("").join(compression.iter_decompress(
+                compressor, self.path, blocksize=100)), self.data,
+                msg=compressor)
+
+    def test_native(self):
+        for compressor in ("bzip2", "gzip", "xz"):
+            module = compression._transforms[compressor].module
+            if not module.native:
+                continue
+            handle = compression.compress_handle(compressor, self.path)
+            self.assertInstance(handle, _stream.CompressionHandle)
+            handle.close()
+            handle = compression.decompress_handle(compressor, self.path)
+            self.assertInstance(handle, _stream.DecompressionHandle)
+            handle.close()
+
+    def test_read(self):
+        self.compress("gzip")
+        handle = compression.decompress_handle("gzip", self.path)
+        self.assertEqual(handle.read(5), self.data[:5])
+        self.assertEqual(handle.tell(), 5)
+        buf = bytearray(10)
+        self.assertEqual(handle.readinto(buf), 10)
+        self.assertEqual(bytes(buf), self.data[5:15])
+        self.assertEqual(handle.read1(5), self.data[15:20])
+        self.assertEqual(handle.read(), self.data[20:])
+        self.assertEqual(handle.read(), force_bytes(""))
+        self.assertEqual(handle.readinto(buf), 0)
+        handle.close()
+
+    def test_seek(self):
+        self.compress("gzip")
+        handle = compression.decompress_handle("gzip", self.path)
+        self.assertEqual(handle.seek(1000), 1000)
+        self.assertEqual(handle.read(10), self.data[1000:1010])
+        self.assertEqual(handle.seek(10, 1), 1020)
+        self.assertEqual(handle.read(10), self.data[1020:1030])
+        # backwards restarts the decompression.
+        self.assertEqual(handle.seek(5), 5)
+        self.assertEqual(handle.read(10), self.data[5:15])
+        self.assertEqual(handle.seek(len(self.data) * 2), len(self.data))
+        self.assertRaises(ValueError, handle.seek, 0, 2)
+        handle.close()
+        # unseekable sources can't go backwards.
+        f = open(self.path, 'rb')
+        handle = _stream.DecompressionHandle(_Unseekable(f),
+            compression._transforms["gzip"].module._decompressor)
+        handle.seek(100)
+        self.assertRaises(TypeError, handle.seek, 0)
+        handle.close()
+        f.close()
+
+    def test_write_seek(self):
+        handle = compression.compress_handle("gzip", self.path)
+        handle.write(force_bytes("foo"))
+        self.assertEqual(handle.seek(10), 10)
+        self.assertEqual(handle.tell(), 10)
+        self.assertRaises(TypeError, handle.seek, 0)
+        handle.close()
+        self.assertRaises(ValueError, handle.write, force_bytes("foo"))
+        f = open(self.path, 'rb')
+        self.assertEqual(compression.decompress_data("gzip", f.read()),
+            force_bytes("foo" + "\0" * 7))
+        f.close()
+
+    def test_multiple_streams(self):
+        for compressor in ("bzip2", "gzip", "xz"):
+            raw = compression.compress_data(compressor, self.data)
+            f = open(self.path, 'wb')
+            f.write(raw * 3)
+            f.close()
+            handle = compression.decompress_handle(compressor, self.path)
+            self.assertEqual(handle.read(), self.data * 3, msg=compressor)
+            handle.close()
+            self.assertEqual(compression.decompress_data(compressor, raw * 3),
+                self.data * 3, msg=compressor)
+
+    def test_file_objects(self):
+        f = open(self.path, 'wb')
+        handle = compression.compress_handle("bzip2", f)
+        handle.write(self.data)
+        handle.close()
+        # the passed in object is left open.
+        self.assertFalse(f.closed)
+        f.close()
+        f = open(self.path, 'rb')
+        handle = compression.decompress_handle("bzip2", f.fileno())
+        self.assertEqual(handle.read(), self.data)
+        handle.close()
+        f.close()
+
+
+class _Unseekable(object):
+
+    def __init__(self, handle):
+        self.read = handle.read
+
+
+class TestDetection(TempDirMixin):
+
+    data = force_bytes("sniff sniff" * 1000)
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, "target")
+        self.formats = compression.available()
+
+    def write(self, compressor):
+        raw = compression.compress_data(compressor, self.data)
+        f = open(self.path, 'wb')
+        f.write(raw)
+        f.close()
+        return raw
+
+    def test_available(self):
+        # zlib is always there.
+        self.assertIn("gzip", self.formats)
+        self.assertTrue(set(self.formats).issubset(
+            ["bzip2", "gzip", "lz4", "xz", "zstd"]))
+
+    def test_detect(self):
+        for compressor in self.formats:
+            raw = self.write(compressor)
+            self.assertEqual(compression.detect(raw), compressor)
+            self.assertEqual(compression.decompress_data(raw), self.data)
+            self.assertEqual(compression.decompress_data(None, raw),
+                self.data)
+            handle = compression.decompress_handle(self.path)
+            self.assertEqual(handle.read(), self.data, msg=compressor)
+            handle.close()
+            self.assertEqual(force_bytes("").join(
+                compression.iter_decompress(None, self.path)), self.data)
+        self.assertEqual(compression.detect(force_bytes("BZh0")), None)
+        self.assertEqual(compression.detect(self.data), None)
+        self.assertRaises(ValueError, compression.decompress_data, self.data)
+        f = open(self.path, 'wb')
+        f.write(self.data)
+        f.close()
+        self.assertRaises(ValueError, compression.decompress_handle,
+            self.path)
+
+    def test_sniff(self):
+        self.write("gzip")
+        self.assertEqual(compression.sniff(self.path), ("gzip", self.path))
+        f = open(self.path, 'rb')
+        f.read(1)
+        self.assertEqual(compression.sniff(f)[0], None)
+        self.assertEqual(f.tell(), 1)
+        f.seek(0)
+        self.assertEqual(compression.sniff(f), ("gzip", f))
+        self.assertEqual(f.tell(), 0)
+        f.close()
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self.assertEqual(compression.sniff(fd), ("gzip", fd))
+            self.assertEqual(os.lseek(fd, 0, os.SEEK_CUR), 0)
+        finally:
+            os.close(fd)
+
+    def test_unseekable(self):
+        raw = self.write("gzip")
+        rfd, wfd = os.pipe()
+        try:
+            os.write(wfd, raw)
+            os.close(wfd)
+            wfd = None
+            handle = compression.decompress_handle(rfd)
+            self.assertEqual(handle.read(), self.data)
+            handle.close()
+        finally:
+            os.close(rfd)
+            if wfd is not None:
+                os.close(wfd)
+        reader = compression._PrefixedReader(force_bytes("abc"),
+            bytes_readonly(force_bytes("defg")))
+        self.assertEqual(reader.read(2), force_bytes("ab"))
+        self.assertEqual(reader.read(3), force_bytes("cde"))
+        self.assertEqual(reader.read(), force_bytes("fg"))
+
+    def test_unseekable_ownership(self):
+        raw = self.write("gzip")
+        rfd, wfd = os.pipe()
+        try:
+            os.write(wfd, raw)
+            # descriptors are read directly, and stay open.
+            compressor, reader = compression.sniff(rfd)
+            self.assertEqual(compressor, "gzip")
+            self.assertRaises(EnvironmentError, reader.fileno)
+            self.assertEqual(reader.read(3), raw[:3])
+            self.assertEqual(reader.read(len(raw) - 3), raw[3:])
+            self.assertEqual(reader.fileno(), rfd)
+            reader.close()
+            self.assertRaises(ValueError, reader.read)
+            os.fstat(rfd)
+            # file objects are closed along with the replacement.
+            os.write(wfd, raw)
+            os.close(wfd)
+            wfd = None
+            f = os.fdopen(os.dup(rfd), 'rb')
+            reader = compression.sniff(f)[1]
+            self.assertTrue(reader.__enter__() is reader)
+            self.assertEqual(reader.read(), raw)
+            reader.__exit__(None, None, None)
+            self.assertTrue(f.closed)
+        finally:
+            os.close(rfd)
+            if wfd is not None:
+                os.close(wfd)
+
+
+class TestParallel(TempDirMixin):
+
+    data = TestHandles.data
+
+    def test_compress_data(self):
+        for compressor in ("bzip2", "gzip", "xz"):
+            for workers in (1, 3):
+                raw = compression.compress_data(compressor, self.data,
+                    workers=workers)
+                self.assertEqual(compression.decompress_data(compressor, raw),
+                    self.data, msg=compressor)
+        raw = _stream.compress_data(self.data, zlib.compressobj, workers=3,
+            blocksize=1000)
+        self.assertEqual(_stream.decompress_data(raw, zlib.decompressobj),
+            self.data)
+        # each block is an independent stream.
+        self.assertEqual(len(zlib.decompressobj().decompress(raw)), 1000)
+
+    def test_handle(self):
+        path = pjoin(self.dir, "target")
+        for blocksize in (1000, 100000, len(self.data) * 2):
+            handle = _stream.ParallelCompressionHandle(path, zlib.compressobj,
+                3, blocksize=blocksize)
+            for x in xrange(0, len(self.data), 777):
+                handle.write(self.data[x:x + 777])
+            self.assertEqual(handle.tell(), len(self.data))
+            handle.close()
+            handle = _stream.DecompressionHandle(path, zlib.decompressobj)
+            self.assertEqual(handle.read(), self.data, msg=str(blocksize))
+            handle.close()
+        # empty output is still a valid stream.
+        handle = compression.compress_handle("gzip", path, workers=2)
+        self.assertInstance(handle, _stream.ParallelCompressionHandle)
+        handle.close()
+        self.assertEqual(compression.decompress_data("gzip",
+            open(path, 'rb').read()), force_bytes(""))
+        self.assertRaises(ValueError, _stream.ParallelCompressionHandle,
+            path, zlib.compressobj, 0)
+
+    def test_get_workers(self):
+        self.assertEqual(_stream.get_workers(), 1)
+        self.assertEqual(_stream.get_workers(False, 4), 4)
+        self.assertEqual(_stream.get_workers(True, 2), 2)
+        self.assertTrue(_stream.get_workers(True) >= 1)
+        self.assertRaises(ValueError, _stream.get_workers, True, 0)
+
+    def test_xz_memory(self):
+        if not compression._transforms["xz"].available:
+            raise SkipTest("xz unavailable")
+        module = compression._transforms["xz"].module
+        self.assertEqual(module.default_level, 6)
+        orig = module._physical_memory
+        try:
+            # 2GiB; a quarter fits five -6 compressors, but no -9 one.
+            module._physical_memory = lambda: 2 << 30
+            self.assertEqual(module._cap_workers(8, 6), 5)
+            self.assertEqual(module._cap_workers(8, 9), 1)
+            self.assertEqual(module._cap_workers(2, 1), 2)
+            module._physical_memory = lambda: None
+            self.assertEqual(module._cap_workers(8, 9), 8)
+        finally:
+            module._physical_memory = orig
+
+
+class TestParallelDecompression(TempDirMixin):
+
+    data = TestHandles.data
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, "target")
+        self.module = compression._transforms["bzip2"].module
+        if not self.module.native:
+            raise SkipTest("bz2 module unavailable")
+        # a stream per 100k.
+        self.raw = self.module.compress_data(self.data, workers=2, level=1)
+        f = open(self.path, 'wb')
+        f.write(self.raw)
+        f.close()
+
+    def handle(self, **kwds):
+        return _stream.ParallelDecompressionHandle(self.path,
+            self.module.BZ2Decompressor, kwds.pop("magic",
+            self.module.stream_magic), 3, **kwds)
+
+    def test_streams(self):
+        self.assertEqual(len(self.module.stream_magic.findall(self.raw)),
+            len(self.data) // 100000 + 1)
+        for blocksize in (100, 1000, 1 << 20):
+            handle = self.handle(blocksize=blocksize)
+            self.assertEqual(handle.read(), self.data, msg=str(blocksize))
+            # no fallback to serial decompression was needed.
+            self.assertFalse(handle._abort)
+            handle.close()
+        handle = compression.decompress_handle("bzip2", self.path, workers=2)
+        self.assertInstance(handle, _stream.ParallelDecompressionHandle)
+        self.assertEqual(handle.read(), self.data)
+        handle.close()
+        self.assertEqual(compression.decompress_data("bzip2", self.raw * 2,
+            workers=3), self.data * 2)
+        # empty streams, and single streams.
+        for data in (force_bytes(""), self.data[:1000]):
+            self.assertEqual(compression.decompress_data("bzip2",
+                compression.compress_data("bzip2", data) * 2, workers=3),
+                data * 2)
+
+    def test_stream_magic(self):
+        for name in ("bzip2", "xz"):
+            if name not in compression.available():
+                continue
+            magic = compression._transforms[name].module.stream_magic
+            raw = compression.compress_data(name, self.data[:1000])
+            self.assertTrue(magic.match(raw), msg=name)
+            self.assertEqual(len(magic.findall(raw * 3)), 3, msg=name)
+
+    def test_seek(self):
+        handle = self.handle()
+        self.assertEqual(handle.seek(250000), 250000)
+        self.assertEqual(handle.read(10), self.data[250000:250010])
+        self.assertEqual(handle.seek(10), 10)
+        self.assertEqual(handle.read(10), self.data[10:20])
+        handle.close()
+
+    def test_fallbacks(self):
+        # a magic matching within streams forces a serial fallback.
+        handle = self.handle(magic=re.compile(force_bytes("BZ")))
+        self.assertEqual(handle.read(), self.data)
+        handle.close()
+        # as does a stream exceeding max_segment.
+        handle = self.handle(blocksize=1000, max_segment=5000)
+        self.assertEqual(handle.read(), self.data)
+        handle.close()
+        # corruption still raises.
+        f = open(self.path, 'wb')
+        f.write(self.raw[:100] + self.raw[200:])
+        f.close()
+        handle = self.handle()
+        self.assertRaises(IOError, handle.read)
+        handle.close()
+
+
+class TestSeekIndex(TempDirMixin):
+
+    data = TestHandles.data
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, "target")
+
+    def write(self, compressor, **kwds):
+        f = open(self.path, 'wb')
+        f.write(compression.compress_data(compressor, self.data, **kwds))
+        f.close()
+
+    def check_seeks(self, handle):
+        for offset in (100000, 5, 250000, 150000, 150001, 0, 200000):
+            self.assertEqual(handle.seek(offset), offset)
+            self.assertEqual(handle.read(100), self.data[offset:offset + 100],
+                msg=str(offset))
+
+    def test_checkpoints(self):
+        # single stream; only zlib's decompressor copying makes this work.
+        self.write("gzip")
+        index = compression.SeekIndex(spacing=10000)
+        # checkpoints are taken at most once per read of the source.
+        handle = _stream.DecompressionHandle(self.path,
+            compression._transforms["gzip"].module._decompressor,
+            blocksize=1000, index=index)
+        self.assertIdentical(handle.index, index)
+        self.assertRaises(ValueError, handle.seek, 0, 2)
+        self.assertEqual(handle.read(), self.data)
+        self.assertTrue(len(index) > 10)
+        self.assertEqual(index.length, len(self.data))
+        self.check_seeks(handle)
+        self.assertEqual(handle.seek(-10, 2), len(self.data) - 10)
+        self.assertEqual(handle.read(), self.data[-10:])
+        self.assertRaises(ValueError, handle.seek, -1)
+        handle.close()
+        # reuse, jumping straight to a point.
+        handle = compression.decompress_handle("gzip", self.path,
+            index=index)
+        handle.seek(200000)
+        self.assertNotEqual(handle._compressed, 0)
+        self.assertEqual(handle.read(100), self.data[200000:200100])
+        handle.close()
+
+    def test_streams(self):
+        self.write("bzip2", level=1, workers=2)
+        index = compression.SeekIndex(spacing=1)
+        handle = compression.decompress_handle("bzip2", self.path,
+            index=index)
+        handle.seek(len(self.data))
+        self.assertEqual(len(index), len(self.data) // 100000 + 1)
+        self.check_seeks(handle)
+        handle.close()
+
+        path = pjoin(self.dir, "index")
+        index.save(path)
+        loaded = compression.SeekIndex.load(path)
+        self.assertEqual(loaded._points, index._points)
+        self.assertEqual((loaded.size, loaded.length),
+            (index.size, index.length))
+        handle = compression.decompress_handle("bzip2", self.path,
+            index=loaded)
+        self.check_seeks(handle)
+        handle.close()
+
+        # the parallel handle records stream boundaries as well.
+        handle = compression.decompress_handle("bzip2", self.path,
+            workers=2, index=compression.SeekIndex(spacing=1))
+        self.assertEqual(handle.read(), self.data)
+        self.assertEqual(handle.index._points, index._points)
+        self.check_seeks(handle)
+        handle.close()
+
+    def test_stale(self):
+        self.write("gzip")
+        handle = compression.decompress_handle("gzip", self.path,
+            index=compression.SeekIndex(spacing=10000))
+        handle.read()
+        handle.close()
+        index = handle.index
+        self.write("gzip", level=1)
+        handle = compression.decompress_handle("gzip", self.path,
+            index=index)
+        self.assertEqual(len(index), 1)
+        self.check_seeks(handle)
+        handle.close()
+
+    def test_load(self):
+        path = pjoin(self.dir, "index")
+        self.assertEqual(compression.SeekIndex.load(path), None)
+        f = open(path, 'w')
+        f.write("not an index\n")
+        f.close()
+        self.assertEqual(compression.SeekIndex.load(path), None)
+        self.assertRaises(ValueError, compression.SeekIndex, 0)
+
+
+class TestPool(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.pool = _pool.ProcessPool(size=2, timeout=30)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        TempDirMixin.tearDown(self)
+
+    def test_run(self):
+        data = force_bytes("monkeys" * 1000)
+        self.assertEqual(self.pool.run(["cat"], data), (0, data,
+            force_bytes("")))
+        self.assertEqual(self.pool.run(["sh", "-c", "echo foo >&2; exit 3"],
+            force_bytes("")), (3, force_bytes(""), force_bytes("foo\n")))
+        self.assertEqual(self.pool.run(["/nonexistent/binary"],
+            force_bytes(""))[0], None)
+        # the helper is reused.
+        self.assertEqual(self.pool.spawned, 1)
+
+    def test_threads(self):
+        results = list(threaded_map(lambda x: self.pool.run(["cat"], x),
+            [force_bytes(str(x)) for x in xrange(20)], workers=4))
+        self.assertEqual([x[1] for x in results],
+            [force_bytes(str(x)) for x in xrange(20)])
+        self.assertTrue(self.pool.spawned <= 2)
+
+    def test_health(self):
+        self.pool.run(["true"], force_bytes(""))
+        worker = self.pool._idle[0]
+        os.kill(worker.process.pid, signal.SIGKILL)
+        worker.process.wait()
+        self.assertEqual(self.pool.run(["cat"], force_bytes("foo"))[1],
+            force_bytes("foo"))
+        self.assertEqual(self.pool.spawned, 2)
+
+    def test_timeout(self):
+        pool = _pool.ProcessPool(size=1, timeout=0.5)
+        pidfile = pjoin(self.dir, "pid")
+        try:
+            try:
+                pool.run(["sh", "-c", "echo $$ > %s; exec sleep 5" % pidfile],
+                    force_bytes(""))
+            except EnvironmentError, e:
+                self.assertEqual(e.errno, errno.ETIMEDOUT)
+            else:
+                self.fail("timeout wasn't enforced")
+            # the binary the helper was running is killed too.
+            pid = int(open(pidfile).read())
+            for x in xrange(100):
+                try:
+                    os.kill(pid, 0)
+                except OSError, oe:
+                    self.assertEqual(oe.errno, errno.ESRCH)
+                    break
+                time.sleep(0.05)
+            else:
+                self.fail("pid %i outlived its helper" % (pid,))
+            self.assertEqual(pool.run(["cat"], force_bytes("foo"))[1],
+                force_bytes("foo"))
+            self.assertEqual(pool.spawned, 2)
+        finally:
+            pool.shutdown()
+        self.assertRaises(ValueError, pool.run, ["true"], force_bytes(""))
+
+    def test_max_requests(self):
+        pool = _pool.ProcessPool(size=1, max_requests=2)
+        try:
+            for x in xrange(5):
+                pool.run(["true"], force_bytes(""))
+            self.assertEqual(pool.spawned, 3)
+        finally:
+            pool.shutdown()
+
+    def test_util(self):
+        data = force_bytes("monkeys" * 1000)
+        self.assertTrue(len(data) < _util.pool_threshold)
+        orig, _pool._pool = _pool._pool, self.pool
+        try:
+            raw = _util.compress_data("bzip2", data)
+            self.assertTrue(isinstance(raw, bytes))
+            self.assertEqual(_util.decompress_data("bzip2", raw), data)
+            self.assertEqual(self.pool._idle[0].requests, 2)
+        finally:
+            _pool._pool = orig
+        self.assertRaises(ValueError, _util.decompress_data, "bzip2", data)
+
+    def test_fork(self):
+        data = force_bytes("monkeys")
+        orig, _pool._pool = _pool._pool, self.pool
+        try:
+            self.pool.run(["true"], force_bytes(""))
+            worker = self.pool._idle[0]
+            pid = os.fork()
+            if not pid:
+                code = 1
+                try:
+                    try:
+                        pool = _pool.get_pool()
+                        if pool is not self.pool and pool.pid == os.getpid() \
+                                and pool.run(["cat"], data)[1] == data \
+                                and not self.pool._idle:
+                            code = 0
+                        pool.shutdown()
+                    except Exception:
+                        pass
+                finally:
+                    os._exit(code)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            # the child neither wrote to nor closed our helper.
+            self.assertEqual(self.pool._idle, [worker])
+            self.assertEqual(self.pool.run(["cat"], data)[1], data)
+            self.assertEqual(self.pool.spawned, 1)
+            self.assertTrue(_pool.get_pool() is self.pool)
+        finally:
+            _pool._pool = orig
+
+
+class TestBenchmark(TestCase):
+
+    def test_bench_workers(self):
+        from snakeoil.compression import benchmark
+        data = benchmark.mk_data(10000)
+        self.assertEqual(len(data), 10000)
+        results = benchmark.bench_workers(data, names=("gzip",),
+            workers=(1, 2), repeat=1)
+        self.assertEqual([x['workers'] for x in results], [1, 2])
+        self.assertTrue(all(0 < x['ratio'] < 1 for x in results))
+        self.assertRaises(ValueError, benchmark.run, ["monkeys"])
+        self.assertRaises(ValueError, benchmark.run, ["seek"], ["monkeys"])
+
+    def test_bench_seek(self):
+        from snakeoil.compression import benchmark
+        results = benchmark.bench_seek(benchmark.mk_data(100000),
+            names=("gzip",), seeks=5, spacing=10000, repeat=1)
+        self.assertEqual([x['mode'] for x in results], ['none', 'index'])
+        self.assertEqual(results[0]['points'], 0)
+
+    def test_bench_pool(self):
+        from snakeoil.compression import benchmark
+        results = benchmark.bench_pool(benchmark.mk_data(10000),
+            binaries=("bzip2", "nonexistent-binary"), count=3, repeat=1)
+        self.assertEqual([(x['mode'], x['blobs']) for x in results],
+            [('spawn', 3), ('pool', 3)])
@@ -80,8 +80,8 @@ class TestDataSource(TestCase):
     def test_transfer_to_path(self):
         data = self._mk_data()
         reader = self.get_obj(data=data)
-        if isinstance(reader, data_source.bz2_source):
-            writer = data_source.bz2_source(pjoin(self.dir, 'transfer_to_path'), mutable=True)
+        if isinstance(reader, data_source.compressed_source):
+            writer = reader.__class__(pjoin(self.dir, 'transfer_to_path'), mutable=True)
         else:
             writer = data_source.local_source(pjoin(self.dir, 'transfer_to_path'), mutable=True)
 
@@ -89,6 +89,54 @@ class TestDataSource(TestCase):
 
         self.assertContents(reader, writer)
 
+    def test_iter_chunks(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data)
+        tobytes = data_source._tobytes
+        chunks = [tobytes(x) for x in obj.iter_chunks(30000)]
+        self.assertEqual(''.join(chunks), data)
+        self.assertTrue(max(len(x) for x in chunks) <= 30000)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual([tobytes(x) for x in obj.iter_chunks()], [data])
+        buf = bytearray(7000)
+        chunks = [tobytes(x) for x in obj.iter_chunks(7000, buf=buf)]
+        self.assertEqual(''.join(chunks), data)
+        self.assertTrue(max(len(x) for x in chunks) <= 7000)
+        # chunks are bounded by the buffer, whatever the size asked for.
+        chunks = [tobytes(x) for x in obj.iter_chunks(30000, buf=buf)]
+        self.assertEqual(''.join(chunks), data)
+        self.assertTrue(max(len(x) for x in chunks) <= 7000)
+        obj = self.get_obj(data='')
+        self.assertEqual(list(obj.iter_chunks()), [])
+
+    def test_readinto(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data)
+        buf = bytearray(1000)
+        self.assertEqual(obj.readinto(buf), 1000)
+        self.assertEqual(str(buf), data[:1000])
+        self.assertEqual(obj.readinto(buf, 99500), 500)
+        self.assertEqual(str(buf[:500]), data[-500:])
+        self.assertEqual(obj.readinto(buf, len(data) + 10), 0)
+
+    @mixins.tempdir_decorator
+    def test_transfer_to_existing_path(self):
+        # existing content is overwritten in place, not truncated.
+        path = pjoin(self.dir, 'transfer_to_path')
+        f = open(path, 'wb')
+        f.write('x' * 200000)
+        f.close()
+        data = self._mk_data()
+        reader = self.get_obj(data=data)
+        if isinstance(reader, data_source.compressed_source):
+            return
+        reader.transfer_to_path(path)
+        f = open(path, 'rb')
+        try:
+            self.assertEqual(f.read(), data + 'x' * 100000)
+        finally:
+            f.close()
+
     def test_transfer_data_between_files(self):
         data = self._mk_data()
         reader = self.get_obj(data=data)
@@ -140,18 +188,71 @@ class TestLocalSource(mixins.TempDirMixin, TestDataSource):
         f.close()
 
 
+class TestMmapSource(mixins.TempDirMixin, TestDataSource):
+
+    supports_mutable = False
+
+    def get_obj(self, data="foonani", mutable=False):
+        self.fp = pjoin(self.dir, "mmapsource.test")
+        f = open(self.fp, "wb")
+        f.write(data)
+        f.close()
+        return data_source.mmap_source(self.fp)
+
+    def test_shared_mapping(self):
+        obj = self.get_obj(data="line1\nline2\nline3")
+        self.assertEqual(obj.refs, 0)
+        f1, f2 = obj.bytes_fileobj(), obj.bytes_fileobj()
+        self.assertEqual(obj.refs, 2)
+        self.assertIdentical(f1._map, f2._map)
+        self.assertEqual(f1.readline(), "line1\n")
+        self.assertEqual(list(f2), ["line1\n", "line2\n", "line3"])
+        self.assertEqual(f1.read(), "line2\nline3")
+        f1.seek(-5, 2)
+        self.assertEqual(f1.read(2), "li")
+        f1.close()
+        f1.close()
+        self.assertEqual(obj.refs, 1)
+        f2.close()
+        self.assertEqual(obj.refs, 0)
+        self.assertEqual(obj._map, None)
+        self.assertRaises(ValueError, obj.release)
+        self.assertRaises(ValueError, obj.view)
+
+        m = obj.acquire()
+        try:
+            self.assertEqual(str(obj.view(6, 5)), "line2")
+            self.assertEqual(str(obj.view(12)), "line3")
+            self.assertEqual([str(x) for x in obj.iter_chunks(6)],
+                ["line1\n", "line2\n", "line3"])
+            # iteration took and dropped its own reference.
+            self.assertEqual(obj.refs, 1)
+            self.assertIdentical(obj.acquire(), m)
+            obj.release()
+        finally:
+            obj.release()
+        self.assertEqual(obj.refs, 0)
+
+    def test_empty(self):
+        obj = self.get_obj(data="")
+        self.assertEqual(obj.bytes_fileobj().read(), "")
+        self.assertEqual(list(obj.iter_chunks()), [])
+
+
 class TestBz2Source(mixins.TempDirMixin, TestDataSource):
 
+    kls = data_source.bz2_source
+
     def get_obj(self, data="foonani", mutable=False, test_creation=False):
-        self.fp = pjoin(self.dir, "bz2source.test.bz2")
+        self.fp = pjoin(self.dir, "compressed.test")
         if not test_creation:
             if compatibility.is_py3k:
                 if isinstance(data, str):
                     data = data.encode()
             f = open(self.fp, 'wb')
-            f.write(compression.compress_data('bzip2', data))
+            f.write(compression.compress_data(self.kls.compressor_type, data))
             f.close()
-        return data_source.bz2_source(self.fp, mutable=mutable)
+        return self.kls(self.fp, mutable=mutable)
 
     def test_bytes_fileobj(self):
         data = u"foonani\xf2".encode("utf8")
@@ -161,6 +262,74 @@ class TestBz2Source(mixins.TempDirMixin, TestDataSource):
         self.assertEqual(f.read(), data)
         f.close()
 
+    def read(self, obj):
+        f = obj.bytes_fileobj()
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_rewrite(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data, mutable=True)
+        os.chmod(obj.path, 0640)
+        f = obj.bytes_fileobj(True)
+        self.assertEqual(f.read(10), data[:10])
+        f.write("monkeys")
+        self.assertEqual(f.tell(), 17)
+        self.assertEqual(f.read(3), data[17:20])
+        f.seek(1000)
+        self.assertRaises(TypeError, f.seek, 0)
+        f.write("x" * 10)
+        # nothing is visible until close.
+        self.assertEqual(self.read(obj), data)
+        f.close()
+        self.assertRaises(ValueError, f.write, "x")
+        self.assertEqual(self.read(obj),
+            data[:10] + "monkeys" + data[17:1000] + "x" * 10 + data[1010:])
+        self.assertEqual(os.stat(obj.path).st_mode & 0777, 0640)
+        self.assertEqual(os.listdir(self.dir), ["compressed.test"])
+
+    def test_rewrite_past_end(self):
+        obj = self.get_obj(data="foonani", mutable=True)
+        f = obj.bytes_fileobj(True)
+        f.seek(10)
+        self.assertEqual(f.read(), "")
+        f.write("dar")
+        f.close()
+        self.assertEqual(self.read(obj), "foonani\0\0\0dar")
+        # seeking alone doesn't extend it.
+        f = obj.bytes_fileobj(True)
+        f.seek(100)
+        f.close()
+        self.assertEqual(self.read(obj), "foonani\0\0\0dar")
+
+    def test_rewrite_discard(self):
+        obj = self.get_obj(data="foonani", mutable=True)
+        f = obj.bytes_fileobj(True)
+        f.write("dar")
+        f._discard()
+        self.assertEqual(self.read(obj), "foonani")
+        self.assertEqual(os.listdir(self.dir), ["compressed.test"])
+
+    def test_create(self):
+        obj = self.get_obj(mutable=True, test_creation=True)
+        f = obj.bytes_fileobj(True)
+        self.assertEqual(f.read(), "")
+        f.write("foonani")
+        f.close()
+        self.assertEqual(self.read(obj), "foonani")
+
+
+class TestGzipSource(TestBz2Source):
+
+    kls = data_source.gzip_source
+
+
+class TestXzSource(TestBz2Source):
+
+    kls = data_source.xz_source
+
 
 class Test_invokable_data_source(TestDataSource):
 
@@ -2,10 +2,12 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import errno
 import fcntl
 import grp
 import os
 import stat
+import time
 
 from snakeoil import compatibility, osutils
 from snakeoil.test import TestCase, SkipTest, mk_cpy_loadable_testcase
@@ -75,7 +77,49 @@ class NativeReaddirTest(ReaddirCommon):
         self.assertEqual([], self.module.readdir(self.subdir))
 
     def test_missing(self):
-        return self._test_missing((self.module.readdir,))
+        return self._test_missing((self.module.readdir,
+            self.module.stat_dir))
+
+    def test_stat_dir(self):
+        self.write_file(pjoin(self.dir, "file"), "w", "monkeys")
+        os.symlink("foon", pjoin(self.dir, "monkeys"))
+        os.symlink(pjoin(self.dir, "file"), pjoin(self.dir, "sym"))
+        for follow in (False, True):
+            stats = native_readdir.DirStats(
+                *self.module.stat_dir(self.dir, follow))
+            self.assertEqual(len(stats), 5)
+            self.assertEqual(stats[-1], stats[4])
+            self.assertRaises(IndexError, stats.__getitem__, 5)
+            stats = dict((x.name, x) for x in stats)
+            for name, entry in stats.iteritems():
+                st = os.lstat(pjoin(self.dir, name))
+                if follow and name == "sym":
+                    st = os.stat(pjoin(self.dir, name))
+                self.assertEqual(entry.mode, st.st_mode)
+                self.assertEqual(entry.size, st.st_size)
+                self.assertEqual(entry.inode, st.st_ino)
+                # py2k's st_mtime is a float, so only roughly equal.
+                self.assertTrue(
+                    abs(entry.mtime_ns / 1e9 - st.st_mtime) < 1e-5)
+            self.assertEqual(stats["file"].kind, "file")
+            self.assertEqual(stats["file"].size, 7)
+            self.assertEqual(stats["fifo"].kind, "fifo")
+            self.assertEqual(stats["dir"].kind, "directory")
+            self.assertEqual(stats["monkeys"].kind, "symlink")
+            self.assertEqual(stats["sym"].kind, ["symlink", "file"][follow])
+        self.assertEqual(len(native_readdir.DirStats(
+            *self.module.stat_dir(self.subdir))), 0)
+
+    def test_dir_stats(self):
+        stats = osutils.readdir_stat(self.dir)
+        self.assertEqual(sorted(stats.column("name")),
+            ["dir", "fifo", "file"])
+        self.assertEqual(sorted(stats.column("kind")),
+            ["directory", "fifo", "file"])
+        self.assertEqual(stats.column("name"),
+            [x.name for x in stats])
+        self.assertRaises(ValueError, stats.column, "monkeys")
+        self.assertRaises(ValueError, native_readdir.DirStats, ["x"], "")
 
 try:
     # No name "readdir" in module osutils
@@ -97,7 +141,7 @@ class CPyReaddirTest(NativeReaddirTest):
         skip = "cpython extension isn't available"
 
 
-class EnsureDirsTest(TempDirMixin):
+class EnsureDirsMixin(TempDirMixin):
 
     def check_dir(self, path, uid, gid, mode):
         self.assertTrue(os.path.isdir(path))
@@ -108,6 +152,8 @@ class EnsureDirsTest(TempDirMixin):
         self.assertEqual(st.st_gid, gid)
 
 
+class EnsureDirsTest(EnsureDirsMixin):
+
     def test_ensure_dirs(self):
         # default settings
         path = pjoin(self.dir, 'foo', 'bar')
@@ -162,6 +208,77 @@ class EnsureDirsTest(TempDirMixin):
         self.check_dir(path, os.geteuid(), os.getegid(), 0777)
 
 
+class EnsureDirsManyTest(EnsureDirsMixin):
+
+    def test_ensure_dirs_many(self):
+        paths = [pjoin(self.dir, 'a', 'b', 'c'), pjoin(self.dir, 'a-b'),
+            pjoin(self.dir, 'a'), pjoin(self.dir, 'a', 'b', 'd') + '/',
+            pjoin(self.dir, 'a', '..', 'a', 'b', 'c')]
+        self.assertEqual(osutils.ensure_dirs_many(paths, mode=0750), [])
+        for path in paths:
+            self.check_dir(path, os.geteuid(), os.getegid(), 0750)
+        self.check_dir(pjoin(self.dir, 'a', 'b'), os.geteuid(), os.getegid(),
+            0750)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a', 'a-b'])
+        # existing dirs get fixed up as ensure_dirs would.
+        self.assertEqual(osutils.ensure_dirs_many(paths[:2], mode=0005), [])
+        self.check_dir(paths[0], os.geteuid(), os.getegid(), 0755)
+        self.assertEqual(osutils.ensure_dirs_many(paths[:1], mode=0700,
+            minimal=False), [])
+        self.check_dir(paths[0], os.geteuid(), os.getegid(), 0700)
+
+    def test_relative(self):
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            self.assertEqual(osutils.ensure_dirs_many(['x/y', 'z']), [])
+        finally:
+            os.chdir(cwd)
+        self.check_dir(pjoin(self.dir, 'x', 'y'), os.geteuid(), os.getegid(),
+            0777)
+        self.check_dir(pjoin(self.dir, 'z'), os.geteuid(), os.getegid(), 0777)
+
+    def test_failures(self):
+        self.write_file(pjoin(self.dir, 'file'), 'w', '')
+        paths = [pjoin(self.dir, 'file', 'x'), pjoin(self.dir, 'ok'),
+            pjoin(self.dir, 'file')]
+        self.assertEqual(sorted(osutils.ensure_dirs_many(paths)),
+            sorted(paths[::2]))
+        self.check_dir(paths[1], os.geteuid(), os.getegid(), 0777)
+
+    def test_unwritable(self):
+        r, x = pjoin(self.dir, 'r'), pjoin(self.dir, 'r', 'x')
+        paths = [pjoin(x, 'y'), pjoin(r, 'z')]
+        self.assertEqual(osutils.ensure_dirs_many(paths, mode=0020), [])
+        self.check_dir(r, os.geteuid(), os.getegid(), 0020)
+        os.chmod(r, 0700)
+        self.check_dir(x, os.geteuid(), os.getegid(), 0020)
+        self.check_dir(paths[1], os.geteuid(), os.getegid(), 0020)
+        # existing restricted parents are restored.
+        self.assertEqual(osutils.ensure_dirs_many([pjoin(x, 'w')],
+            mode=0755), [])
+        self.check_dir(x, os.geteuid(), os.getegid(), 0020)
+        os.chmod(x, 0700)
+        self.check_dir(paths[0], os.geteuid(), os.getegid(), 0020)
+        self.check_dir(pjoin(x, 'w'), os.geteuid(), os.getegid(), 0755)
+        for path in paths:
+            os.chmod(path, 0700)
+
+
+class EnsureDirsManyPathsTest(EnsureDirsManyTest):
+
+    # lacking *at support.
+
+    def setUp(self):
+        EnsureDirsManyTest.setUp(self)
+        self._openat = osutils._openat
+        osutils._openat = None
+
+    def tearDown(self):
+        osutils._openat = self._openat
+        EnsureDirsManyTest.tearDown(self)
+
+
 class SymlinkTest(TempDirMixin):
 
     def test_abssymlink(self):
@@ -280,6 +397,212 @@ class FsLockTest(TempDirMixin):
         fcntl.flock(f, fcntl.LOCK_UN | fcntl.LOCK_NB)
         f.close()
 
+    def locked(self, path, flags=fcntl.LOCK_EX):
+        # whether another open of the file can't get the lock.
+        f = open(path)
+        try:
+            fcntl.flock(f, flags | fcntl.LOCK_NB)
+        except IOError:
+            return True
+        finally:
+            f.close()
+        return False
+
+    def test_shared_fd(self):
+        path = pjoin(self.dir, 'lockfile')
+        locks = [osutils.FsLock(path, True) for x in range(3)]
+        self.assertEqual(locks[0].fd, None)
+        for lock in locks:
+            self.assertTrue(lock.acquire_read_lock(False))
+        self.assertEqual(len(set(x.fd for x in locks)), 1)
+        self.assertTrue(self.locked(path))
+        self.assertFalse(self.locked(path, fcntl.LOCK_SH))
+        # other holders block writers, even those in this process.
+        self.assertFalse(locks[0].acquire_write_lock(False))
+        for lock in locks[1:]:
+            lock.release_read_lock()
+        self.assertTrue(self.locked(path))
+        self.assertTrue(locks[0].acquire_write_lock(False))
+        self.assertFalse(locks[1].acquire_read_lock(False))
+        self.assertFalse(locks[1].acquire_write_lock(timeout=0.01))
+        self.assertTrue(self.locked(path, fcntl.LOCK_SH))
+        locks[0].release_write_lock()
+        self.assertFalse(self.locked(path))
+        fd = locks[0].fd
+        del lock, locks
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_timeout(self):
+        path = pjoin(self.dir, 'lockfile')
+        self.write_file(path, 'w', '')
+        lock = osutils.FsLock(path)
+        stats = lock.stats
+        self.assertEqual(stats.histogram, [0] * 6)
+        self.assertTrue(osutils.lock_stats()[os.path.abspath(path)] is stats)
+        f = open(path)
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self.assertFalse(lock.acquire_write_lock(False))
+            self.assertFalse(lock.acquire_read_lock(timeout=0.05))
+            self.assertEqual((stats.acquisitions, stats.failures,
+                stats.contended), (0, 2, 2))
+            self.assertTrue(stats.wait_max >= 0.05)
+            self.assertEqual(stats.histogram, [1, 0, 1, 0, 0, 0])
+            fcntl.flock(f, fcntl.LOCK_UN)
+            self.assertTrue(lock.acquire_write_lock(timeout=0.05))
+            self.assertEqual(stats.acquisitions, 1)
+            lock.release_write_lock()
+        finally:
+            f.close()
+
+    def test_failed_upgrade(self):
+        path = pjoin(self.dir, 'lockfile')
+        lock = osutils.FsLock(path, True)
+        self.assertTrue(lock.acquire_read_lock(False))
+        f = open(path)
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            self.assertFalse(lock.acquire_write_lock(False))
+            self.assertFalse(lock.acquire_write_lock(timeout=0.05))
+            fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            f.close()
+        # the read lock survived the failed conversions.
+        self.assertTrue(self.locked(path))
+        self.assertFalse(self.locked(path, fcntl.LOCK_SH))
+        lock.release_read_lock()
+        self.assertFalse(self.locked(path))
+
+    def test_upgrade_timeout(self):
+        path = pjoin(self.dir, 'lockfile')
+        lock = osutils.FsLock(path, True)
+        self.assertTrue(lock.acquire_read_lock(False))
+        f = open(path)
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            start = time.time()
+            self.assertFalse(lock.acquire_write_lock(timeout=0.1))
+            self.assertTrue(time.time() - start < 2)
+            # a writer elsewhere can't get in while we retry.
+            self.assertTrue(self.locked(path))
+            fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            f.close()
+        self.assertTrue(lock.acquire_write_lock(timeout=0.1))
+        lock.release_write_lock()
+
+    def test_local_upgrades(self):
+        import threading
+        path = pjoin(self.dir, 'lockfile')
+        locks = [osutils.FsLock(path, True) for x in range(2)]
+        for lock in locks:
+            self.assertTrue(lock.acquire_read_lock(False))
+        results = []
+        def f(lock):
+            results.append(lock.acquire_write_lock())
+        threads = [threading.Thread(target=f, args=(lock,)) for lock in locks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.isAlive())
+        # neither waits on the other; both keep their read locks.
+        self.assertEqual(results, [False, False])
+        self.assertTrue(self.locked(path))
+        self.assertFalse(self.locked(path, fcntl.LOCK_SH))
+        locks[1].release_read_lock()
+        self.assertTrue(locks[0].acquire_write_lock())
+        self.assertTrue(self.locked(path, fcntl.LOCK_SH))
+        locks[0].release_write_lock()
+
+    def test_fork(self):
+        path = pjoin(self.dir, 'lockfile')
+        lock = osutils.FsLock(path, True)
+        self.assertTrue(lock.acquire_write_lock(False))
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # neither the inherited lock nor a new one share the
+                # parent's fd, thus they're excluded by it.
+                if not (osutils.FsLock(path).acquire_write_lock(False) or
+                    lock.acquire_read_lock(False)):
+                    code = 0
+                del lock
+            finally:
+                os._exit(code)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        # the child dropping its copy didn't release ours.
+        self.assertTrue(self.locked(path, fcntl.LOCK_SH))
+        lock.release_write_lock()
+        self.assertFalse(self.locked(path))
+
+    def test_threads(self):
+        import threading
+        path = pjoin(self.dir, 'lockfile')
+        first, second = [osutils.FsLock(path, True) for x in range(2)]
+        self.assertTrue(first.acquire_write_lock())
+        acquired = []
+        def f():
+            acquired.append(second.acquire_write_lock())
+        thread = threading.Thread(target=f)
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual(acquired, [])
+        first.release_write_lock()
+        thread.join()
+        self.assertEqual(acquired, [True])
+        self.assertTrue(self.locked(path))
+        second.release_write_lock()
+        self.assertEqual(second.stats.contended, 1)
+
+    def test_async(self):
+        try:
+            import asyncio
+        except ImportError:
+            raise SkipTest("asyncio isn't available")
+        path = pjoin(self.dir, 'lockfile')
+        self.write_file(path, 'w', '')
+        lock = osutils.FsLock(path, timeout=0.05)
+        loop = asyncio.new_event_loop()
+        try:
+            f = open(path)
+            fcntl.flock(f, fcntl.LOCK_EX)
+            ticks = []
+            def tick():
+                ticks.append(True)
+                if len(ticks) < 10:
+                    loop.call_later(0.005, tick)
+            loop.call_soon(tick)
+            self.assertFalse(loop.run_until_complete(asyncio.ensure_future(
+                lock.acquire_write_lock_async(timeout=0.05), loop=loop)))
+            # the loop kept running while we waited.
+            self.assertTrue(len(ticks) > 1)
+            # what async with does; the special methods are looked up on
+            # the type.
+            kls = type(lock)
+            self.assertRaises(osutils.GenericFailed, loop.run_until_complete,
+                asyncio.ensure_future(kls.__aenter__(lock), loop=loop))
+            lock.timeout = 5
+            loop.call_later(0.02, f.close)
+            self.assertEqual(loop.run_until_complete(asyncio.ensure_future(
+                kls.__aenter__(lock), loop=loop)).path, path)
+            self.assertTrue(self.locked(path))
+            loop.run_until_complete(asyncio.ensure_future(
+                kls.__aexit__(lock, None, None, None), loop=loop))
+            self.assertFalse(self.locked(path))
+            # a failed upgrade keeps the read lock.
+            self.assertTrue(lock.acquire_read_lock(False))
+            f = open(path)
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            self.assertFalse(loop.run_until_complete(asyncio.ensure_future(
+                lock.acquire_write_lock_async(timeout=0.02), loop=loop)))
+            f.close()
+            self.assertTrue(self.locked(path))
+            lock.release_read_lock()
+        finally:
+            loop.close()
+
 
 class TestAccess(TempDirMixin):
 
@@ -314,6 +637,335 @@ class Test_unlink_if_exists(TempDirMixin):
         # and once more for good measure...
         f(path)
 
+
+class Test_fadvise(TempDirMixin):
+
+    def test_it(self):
+        path = pjoin(self.dir, 'target')
+        self.write_file(path, 'w', 'monkeys')
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            for advice in (osutils.POSIX_FADV_SEQUENTIAL,
+                osutils.POSIX_FADV_WILLNEED, osutils.POSIX_FADV_DONTNEED):
+                osutils.fadvise(fd, 0, 0, advice)
+                osutils.native_fadvise(fd, 0, 0, advice)
+            if osutils.fadvise_supported:
+                self.assertRaises(EnvironmentError, osutils.fadvise, fd, 0, 0,
+                    -1)
+        finally:
+            os.close(fd)
+        if osutils.fadvise_supported:
+            self.assertRaises(EnvironmentError, osutils.fadvise, fd, 0, 0,
+                osutils.POSIX_FADV_SEQUENTIAL)
+
+
+class Test_copy_data(TempDirMixin):
+
+    data = os.urandom(300000)
+
+    def _copy(self, methods, offset=0, length=None, dst_data=''):
+        src = pjoin(self.dir, 'src')
+        dst = pjoin(self.dir, 'dst')
+        self.write_file(src, 'wb', self.data)
+        self.write_file(dst, 'wb', dst_data)
+        src_fd = os.open(src, os.O_RDONLY)
+        dst_fd = os.open(dst, os.O_WRONLY)
+        try:
+            os.lseek(src_fd, offset, os.SEEK_SET)
+            os.lseek(dst_fd, len(dst_data), os.SEEK_SET)
+            copied, method = osutils.copy_data(src_fd, dst_fd, length,
+                methods=methods)
+            self.assertEqual(os.lseek(src_fd, 0, os.SEEK_CUR),
+                offset + copied)
+            self.assertEqual(os.lseek(dst_fd, 0, os.SEEK_CUR),
+                len(dst_data) + copied)
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+        f = open(dst, 'rb')
+        try:
+            return copied, method, f.read()
+        finally:
+            f.close()
+
+    def test_methods(self):
+        for method in osutils.copy_methods:
+            methods = (method, 'readwrite')
+            copied, used, data = self._copy(methods)
+            self.assertEqual(copied, len(self.data))
+            self.assertIn(used, methods)
+            self.assertEqual(data, self.data)
+
+            copied, used, data = self._copy(methods, offset=1000, length=5000,
+                dst_data='monkeys')
+            self.assertEqual(copied, 5000)
+            self.assertEqual(data, 'monkeys' + self.data[1000:6000])
+
+            copied, used, data = self._copy(methods, offset=len(self.data))
+            self.assertEqual((copied, data), (0, ''))
+
+    def test_pipe(self):
+        # neither end need be a regular file.
+        path = pjoin(self.dir, 'src')
+        self.write_file(path, 'wb', self.data[:1000])
+        src_fd = os.open(path, os.O_RDONLY)
+        r, w = os.pipe()
+        try:
+            self.assertEqual(osutils.copy_data(src_fd, w)[0], 1000)
+            os.close(w)
+            w = None
+            self.assertEqual(os.read(r, 2000), self.data[:1000])
+        finally:
+            for fd in (src_fd, r, w):
+                if fd is not None:
+                    os.close(fd)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, osutils.copy_data, 0, 1,
+            methods=('monkeys',))
+        path = pjoin(self.dir, 'src')
+        self.write_file(path, 'wb', self.data)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # nothing usable.
+            self.assertRaises(ValueError, osutils.copy_data, fd, fd,
+                methods=('reflink',))
+        finally:
+            os.close(fd)
+
+
+class WalkTest(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        for path in ('a/b', 'c'):
+            os.makedirs(pjoin(self.dir, path))
+        for path in ('f', 'a/g', 'a/b/h'):
+            self.write_file(pjoin(self.dir, path), 'w', '')
+        os.symlink('../c', pjoin(self.dir, 'a', 'lc'))
+        os.symlink('..', pjoin(self.dir, 'c', 'loop'))
+        os.symlink('missing', pjoin(self.dir, 'c', 'dangling'))
+
+    def entries(self, **kwds):
+        return sorted((dirpath[len(self.dir):], name, kind) for
+            dirpath, name, kind in osutils.iter_tree(self.dir, **kwds))
+
+    def test_iter_tree(self):
+        expected = [('', 'a', 'directory'), ('', 'c', 'directory'),
+            ('', 'f', 'file'), ('/a', 'b', 'directory'), ('/a', 'g', 'file'),
+            ('/a', 'lc', 'symlink'), ('/a/b', 'h', 'file'),
+            ('/c', 'dangling', 'symlink'), ('/c', 'loop', 'symlink')]
+        self.assertEqual(self.entries(), expected)
+        self.assertEqual(self.entries(workers=4), expected)
+        self.assertEqual(self.entries(prune=lambda x: x.endswith('/a')),
+            [x for x in expected if not x[0].startswith('/a')])
+        # every directory is only visited once, regardless of the links.
+        self.assertEqual(self.entries(follow_symlinks=True), expected)
+        self.assertEqual(self.entries(follow_symlinks=True, workers=3),
+            expected)
+
+    def test_follow_symlinks(self):
+        os.rename(pjoin(self.dir, 'c'), pjoin(self.dir, 'a', 'b', 'c'))
+        os.unlink(pjoin(self.dir, 'a', 'lc'))
+        os.symlink('b/c', pjoin(self.dir, 'a', 'lc'))
+        entries = self.entries(prune=lambda x: x.endswith('/b'),
+            follow_symlinks=True)
+        self.assertIn(('/a/lc', 'dangling', 'symlink'), entries)
+        self.assertNotIn(('/a/b/c', 'dangling', 'symlink'), entries)
+
+    def test_walk(self):
+        expected = sorted((dirpath, sorted(dirnames), sorted(filenames))
+            for dirpath, dirnames, filenames in os.walk(self.dir))
+        # os.walk treats symlinks to directories as directories.
+        for dirpath, dirnames, filenames in expected:
+            for name in dirnames[:]:
+                if os.path.islink(pjoin(dirpath, name)):
+                    dirnames.remove(name)
+                    filenames.append(name)
+            filenames.sort()
+        for workers in (1, 4):
+            self.assertEqual(sorted((dirpath, sorted(dirnames),
+                sorted(filenames)) for dirpath, dirnames, filenames in
+                osutils.walk(self.dir, workers=workers)), expected)
+
+        order = [x[0] for x in osutils.walk(self.dir, topdown=False)]
+        self.assertEqual(sorted(order), sorted(x[0] for x in expected))
+        self.assertTrue(order.index(pjoin(self.dir, 'a', 'b')) <
+            order.index(pjoin(self.dir, 'a')) < order.index(self.dir))
+        self.assertRaises(ValueError, list,
+            osutils.walk(self.dir, topdown=False, workers=2))
+
+        # pruning via dirnames.
+        seen = []
+        for dirpath, dirnames, filenames in osutils.walk(self.dir):
+            seen.append(dirpath)
+            if 'a' in dirnames:
+                dirnames.remove('a')
+        self.assertEqual(sorted(seen), [self.dir, pjoin(self.dir, 'c')])
+
+    def test_onerror(self):
+        errors = []
+        missing = pjoin(self.dir, 'missing')
+        self.assertEqual(list(osutils.iter_tree(missing)), [])
+        self.assertEqual(list(osutils.iter_tree(missing, workers=2,
+            onerror=errors.append)), [])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].errno, errno.ENOENT)
+
+
+class CachedDirectoryViewTest(TempDirMixin):
+
+    kwds = {}
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.view = osutils.CachedDirectoryView(**self.kwds)
+        os.mkdir(pjoin(self.dir, 'dir'))
+        self.write_file(pjoin(self.dir, 'file'), 'w', '')
+
+    def tearDown(self):
+        self.view.close()
+        TempDirMixin.tearDown(self)
+
+    def changed(self, path):
+        # the mtime fallback is only as precise as the filesystem's
+        # timestamps; ensure the change is visible to it.
+        os.utime(path, (0, 0))
+
+    def counters(self):
+        return (self.view.hits, self.view.misses, self.view.invalidations)
+
+    def test_caching(self):
+        view = self.view
+        self.assertEqual(sorted(view.listdir(self.dir)), ['dir', 'file'])
+        self.assertEqual(view.listdir_dirs(self.dir), ['dir'])
+        self.assertEqual(view.listdir_files(self.dir), ['file'])
+        self.assertEqual(sorted(view.readdir(self.dir)),
+            [('dir', 'directory'), ('file', 'file')])
+        self.assertEqual(self.counters(), (0, 4, 0))
+        l = view.listdir_files(self.dir)
+        l.append('monkeys')
+        self.assertEqual(view.listdir_files(self.dir), ['file'])
+        self.assertEqual(view.listdir_files(self.dir + '/'), ['file'])
+        self.assertEqual(self.counters(), (3, 4, 0))
+        # the symlink arg is part of the key.
+        self.assertEqual(view.listdir_files(self.dir, False), ['file'])
+        self.assertEqual(self.counters(), (3, 5, 0))
+        view.invalidate(self.dir)
+        view.listdir_files(self.dir)
+        self.assertEqual(self.counters(), (3, 6, 0))
+
+    def test_invalidation(self):
+        view = self.view
+        subdir = pjoin(self.dir, 'dir')
+        self.assertEqual(view.listdir_files(self.dir), ['file'])
+        self.assertEqual(view.listdir_files(subdir), [])
+
+        self.write_file(pjoin(self.dir, 'new'), 'w', '')
+        self.changed(self.dir)
+        self.assertEqual(sorted(view.listdir_files(self.dir)), ['file', 'new'])
+        self.assertEqual(view.listdir_files(subdir), [])
+        self.assertEqual(self.counters(), (1, 3, 1))
+
+        os.rename(pjoin(self.dir, 'new'), pjoin(subdir, 'moved'))
+        self.changed(self.dir)
+        self.changed(subdir)
+        self.assertEqual(view.listdir_files(self.dir), ['file'])
+        self.assertEqual(view.listdir_files(subdir), ['moved'])
+        self.assertEqual(self.counters(), (1, 5, 3))
+
+        os.unlink(pjoin(subdir, 'moved'))
+        os.rmdir(subdir)
+        self.assertRaises(OSError, view.listdir_files, subdir)
+        os.mkdir(subdir)
+        self.write_file(pjoin(subdir, 'recreated'), 'w', '')
+        self.assertEqual(view.listdir_files(subdir), ['recreated'])
+        self.write_file(pjoin(subdir, 'again'), 'w', '')
+        self.changed(subdir)
+        self.assertEqual(sorted(view.listdir_files(subdir)),
+            ['again', 'recreated'])
+
+    def test_missing(self):
+        self.assertRaises(OSError, self.view.listdir,
+            pjoin(self.dir, 'missing'))
+        self.assertRaises(OSError, self.view.listdir,
+            pjoin(self.dir, 'file'))
+
+
+class CachedDirectoryViewFallbackTest(CachedDirectoryViewTest):
+
+    kwds = {'use_inotify': False}
+
+    def test_watches(self):
+        self.view.listdir(self.dir)
+        self.assertEqual(self.view.watched, 0)
+
+
+class CachedDirectoryViewLimitTest(CachedDirectoryViewTest):
+
+    kwds = {'max_watches': 1}
+
+    def test_watches(self):
+        if not osutils._inotify.available():
+            raise SkipTest("inotify isn't available")
+        self.view.listdir(self.dir)
+        self.view.listdir(pjoin(self.dir, 'dir'))
+        self.assertEqual(self.view.watched, 1)
+
+
+class InotifyTest(TempDirMixin):
+
+    def test_read_events(self):
+        if not osutils._inotify.available():
+            raise SkipTest("inotify isn't available")
+        inotify = osutils._inotify.Inotify()
+        try:
+            wd = inotify.add_watch(self.dir, osutils._inotify.IN_CREATE)
+            self.assertEqual(inotify.read_events(), [])
+            self.write_file(pjoin(self.dir, 'new'), 'w', '')
+            self.assertEqual([(x[0], x[1], x[3])
+                for x in inotify.read_events()],
+                [(wd, osutils._inotify.IN_CREATE, 'new')])
+        finally:
+            inotify.close()
+
+
+class Test_benchmark(TempDirMixin):
+
+    def test_copy(self):
+        from snakeoil.osutils import benchmark
+        self.assertEqual(benchmark.parse_size('4G'), 4 << 30)
+        self.assertEqual(benchmark.parse_size('64KiB'), 64 << 10)
+        self.assertEqual(benchmark.parse_size('100'), 100)
+        self.assertRaises(ValueError, benchmark.parse_size, 'monkeys')
+        path = pjoin(self.dir, 'src')
+        self.write_file(path, 'wb', os.urandom(5000))
+        results = benchmark.bench_copy([path], repeat=1, sync=True)
+        modes = [x['mode'] for x in results]
+        self.assertIn('readwrite', modes)
+        self.assertIn('transfer_between_files', modes)
+        self.assertEqual(os.listdir(self.dir), ['src'])
+        self.assertRaises(ValueError, benchmark.run, ['monkeys'])
+
+    def test_walk(self):
+        from snakeoil.osutils import benchmark
+        self.assertEqual(benchmark.mk_tree(self.dir, 100, fanout=3, files=5),
+            100)
+        results = benchmark.bench_walk(self.dir, workers=(1, 2), repeat=1)
+        self.assertEqual([(x['mode'], x['workers']) for x in results],
+            [('os.walk', 1), ('walk', 1), ('walk', 2), ('iter_tree', 1),
+            ('iter_tree', 2)])
+        self.assertEqual(set(x['entries'] for x in results), set([100]))
+
+    def test_mkdirs(self):
+        from snakeoil.osutils import benchmark
+        paths = benchmark.mk_dir_paths(self.dir, 100)
+        self.assertEqual(len(set(paths)), 100)
+        results = benchmark.bench_mkdirs(self.dir, 100, repeat=1)
+        self.assertEqual([(x['mode'], x['state']) for x in results],
+            [('ensure_dirs', 'create'), ('ensure_dirs', 'existing'),
+            ('ensure_dirs_many', 'create'), ('ensure_dirs_many', 'existing')])
+
 cpy_readdir_loaded_Test = mk_cpy_loadable_testcase("snakeoil.osutils._readdir",
     "snakeoil.osutils", "listdir", "listdir")
 cpy_posix_loaded_Test = mk_cpy_loadable_testcase("snakeoil._posix",
@@ -0,0 +1,57 @@
+# License: GPL2/BSD
+
+import threading
+import time
+
+from snakeoil.test import TestCase
+from snakeoil.threads import threaded_map
+
+
+class Test_threaded_map(TestCase):
+
+    def test_ordered(self):
+        def f(x):
+            # finish the early items last.
+            time.sleep((20 - x) * 0.001)
+            return x * 2
+        for workers in (1, 2, 8):
+            self.assertEqual(list(threaded_map(f, xrange(20), workers=workers)),
+                [x * 2 for x in xrange(20)])
+
+    def test_unordered(self):
+        self.assertEqual(
+            sorted(threaded_map(lambda x: x * 2, xrange(50), workers=4,
+                ordered=False)),
+            [x * 2 for x in xrange(50)])
+
+    def test_threads_used(self):
+        seen = set()
+        def f(x):
+            seen.add(threading.currentThread())
+            time.sleep(0.01)
+        list(threaded_map(f, xrange(8), workers=4))
+        self.assertTrue(threading.currentThread() not in seen)
+        self.assertTrue(len(seen) > 1)
+
+    def test_lazy(self):
+        consumed = []
+        def source():
+            for x in xrange(1000):
+                consumed.append(x)
+                yield x
+        results = threaded_map(lambda x: x, source(), workers=2, backlog=2)
+        self.assertEqual(results.next(), 0)
+        self.assertTrue(len(consumed) <= 5, msg=repr(consumed))
+        results.close()
+
+    def test_exceptions(self):
+        def f(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        results = threaded_map(f, xrange(10), workers=2)
+        self.assertEqual([results.next() for x in xrange(3)], [0, 1, 2])
+        self.assertRaises(ValueError, results.next)
+        self.assertRaises(ValueError, list, threaded_map(f, xrange(10),
+            workers=3, ordered=False))
+        self.assertRaises(ValueError, threaded_map, f, (), workers=0)
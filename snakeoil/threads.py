@@ -0,0 +1,116 @@
+# License: GPL2/BSD
+
+"""
+thread pool helpers
+
+Primarily intended for work that drops the GIL (hashing, compression, IO);
+for pure python work threads buy nothing.
+"""
+
+__all__ = ("threaded_map",)
+
+import sys
+import threading
+import Queue
+
+from snakeoil.demandload import demandload
+demandload(globals(),
+    'snakeoil.process:get_proc_count',
+)
+
+
+def _worker(jobs, results, functor):
+    jget, rput = jobs.get, results.put
+    job = jget()
+    while job is not None:
+        index, item = job
+        try:
+            rput((index, True, functor(item)))
+        except Exception:
+            rput((index, False, sys.exc_info()))
+        job = jget()
+
+
+def threaded_map(functor, iterable, workers=None, ordered=True, backlog=2):
+    """
+    lazily map `functor` over `iterable` via a pool of threads
+
+    Items are pulled from `iterable` only as workers free up, so this is
+    safe to use against huge (or infinite) iterables.
+
+    If `functor` throws an exception, it's reraised in the consumer when that
+    result would have been yielded; remaining work is abandoned.
+
+    :param functor: callable taking a single argument
+    :param iterable: items to feed to `functor`
+    :param workers: number of threads to use; defaults to the number of
+        processors available.  If 1, no threads are used.
+    :param ordered: if True, results are yielded in the same order as
+        `iterable`; if False, they're yielded as they complete.
+    :param backlog: per worker, how many items may be queued or awaiting
+        consumption before we stop pulling from `iterable`.
+    :return: generator yielding the results of `functor`
+    """
+    if workers is None:
+        workers = get_proc_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be positive, got %r" % (workers,))
+    if workers == 1:
+        return (functor(x) for x in iterable)
+    return _threaded_map(functor, iterable, workers, ordered,
+        workers * max(backlog, 1))
+
+
+def _threaded_map(functor, iterable, workers, ordered, limit):
+    jobs, results = Queue.Queue(), Queue.Queue()
+    threads = [threading.Thread(target=_worker, args=(jobs, results, functor))
+        for x in xrange(workers)]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+
+    iterable = enumerate(iterable)
+    finished = {}
+    next_index = 0
+    pending = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and pending < limit:
+                try:
+                    job = iterable.next()
+                except StopIteration:
+                    exhausted = True
+                    break
+                jobs.put(job)
+                pending += 1
+
+            if not pending:
+                break
+
+            index, success, val = results.get()
+            if ordered:
+                finished[index] = (success, val)
+                while next_index in finished:
+                    success, val = finished.pop(next_index)
+                    next_index += 1
+                    pending -= 1
+                    if not success:
+                        raise val[0], val[1], val[2]
+                    yield val
+            else:
+                pending -= 1
+                if not success:
+                    raise val[0], val[1], val[2]
+                yield val
+    finally:
+        # abandon anything not yet started, and shut the pool down.
+        try:
+            while True:
+                jobs.get_nowait()
+        except Queue.Empty:
+            pass
+        for thread in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
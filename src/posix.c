@@ -19,6 +19,11 @@
 #include <dirent.h>
 #include <sys/stat.h>
 #include <fcntl.h>
+#ifdef __linux__
+#include <sys/sendfile.h>
+#include <sys/syscall.h>
+#include <unistd.h>
+#endif
 
 // we get MAXPATHLEN from python.
 #include <osdefs.h>
@@ -798,6 +803,117 @@ snakeoil_closerange(PyObject *self, PyObject *args)
 }
 
 
+#ifdef POSIX_FADV_NORMAL
+static PyObject *
+snakeoil_fadvise(PyObject *self, PyObject *args)
+{
+	int fd, advice, ret;
+	PY_LONG_LONG offset, len;
+
+	if (!PyArg_ParseTuple(args, "iLLi:fadvise", &fd, &offset, &len, &advice))
+		return NULL;
+
+	// WILLNEED can block on the request queue; don't hold the GIL for it.
+	Py_BEGIN_ALLOW_THREADS
+	ret = posix_fadvise(fd, (off_t)offset, (off_t)len, advice);
+	Py_END_ALLOW_THREADS
+
+	if (ret) {
+		// note posix_fadvise returns the errno rather than setting it.
+		errno = ret;
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	Py_RETURN_NONE;
+}
+#endif
+
+#ifdef __linux__
+static PyObject *
+snakeoil_sendfile(PyObject *self, PyObject *args)
+{
+	int out_fd, in_fd;
+	PY_LONG_LONG offset;
+	Py_ssize_t count, ret;
+	off_t off;
+
+	if (!PyArg_ParseTuple(args, "iiLn:sendfile", &out_fd, &in_fd, &offset,
+		&count))
+		return NULL;
+
+	off = (off_t)offset;
+	Py_BEGIN_ALLOW_THREADS
+	ret = sendfile(out_fd, in_fd, &off, (size_t)count);
+	Py_END_ALLOW_THREADS
+
+	if (ret < 0)
+		return PyErr_SetFromErrno(PyExc_OSError);
+	return PyInt_FromSsize_t(ret);
+}
+#endif
+
+#ifdef __NR_copy_file_range
+static PyObject *
+snakeoil_copy_file_range(PyObject *self, PyObject *args)
+{
+	int src_fd, dst_fd;
+	Py_ssize_t count, ret;
+
+	if (!PyArg_ParseTuple(args, "iin:copy_file_range", &src_fd, &dst_fd,
+		&count))
+		return NULL;
+
+	// glibc only grew a wrapper in 2.27; go via syscall.  Offsets are the
+	// fds' own, which the kernel advances.
+	Py_BEGIN_ALLOW_THREADS
+	ret = syscall(__NR_copy_file_range, src_fd, NULL, dst_fd, NULL,
+		(size_t)count, 0);
+	Py_END_ALLOW_THREADS
+
+	if (ret < 0)
+		return PyErr_SetFromErrno(PyExc_OSError);
+	return PyInt_FromSsize_t(ret);
+}
+#endif
+
+#ifdef AT_FDCWD
+static PyObject *
+snakeoil_mkdirat(PyObject *self, PyObject *args)
+{
+	int dir_fd, mode = 0777, ret;
+	char *path;
+
+	if (!PyArg_ParseTuple(args, "is|i:mkdirat", &dir_fd, &path, &mode))
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	ret = mkdirat(dir_fd, path, (mode_t)mode);
+	Py_END_ALLOW_THREADS
+
+	if (ret < 0)
+		return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+snakeoil_openat(PyObject *self, PyObject *args)
+{
+	int dir_fd, flags, mode = 0777, fd;
+	char *path;
+
+	if (!PyArg_ParseTuple(args, "isi|i:openat", &dir_fd, &path, &flags,
+		&mode))
+		return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	fd = openat(dir_fd, path, flags | O_CLOEXEC, (mode_t)mode);
+	Py_END_ALLOW_THREADS
+
+	if (fd < 0)
+		return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+	return PyInt_FromLong(fd);
+}
+#endif
+
 static PyMethodDef snakeoil_posix_methods[] = {
 	{"normpath", (PyCFunction)snakeoil_normpath, METH_O,
 		"normalize a path entry"},
@@ -808,6 +924,27 @@ static PyMethodDef snakeoil_posix_methods[] = {
 		"indicating whether to swallow ENOENT; defaults to false"},
 	{"closerange", (PyCFunction)snakeoil_closerange, METH_VARARGS,
 		"close a range of fds"},
+#ifdef POSIX_FADV_NORMAL
+	{"fadvise", (PyCFunction)snakeoil_fadvise, METH_VARARGS,
+		"posix_fadvise(fd, offset, len, advice); see os.posix_fadvise"},
+#endif
+#ifdef __linux__
+	{"sendfile", (PyCFunction)snakeoil_sendfile, METH_VARARGS,
+		"sendfile(out_fd, in_fd, offset, count); see os.sendfile"},
+#endif
+#ifdef __NR_copy_file_range
+	{"copy_file_range", (PyCFunction)snakeoil_copy_file_range, METH_VARARGS,
+		"copy_file_range(src_fd, dst_fd, count); copies from and advances "
+		"each fd's offset, returning the bytes copied"},
+#endif
+#ifdef AT_FDCWD
+	{"mkdirat", (PyCFunction)snakeoil_mkdirat, METH_VARARGS,
+		"mkdirat(dir_fd, path, mode=0777); create a directory relative to "
+		"dir_fd"},
+	{"openat", (PyCFunction)snakeoil_openat, METH_VARARGS,
+		"openat(dir_fd, path, flags, mode=0777); open relative to dir_fd, "
+		"returning a close on exec fd"},
+#endif
 	{NULL}
 };
 
@@ -846,6 +983,24 @@ init_posix(void)
 			m, "readlines", (PyObject *)&snakeoil_readlines_type) == -1)
 		return;
 
+#ifdef POSIX_FADV_NORMAL
+	if (PyModule_AddIntConstant(m, "POSIX_FADV_NORMAL", POSIX_FADV_NORMAL) ||
+		PyModule_AddIntConstant(m, "POSIX_FADV_SEQUENTIAL",
+			POSIX_FADV_SEQUENTIAL) ||
+		PyModule_AddIntConstant(m, "POSIX_FADV_RANDOM", POSIX_FADV_RANDOM) ||
+		PyModule_AddIntConstant(m, "POSIX_FADV_NOREUSE", POSIX_FADV_NOREUSE) ||
+		PyModule_AddIntConstant(m, "POSIX_FADV_WILLNEED",
+			POSIX_FADV_WILLNEED) ||
+		PyModule_AddIntConstant(m, "POSIX_FADV_DONTNEED",
+			POSIX_FADV_DONTNEED))
+		return;
+#endif
+
+#ifdef O_PATH
+	if (PyModule_AddIntConstant(m, "O_PATH", O_PATH))
+		return;
+#endif
+
 	snakeoil_LOAD_SINGLE_ATTR(snakeoil_native_readlines_shim, "snakeoil._fileutils",
 		"_native_readlines_shim");
 	snakeoil_LOAD_SINGLE_ATTR(snakeoil_native_readfile_shim, "snakeoil._fileutils",
@@ -16,6 +16,7 @@
 #include "snakeoil/common.h"
 
 #include <dirent.h>
+#include <fcntl.h>
 #include <sys/stat.h>
 
 
@@ -200,27 +201,46 @@ snakeoil_readdir_listdir(PyObject* self, PyObject* args)
 	return result;
 }
 
-static PyObject*
-snakeoil_readdir_read_dir(PyObject* self, PyObject* args)
-{
-	char *path;
+/* An entry gathered by snakeoil_scan_dir; kind is the S_IFMT bits. */
+typedef struct {
+	char *name;
+	mode_t kind;
+} snakeoil_dirent;
 
-	if (!PyArg_ParseTuple(args, "s", &path)) {
-		return NULL;
+static void
+snakeoil_free_dirents(snakeoil_dirent *entries, Py_ssize_t count)
+{
+	Py_ssize_t i;
+	for (i = 0; i < count; i++) {
+		free(entries[i].name);
 	}
-	ssize_t pathlen = strlen(path);
+	free(entries);
+}
 
-	PyObject *result = PyList_New(0);
+/* Read a directory's entries and their types, without touching any python
+ * objects so that it can run with the GIL released.  Returns 0 or an errno;
+ * on success the caller owns *entries.
+ */
+static int
+snakeoil_scan_dir(const char *path, snakeoil_dirent **entries,
+	Py_ssize_t *count)
+{
+	Py_ssize_t allocated = 64, used = 0;
+	snakeoil_dirent *result = malloc(sizeof(snakeoil_dirent) * allocated);
 	if (!result) {
-		return NULL;
+		return ENOMEM;
 	}
 
 	DIR *the_dir = opendir(path);
 	if (!the_dir) {
-		return PyErr_SetFromErrno(PyExc_OSError);
+		int err = errno;
+		free(result);
+		return err;
 	}
 
+	int err = 0;
 	struct dirent *entry;
+	errno = 0;
 	while ((entry = readdir(the_dir))) {
 		const char *name = entry->d_name;
 		/* skip over "." and ".." */
@@ -229,107 +249,306 @@ snakeoil_readdir_read_dir(PyObject* self, PyObject* args)
 			continue;
 		}
 
-		PyObject *typestr;
+		mode_t kind;
 		switch (entry->d_type) {
-			case DT_REG:
-				typestr = snakeoil_REGSTR;
-				break;
-			case DT_DIR:
-				typestr = snakeoil_DIRSTR;
-				break;
-			case DT_FIFO:
-				typestr = snakeoil_FIFOSTR;
-				break;
-			case DT_SOCK:
-				typestr = snakeoil_SOCKSTR;
-				break;
-			case DT_CHR:
-				typestr = snakeoil_CHRSTR;
-				break;
-			case DT_BLK:
-				typestr = snakeoil_BLKSTR;
-				break;
-			case DT_LNK:
-				typestr = snakeoil_LNKSTR;
-				break;
+			case DT_REG: kind = S_IFREG; break;
+			case DT_DIR: kind = S_IFDIR; break;
+			case DT_FIFO: kind = S_IFIFO; break;
+			case DT_SOCK: kind = S_IFSOCK; break;
+			case DT_CHR: kind = S_IFCHR; break;
+			case DT_BLK: kind = S_IFBLK; break;
+			case DT_LNK: kind = S_IFLNK; break;
 			case DT_UNKNOWN:
 			{
-				/* both path components, the "/", the trailing null */
-				size_t size = pathlen + strlen(name) + 2;
-				char *buffer = (char *) malloc(size);
-				if (!buffer) {
-					closedir(the_dir);
-					return PyErr_NoMemory();
-				}
-				snprintf(buffer, size, "%s/%s", path, name);
+				/* the filesystem doesn't fill d_type; stat it. */
 				struct stat st;
-				int ret = lstat(buffer, &st);
-				free(buffer);
+				int ret = fstatat(dirfd(the_dir), name, &st,
+					AT_SYMLINK_NOFOLLOW);
 				if (ret == -1) {
-					closedir(the_dir);
-					return PyErr_SetFromErrno(PyExc_OSError);
-				}
-				switch (st.st_mode & S_IFMT) {
-					case S_IFDIR:
-						typestr = snakeoil_DIRSTR;
-						break;
-					case S_IFCHR:
-						typestr = snakeoil_CHRSTR;
-						break;
-					case S_IFBLK:
-						typestr = snakeoil_BLKSTR;
-						break;
-					case S_IFREG:
-						typestr = snakeoil_REGSTR;
-						break;
-					case S_IFLNK:
-						typestr = snakeoil_LNKSTR;
-						break;
-					case S_IFSOCK:
-						typestr = snakeoil_SOCKSTR;
-						break;
-					case S_IFIFO:
-						typestr = snakeoil_FIFOSTR;
-						break;
-					default:
-						/* XXX does this make sense? probably not. */
-						typestr = snakeoil_UNKNOWNSTR;
+					if (errno == ENOENT) {
+						/* removed since the readdir; skip it. */
+						errno = 0;
+						continue;
+					}
+					err = errno;
+					goto finished;
 				}
+				kind = st.st_mode & S_IFMT;
 			}
 			break;
+			default:
+				kind = 0;
+		}
+
+		if (used == allocated) {
+			allocated *= 2;
+			snakeoil_dirent *tmp = realloc(result,
+				sizeof(snakeoil_dirent) * allocated);
+			if (!tmp) {
+				err = ENOMEM;
+				goto finished;
+			}
+			result = tmp;
+		}
+		if (!(result[used].name = strdup(name))) {
+			err = ENOMEM;
+			goto finished;
+		}
+		result[used].kind = kind;
+		used++;
+		errno = 0;
+	}
+	err = errno;
 
+finished:
+	if (closedir(the_dir) == -1 && !err) {
+		err = errno;
+	}
+	if (err) {
+		snakeoil_free_dirents(result, used);
+		return err;
+	}
+	*entries = result;
+	*count = used;
+	return 0;
+}
+
+static PyObject*
+snakeoil_readdir_read_dir(PyObject* self, PyObject* args)
+{
+	char *path;
+	snakeoil_dirent *entries = NULL;
+	Py_ssize_t count = 0, i;
+	int err;
+
+	if (!PyArg_ParseTuple(args, "s", &path)) {
+		return NULL;
+	}
+
+	/* the IO is done without the GIL, so threads can scan in parallel. */
+	Py_BEGIN_ALLOW_THREADS
+	err = snakeoil_scan_dir(path, &entries, &count);
+	Py_END_ALLOW_THREADS
+
+	if (err) {
+		errno = err;
+		return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+	}
+
+	PyObject *result = PyList_New(count);
+	if (!result) {
+		snakeoil_free_dirents(entries, count);
+		return NULL;
+	}
+
+	for (i = 0; i < count; i++) {
+		PyObject *typestr;
+		switch (entries[i].kind) {
+			case S_IFDIR: typestr = snakeoil_DIRSTR; break;
+			case S_IFCHR: typestr = snakeoil_CHRSTR; break;
+			case S_IFBLK: typestr = snakeoil_BLKSTR; break;
+			case S_IFREG: typestr = snakeoil_REGSTR; break;
+			case S_IFLNK: typestr = snakeoil_LNKSTR; break;
+			case S_IFSOCK: typestr = snakeoil_SOCKSTR; break;
+			case S_IFIFO: typestr = snakeoil_FIFOSTR; break;
 			default:
 				/* XXX does this make sense? probably not. */
 				typestr = snakeoil_UNKNOWNSTR;
 		}
 
-		PyObject *namestr = PyString_FromString(name);
+		PyObject *namestr = PyString_FromString(entries[i].name);
 		if (!namestr) {
-			Py_DECREF(result);
-			result = NULL;
+			Py_CLEAR(result);
 			break;
 		}
-		/* Slight hack: incref typestr after our error checks. */
 		PyObject *tuple = PyTuple_Pack(2, namestr, typestr);
 		Py_DECREF(namestr);
 		if (!tuple) {
-			Py_DECREF(result);
-			result = NULL;
+			Py_CLEAR(result);
 			break;
 		}
-		Py_INCREF(typestr);
+		PyList_SET_ITEM(result, i, tuple);
+	}
+	snakeoil_free_dirents(entries, count);
+	return result;
+}
 
-		int res = PyList_Append(result, tuple);
-		Py_DECREF(tuple);
-		if (res == -1) {
-			Py_DECREF(result);
-			result = NULL;
-			break;
+/* A record of snakeoil_stat_dir; packed, matching
+ * snakeoil.osutils.native_readdir.DirStats.record.
+ */
+#define SNAKEOIL_STAT_RECORD_SIZE (8 + 8 + 8 + 4)
+
+static void
+snakeoil_pack_stat(char *record, struct stat *st)
+{
+	unsigned PY_LONG_LONG ino = st->st_ino;
+	PY_LONG_LONG size = st->st_size;
+	PY_LONG_LONG mtime_ns = (PY_LONG_LONG)st->st_mtime * 1000000000;
+	unsigned int mode = st->st_mode;
+#ifdef __APPLE__
+	mtime_ns += st->st_mtimespec.tv_nsec;
+#else
+	mtime_ns += st->st_mtim.tv_nsec;
+#endif
+	memcpy(record, &ino, 8);
+	memcpy(record + 8, &size, 8);
+	memcpy(record + 16, &mtime_ns, 8);
+	memcpy(record + 24, &mode, 4);
+}
+
+/* Read a directory's entries, stat'ing each relative to the directory's fd.
+ * Like snakeoil_scan_dir this runs with the GIL released; returns 0 or an
+ * errno, on success the caller owns *names and *records.
+ */
+static int
+snakeoil_stat_dir(const char *path, int follow_symlinks, char ***names,
+	char **records, Py_ssize_t *count)
+{
+	Py_ssize_t allocated = 64, used = 0;
+	char **result_names = malloc(sizeof(char *) * allocated);
+	char *result_records = malloc(SNAKEOIL_STAT_RECORD_SIZE * allocated);
+	if (!result_names || !result_records) {
+		free(result_names);
+		free(result_records);
+		return ENOMEM;
+	}
+
+	DIR *the_dir = opendir(path);
+	if (!the_dir) {
+		int err = errno;
+		free(result_names);
+		free(result_records);
+		return err;
+	}
+
+	int err = 0, fd = dirfd(the_dir);
+	int flags = follow_symlinks ? 0 : AT_SYMLINK_NOFOLLOW;
+	struct dirent *entry;
+	errno = 0;
+	while ((entry = readdir(the_dir))) {
+		const char *name = entry->d_name;
+		/* skip over "." and ".." */
+		if (name[0] == '.' && (name[1] == 0 ||
+			(name[1] == '.' && name[2] == 0))) {
+			continue;
+		}
+
+		struct stat st;
+		if (fstatat(fd, name, &st, flags) == -1) {
+			/* a dangling symlink is reported as the symlink itself. */
+			if (!(follow_symlinks && errno == ENOENT &&
+				fstatat(fd, name, &st, AT_SYMLINK_NOFOLLOW) == 0)) {
+				if (errno == ENOENT) {
+					/* removed since the readdir; skip it. */
+					errno = 0;
+					continue;
+				}
+				err = errno;
+				goto finished;
+			}
+		}
+
+		if (used == allocated) {
+			allocated *= 2;
+			char **tmp_names = realloc(result_names,
+				sizeof(char *) * allocated);
+			if (!tmp_names) {
+				err = ENOMEM;
+				goto finished;
+			}
+			result_names = tmp_names;
+			char *tmp_records = realloc(result_records,
+				SNAKEOIL_STAT_RECORD_SIZE * allocated);
+			if (!tmp_records) {
+				err = ENOMEM;
+				goto finished;
+			}
+			result_records = tmp_records;
 		}
+		if (!(result_names[used] = strdup(name))) {
+			err = ENOMEM;
+			goto finished;
+		}
+		snakeoil_pack_stat(result_records + used * SNAKEOIL_STAT_RECORD_SIZE,
+			&st);
+		used++;
+		errno = 0;
 	}
-	if (closedir(the_dir) == -1) {
-		return PyErr_SetFromErrno(PyExc_OSError);
+	err = errno;
+
+finished:
+	if (closedir(the_dir) == -1 && !err) {
+		err = errno;
+	}
+	if (err) {
+		Py_ssize_t i;
+		for (i = 0; i < used; i++) {
+			free(result_names[i]);
+		}
+		free(result_names);
+		free(result_records);
+		return err;
+	}
+	*names = result_names;
+	*records = result_records;
+	*count = used;
+	return 0;
+}
+
+static PyObject*
+snakeoil_readdir_stat_dir(PyObject* self, PyObject* args)
+{
+	char *path;
+	PyObject *follow_symlinks_obj = Py_False;
+	char **names = NULL, *records = NULL;
+	Py_ssize_t count = 0, i;
+	int err;
+
+	if (!PyArg_ParseTuple(args, "s|O", &path, &follow_symlinks_obj)) {
+		return NULL;
+	}
+
+	int follow_symlinks = PyObject_IsTrue(follow_symlinks_obj);
+	if (follow_symlinks == -1) {
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	err = snakeoil_stat_dir(path, follow_symlinks, &names, &records, &count);
+	Py_END_ALLOW_THREADS
+
+	if (err) {
+		errno = err;
+		return PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+	}
+
+	PyObject *result = NULL, *records_str = NULL;
+	PyObject *names_list = PyList_New(count);
+	if (names_list) {
+		for (i = 0; i < count; i++) {
+			PyObject *namestr = PyString_FromString(names[i]);
+			if (!namestr) {
+				Py_CLEAR(names_list);
+				break;
+			}
+			PyList_SET_ITEM(names_list, i, namestr);
+		}
+	}
+	if (names_list) {
+		records_str = PyString_FromStringAndSize(records,
+			count * SNAKEOIL_STAT_RECORD_SIZE);
+		if (records_str) {
+			result = PyTuple_Pack(2, names_list, records_str);
+			Py_DECREF(records_str);
+		}
+		Py_DECREF(names_list);
+	}
+
+	for (i = 0; i < count; i++) {
+		free(names[i]);
 	}
+	free(names);
+	free(records);
 	return result;
 }
 
@@ -344,6 +563,8 @@ static PyMethodDef snakeoil_readdir_methods[] = {
 	 "listdir_files(path, followSymlinks=True)"},
 	{"readdir", (PyCFunction)snakeoil_readdir_read_dir, METH_VARARGS,
 	 "read_dir(path)"},
+	{"stat_dir", (PyCFunction)snakeoil_readdir_stat_dir, METH_VARARGS,
+	 "stat_dir(path, follow_symlinks=False)"},
 	{NULL}
 };
 